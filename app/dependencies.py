@@ -1,11 +1,16 @@
 """app dependencies"""
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from sqlalchemy import text
+
 from app.settings import SETTINGS
 
 from fastapi import HTTPException, Security
 from fastapi.security.api_key import APIKeyHeader
 from starlette.status import HTTP_403_FORBIDDEN
 from app.settings import SETTINGS
-from app.repository.database import AsyncSessionLocal
+from app.repository.database import AsyncSessionLocal, PipelineSessionLocal
 
 import logging
 logger = logging.getLogger(__name__)
@@ -34,7 +39,48 @@ async def get_db():
             await session.close()
 
 async def get_independent_db_session():
-    """Get an independent database session for background tasks"""
+    """Get an independent database session for background tasks, from the pipeline pool"""
+    async with PipelineSessionLocal() as session:
+        return session
+
+async def get_api_db_session():
+    """Get an independent database session for reads outside a request dependency, e.g. streaming"""
     async with AsyncSessionLocal() as session:
         return session
 
+@asynccontextmanager
+async def leader_lock(name: str) -> AsyncIterator[bool]:
+    """Hold a named lock shared by all workers, yields whether it was acquired
+
+    Uses MySQL GET_LOCK without waiting, other databases always acquire it.
+    """
+    db = await get_independent_db_session()
+    try:
+        connection = await db.connection()
+        use_lock = connection.dialect.name == "mysql"
+        if use_lock:
+            acquired = (await db.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": name})).scalar()
+            if not acquired:
+                yield False
+                return
+        try:
+            yield True
+        finally:
+            if use_lock:
+                await db.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": name})
+    finally:
+        await db.close()
+
+
+def get_s3_client():
+    """Get an S3 client, use as `async with get_s3_client() as s3_client`"""
+    import aioboto3  # pylint: disable=import-outside-toplevel
+
+    secret_key = SETTINGS.AWS_SECRET_ACCESS_KEY
+    return aioboto3.Session().client(
+        "s3",
+        endpoint_url=SETTINGS.AWS_S3_ENDPOINT_URL,
+        region_name=SETTINGS.AWS_REGION_NAME,
+        aws_access_key_id=SETTINGS.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=secret_key.get_secret_value() if secret_key else None,
+    )
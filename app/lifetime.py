@@ -6,10 +6,21 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import os
 from app.settings import SETTINGS
+from app.repository.database import dispose_engines, engine, warm_up_pool
+from app.util.http_client import init_http_client, close_http_client
+from app.util.loop_monitor import loop_monitor
+from app.service.i2v_service import check_minimax_callback_settings
+from app.service.task_events import task_event_bus
+from app.service.task_reconciler import TaskReconciler
+from app.service.task_status_cache import task_status_cache
+from app.utils.image_utils import init_image_process_pool, shutdown_image_process_pool
+from app.utils.storage import storage
 # from app.service.tts_service import init_voice_ids
 
 logger = logging.getLogger(__name__)
 
+task_reconciler = TaskReconciler()
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -19,13 +30,36 @@ async def lifespan(app: FastAPI):
     await shutdown()
 
 
-async def startup():
-    """Actions to run on app startup."""
-    logger.info("App is starting up.")
+def export_provider_env():
+    """Expose the Azure credentials to litellm"""
     os.environ["AZURE_API_KEY"] = SETTINGS.AZURE_API_KEY.get_secret_value()
     os.environ["AZURE_API_BASE"] = SETTINGS.AZURE_API_BASE
     os.environ["AZURE_API_VERSION"] = SETTINGS.AZURE_API_VERSION
 
+
+async def startup():
+    """Actions to run on app startup."""
+    logger.info("App is starting up.")
+    check_minimax_callback_settings()
+    loop_monitor.start()
+    export_provider_env()
+    if SETTINGS.DB_POOL_WARMUP:
+        await warm_up_pool(engine, SETTINGS.DB_API_POOL_SIZE)
+    await init_http_client()
+    await storage.start()
+    init_image_process_pool(SETTINGS.IMAGE_PROCESS_POOL_SIZE)
+    await task_event_bus.start()
+    if SETTINGS.RECONCILER_ENABLED:
+        task_reconciler.start()
+
 async def shutdown():
     """Actions to run on app's shutdown."""
     logger.info("App is shutting down.")
+    await task_reconciler.stop()
+    await task_event_bus.stop()
+    await task_status_cache.close()
+    await close_http_client()
+    await storage.close()
+    shutdown_image_process_pool()
+    await dispose_engines()
+    await loop_monitor.stop()
@@ -3,13 +3,16 @@ import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.routing import APIRouter
+from prometheus_client import REGISTRY
 from prometheus_fastapi_instrumentator import Instrumentator
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 
 from app.exception_handlers import register_exception_handlers
 from app.lifetime import lifespan
-from app.router import status_router, video_router, resource_router
+from app.router import status_router, video_router, resource_router, event_router
 from app.app_logging import configure_logging
+from app.util.http_client import HttpClientPoolCollector
+from app.repository.database import DbPoolCollector
 
 configure_logging()
 logger = logging.getLogger(__name__)
@@ -32,6 +35,7 @@ api_router = APIRouter()
 api_router.include_router(video_router.router)
 api_router.include_router(status_router.router)
 api_router.include_router(resource_router.router)
+api_router.include_router(event_router.router)
 
 app.include_router(router=api_router)
 
@@ -40,6 +44,8 @@ register_exception_handlers(app)
 
 instrumentator = Instrumentator()
 instrumentator.instrument(app).expose(app, endpoint="/admin/metrics")
+REGISTRY.register(HttpClientPoolCollector())
+REGISTRY.register(DbPoolCollector())
 FastAPIInstrumentor.instrument_app(
     app, excluded_urls="^/$|^/ws$|/admin/metrics$|/admin/openapi.json|/ws websocket receive"
 )
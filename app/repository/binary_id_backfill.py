@@ -0,0 +1,67 @@
+"""
+Copies the CHAR(32) ids into their BINARY(16) shadow columns
+
+Runs between the migrations d5f27a8c3b14 and e2a94b7c6d05 while the service keeps
+serving: rows are updated in small batches, each in its own transaction, so no
+long lock is held on the tables. Safe to stop and run again.
+
+    python -m app.repository.binary_id_backfill --batch-size 2000 --pause 0.2
+"""
+import argparse
+import asyncio
+import logging
+
+from sqlalchemy import text
+
+from app.dependencies import get_independent_db_session
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_STATEMENTS = {
+    "i2v_task.id": "UPDATE i2v_task SET id_bin = UNHEX(id) WHERE id_bin IS NULL LIMIT :limit",
+    "i2v_job.id": "UPDATE i2v_job SET id_bin = UNHEX(id) WHERE id_bin IS NULL LIMIT :limit",
+    "i2v_job.task_id": "UPDATE i2v_job SET task_id_bin = UNHEX(task_id) WHERE task_id_bin IS NULL LIMIT :limit",
+    "i2v_prompt_cache.id": "UPDATE i2v_prompt_cache SET id_bin = UNHEX(id) WHERE id_bin IS NULL LIMIT :limit",
+}
+
+
+async def backfill_column(column: str, batch_size: int, pause: float) -> int:
+    """backfill one column
+
+    Returns:
+        int: number of updated rows
+    """
+    statement = text(BACKFILL_STATEMENTS[column])
+    total = 0
+    db = await get_independent_db_session()
+    try:
+        while True:
+            result = await db.execute(statement, {"limit": batch_size})
+            await db.commit()
+            if not result.rowcount:
+                break
+            total += result.rowcount
+            logger.info("backfill %s, updated: %d", column, total)
+            # 给线上流量让出 IO
+            await asyncio.sleep(pause)
+    finally:
+        await db.close()
+    return total
+
+
+async def main(batch_size: int, pause: float):
+    """backfill all columns"""
+    for column in BACKFILL_STATEMENTS:
+        total = await backfill_column(column, batch_size, pause)
+        logger.info("backfill %s done, updated: %d", column, total)
+
+
+if __name__ == "__main__":
+    from app.app_logging import configure_logging  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--pause", type=float, default=0.2, help="seconds between batches")
+    args = parser.parse_args()
+    configure_logging()
+    asyncio.run(main(args.batch_size, args.pause))
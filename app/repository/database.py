@@ -1,6 +1,7 @@
 """
 Module for mysql database connection
 """
+import asyncio
 import logging
 import time
 import uuid
@@ -11,22 +12,65 @@ from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 from sqlalchemy import BigInteger, Boolean, Column, Date
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy_utils import UUIDType
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncConnection, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from pydantic import BaseModel as PydanticBaseModel
+from prometheus_client import Histogram
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
 
-DB_USER = os.getenv("DB_USER", "videosnap")
-DB_PASS = os.getenv("DB_PASS", "videosnap")
-DB_HOST = os.getenv("DB_HOST", "mysql")
-DB_PORT = os.getenv("DB_PORT", "3306")
-DB_NAME = os.getenv("DB_NAME", "videosnap")
+from app.settings import SETTINGS
 
-ASYNC_DATABASE_URL = f"mysql+aiomysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}?charset=utf8mb4"
+logger = logging.getLogger(__name__)
 
-engine = create_async_engine(
-    ASYNC_DATABASE_URL,
-    echo=False,
-    pool_recycle=3600
+ASYNC_DATABASE_URL = (
+    f"mysql+aiomysql://{SETTINGS.DB_USER}:{SETTINGS.DB_PASS.get_secret_value()}"
+    f"@{SETTINGS.DB_HOST}:{SETTINGS.DB_PORT}/{SETTINGS.DB_NAME}?charset=utf8mb4"
+)
+
+API_POOL = "api"
+PIPELINE_POOL = "pipeline"
+
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the database pool",
+    ["pool"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool recording how long checkouts wait, labeled by the pool logging name"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.labels(self._orig_logging_name).observe(time.perf_counter() - start)
+
+
+def create_pooled_engine(role: str, pool_size: int, max_overflow: int) -> AsyncEngine:
+    """async engine with its own connection pool"""
+    return create_async_engine(
+        ASYNC_DATABASE_URL,
+        echo=False,
+        poolclass=InstrumentedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=SETTINGS.DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=SETTINGS.DB_POOL_RECYCLE_SECONDS,
+        pool_pre_ping=SETTINGS.DB_POOL_PRE_PING,
+        pool_logging_name=role,
+    )
+
+
+# request handlers, status reads and streaming
+engine = create_pooled_engine(API_POOL, SETTINGS.DB_API_POOL_SIZE, SETTINGS.DB_API_MAX_OVERFLOW)
+# pipeline, worker and reconciler writes
+pipeline_engine = create_pooled_engine(
+    PIPELINE_POOL, SETTINGS.DB_PIPELINE_POOL_SIZE, SETTINGS.DB_PIPELINE_MAX_OVERFLOW
 )
 
 AsyncSessionLocal = sessionmaker(
@@ -35,8 +79,83 @@ AsyncSessionLocal = sessionmaker(
     expire_on_commit=False
 )
 
+PipelineSessionLocal = sessionmaker(
+    pipeline_engine,
+    class_=AsyncSession,
+    expire_on_commit=False
+)
+
+
+async def warm_up_pool(async_engine: AsyncEngine, connections: int) -> int:
+    """open pool connections ahead of the first requests
+
+    Failures are logged, the pool then connects lazily as before.
+
+    Returns:
+        int: number of connections opened
+    """
+    results = await asyncio.gather(
+        *(async_engine.connect() for _ in range(connections)), return_exceptions=True
+    )
+    opened = [conn for conn in results if isinstance(conn, AsyncConnection)]
+    for conn in opened:
+        # back into the pool, kept open for the next checkout
+        await conn.close()
+    errors = [error for error in results if isinstance(error, BaseException)]
+    if errors:
+        logger.error("db pool warm up failure: %s", errors[0])
+    logger.info("db pool %s warmed up, connections: %d", async_engine.sync_engine.pool.logging_name, len(opened))
+    return len(opened)
+
+
+async def dispose_engines() -> None:
+    """close all pooled connections"""
+    await engine.dispose()
+    await pipeline_engine.dispose()
+
+
+class DbPoolCollector(Collector):
+    """Prometheus collector exposing usage of the database connection pools"""
+
+    def collect(self):
+        size = GaugeMetricFamily("db_pool_size", "Persistent connections of the database pool", labels=["pool"])
+        in_use = GaugeMetricFamily(
+            "db_pool_connections_in_use", "Connections checked out of the database pool", labels=["pool"]
+        )
+        idle = GaugeMetricFamily(
+            "db_pool_connections_idle", "Connections idling in the database pool", labels=["pool"]
+        )
+        overflow = GaugeMetricFamily(
+            "db_pool_overflow", "Connections opened beyond the pool size", labels=["pool"]
+        )
+        for role, async_engine in ((API_POOL, engine), (PIPELINE_POOL, pipeline_engine)):
+            pool = async_engine.sync_engine.pool
+            size.add_metric([role], pool.size())
+            in_use.add_metric([role], pool.checkedout())
+            idle.add_metric([role], pool.checkedin())
+            # negative until the pool itself is full
+            overflow.add_metric([role], max(pool.overflow(), 0))
+        yield size
+        yield in_use
+        yield idle
+        yield overflow
+
 Base = declarative_base()
 
+
+def uuid7() -> uuid.UUID:
+    """Time ordered UUID with the version 7 layout of RFC 9562
+
+    The first 48 bits are the unix time in milliseconds, the rest is random, so new
+    primary keys are appended at the end of the clustered index instead of being
+    scattered over it like uuid4.
+    """
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), "big")
+    value = value & ~(0xF << 76) | 0x7 << 76  # version
+    value = value & ~(0x3 << 62) | 0x2 << 62  # variant
+    return uuid.UUID(int=value)
+
+
 class TimestampMixin(object):
     """Mixin for timestamp columns"""
 
@@ -57,4 +176,5 @@ class BaseMixin(TimestampMixin, Base):
     """Base mixin for all models"""
 
     __abstract__ = True
-    id = Column(UUIDType(binary=False), primary_key=True, default=uuid.uuid4)  # type: ignore
+    # BINARY(16) time ordered key, the API still returns the string form
+    id = Column(UUIDType(binary=True), primary_key=True, default=uuid7)  # type: ignore
@@ -0,0 +1,137 @@
+"""
+Create/Remove/Update/Delete database operations
+"""
+import logging
+import time
+from typing import Optional
+from uuid import UUID
+
+from sqlalchemy import and_, asc, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.repository.i2v_job_model import I2vJob
+from app.schema.i2v_job_schema import JobStatus
+
+logger = logging.getLogger(__name__)
+
+async def enqueue_i2v_job(
+    db: AsyncSession,
+    task_id: UUID,
+    commit: bool = True
+) -> I2vJob:
+    """
+    queue the pipeline job of a task
+    """
+    job = I2vJob(
+        task_id=task_id,
+        status=JobStatus.QUEUED,
+        attempts=0,
+        available_at=int(time.time() * 1000)
+    )
+    db.add(job)
+    if not commit:
+        await db.flush()
+        return job
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+async def claim_i2v_jobs(
+    db: AsyncSession,
+    worker_id: str,
+    limit: int,
+    lease_ms: int
+) -> list[I2vJob]:
+    """
+    claim up to limit runnable jobs for a worker
+
+    Queued jobs that are due and running jobs whose lease expired, e.g. because the
+    worker died, are locked with FOR UPDATE SKIP LOCKED so concurrent workers never
+    claim the same job.
+    """
+    now = int(time.time() * 1000)
+    result = await db.execute(
+        select(I2vJob)
+        .filter(or_(
+            and_(I2vJob.status == JobStatus.QUEUED, I2vJob.available_at <= now),
+            and_(I2vJob.status == JobStatus.RUNNING, I2vJob.locked_at < now - lease_ms)
+        ))
+        .order_by(asc(I2vJob.available_at))
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    jobs = list(result.scalars().all())
+    for job in jobs:
+        if job.status == JobStatus.RUNNING:
+            logger.warning("reclaim job with expired lease, jid: %s, owner: %s", job.id, job.locked_by)
+        job.status = JobStatus.RUNNING
+        job.locked_by = worker_id
+        job.locked_at = now
+        job.attempts += 1
+    await db.commit()
+    return jobs
+
+async def renew_i2v_job_lease(
+    db: AsyncSession,
+    job_id: UUID,
+    worker_id: str
+) -> bool:
+    """
+    extend the lease of a running job, only while the worker still holds it
+    """
+    result = await db.execute(
+        update(I2vJob)
+        .where(I2vJob.id == job_id, I2vJob.locked_by == worker_id, I2vJob.status == JobStatus.RUNNING)
+        .values(locked_at=int(time.time() * 1000))
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+async def complete_i2v_job(
+    db: AsyncSession,
+    job_id: UUID,
+    worker_id: str
+) -> bool:
+    """
+    mark a job done, only while the worker still holds it
+    """
+    result = await db.execute(
+        update(I2vJob)
+        .where(I2vJob.id == job_id, I2vJob.locked_by == worker_id, I2vJob.status == JobStatus.RUNNING)
+        .values(status=JobStatus.DONE, locked_by=None, locked_at=None, updated_at=int(time.time() * 1000))
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+async def fail_i2v_job(
+    db: AsyncSession,
+    job_id: UUID,
+    worker_id: str,
+    error: str,
+    retry_at: Optional[int] = None,
+    count_attempt: bool = True
+) -> bool:
+    """
+    release a failed job, queued again at retry_at or failed for good without it
+
+    Without count_attempt the claim is not counted against the job's attempts, e.g.
+    when the provider was unavailable and the job never really ran.
+    """
+    values = {
+        "status": JobStatus.QUEUED if retry_at is not None else JobStatus.FAILED,
+        "locked_by": None,
+        "locked_at": None,
+        "last_error": error,
+        "updated_at": int(time.time() * 1000),
+    }
+    if retry_at is not None:
+        values["available_at"] = retry_at
+    if not count_attempt:
+        values["attempts"] = I2vJob.attempts - 1
+    result = await db.execute(
+        update(I2vJob)
+        .where(I2vJob.id == job_id, I2vJob.locked_by == worker_id, I2vJob.status == JobStatus.RUNNING)
+        .values(**values)
+    )
+    await db.commit()
+    return result.rowcount == 1
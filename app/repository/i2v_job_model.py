@@ -0,0 +1,29 @@
+"""
+Module to model mapping database tables
+"""
+from sqlalchemy import BigInteger, Column, Index, Integer, String, Text
+from sqlalchemy import Enum as SQLAlchemyEnum
+from sqlalchemy_utils import UUIDType
+
+from app.repository.database import BaseMixin
+from app.schema.i2v_job_schema import JobStatus
+
+class I2vJob(BaseMixin):
+    """Queued pipeline run of an i2v task, executed by the worker process"""
+
+    __tablename__ = "i2v_job"
+    __table_args__ = (
+        Index("ix_i2v_job_status_available_at", "status", "available_at"),
+    )
+    task_id = Column(UUIDType(binary=True), nullable=False, unique=True)
+    status: "Column[JobStatus]" = Column(
+        SQLAlchemyEnum(JobStatus, native_enum=False),
+        default=JobStatus.QUEUED,
+        nullable=False
+    )
+    attempts = Column(Integer, default=0, nullable=False)
+    # epoch millis, the job is not claimed before this time
+    available_at = Column(BigInteger, nullable=False)
+    locked_by = Column(String(length=128), nullable=True)
+    locked_at = Column(BigInteger, nullable=True)
+    last_error = Column(Text, nullable=True)
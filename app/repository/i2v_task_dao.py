@@ -3,16 +3,17 @@ Create/Remove/Update/Delete database operations
 """
 import logging
 import random
+import time
 from typing import Optional
 from typing import Any
 from uuid import UUID
 
-from sqlalchemy import asc, desc, select
+from sqlalchemy import and_, asc, desc, or_, select, update
 from sqlalchemy.orm import Session
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.repository.i2v_task_model import I2vTask
-from app.schema.i2v_task_schema import I2vType, VideoGenerationProvider
+from app.schema.i2v_task_schema import I2vType, TaskStatus, VideoGenerationProvider
 
 logger = logging.getLogger(__name__)
 
@@ -20,15 +21,51 @@ async def create_i2v_task(
     db: AsyncSession,
     source_image_filename: str,
     video_provider: VideoGenerationProvider,
-    i2v_type: I2vType
+    i2v_type: I2vType,
+    content_hash: Optional[str] = None,
+    commit: bool = True
 ) -> I2vTask:
     """
     create i2v task
+
+    With commit=False the row is only flushed, so the caller can add more writes
+    to the same transaction.
     """
     task = I2vTask(
         source_image_filename=source_image_filename,
         video_generation_provider=video_provider,
-        i2v_type=i2v_type
+        i2v_type=i2v_type,
+        content_hash=content_hash
+    )
+    db.add(task)
+    if not commit:
+        await db.flush()
+        return task
+    await db.commit()
+    await db.refresh(task)
+    return task
+
+async def clone_completed_i2v_task(
+    db: AsyncSession,
+    source: I2vTask,
+    source_image_filename: str
+) -> I2vTask:
+    """
+    create an already completed i2v task reusing the result of another task
+    """
+    task = I2vTask(
+        source_image_filename=source_image_filename,
+        content_hash=source.content_hash,
+        status=TaskStatus.TASK_COMPLETED,
+        i2v_type=source.i2v_type,
+        video_generation_provider=source.video_generation_provider,
+        video_generation_prompt=source.video_generation_prompt,
+        video_generation_id=source.video_generation_id,
+        output_video_filename=source.output_video_filename,
+        output_video_size=source.output_video_size,
+        output_video_sha256=source.output_video_sha256,
+        poster_image_filename=source.poster_image_filename,
+        preview_video_filename=source.preview_video_filename
     )
     db.add(task)
     await db.commit()
@@ -54,6 +91,64 @@ async def update_i2v_task(
         await db.refresh(task)
     return task
 
+def _status_list(expected_status: TaskStatus | list[TaskStatus]) -> list[TaskStatus]:
+    """expected status argument as a list"""
+    if isinstance(expected_status, TaskStatus):
+        return [expected_status]
+    return list(expected_status)
+
+async def transition_i2v_task(
+    db: AsyncSession,
+    task_id: UUID,
+    update_data: dict[str, Any],
+    expected_status: Optional[TaskStatus | list[TaskStatus]] = None,
+    commit: bool = True
+) -> int:
+    """
+    update i2v task in a single UPDATE, without loading it
+
+    With expected_status the row only changes while the task is in one of those
+    statuses, so concurrent writers can't overwrite a newer transition.
+
+    Returns:
+        int: number of updated rows, 0 if the task is missing or in another status
+    """
+    return await bulk_transition_i2v_tasks(db, [task_id], update_data, expected_status, commit)
+
+async def bulk_transition_i2v_tasks(
+    db: AsyncSession,
+    task_ids: list[UUID],
+    update_data: dict[str, Any],
+    expected_status: Optional[TaskStatus | list[TaskStatus]] = None,
+    commit: bool = True,
+    updated_before: Optional[int] = None
+) -> int:
+    """
+    update many i2v tasks in one UPDATE, see transition_i2v_task
+
+    With updated_before only tasks that didn't change since then (ms) are updated.
+
+    Returns:
+        int: number of updated rows
+    """
+    if not task_ids:
+        return 0
+    values = {"updated_at": int(time.time() * 1000), **update_data}
+    if len(task_ids) == 1:
+        query = update(I2vTask).where(I2vTask.id == task_ids[0])
+    else:
+        query = update(I2vTask).where(I2vTask.id.in_(task_ids))
+    if expected_status is not None:
+        query = query.where(I2vTask.status.in_(_status_list(expected_status)))
+    if updated_before is not None:
+        query = query.where(I2vTask.updated_at < updated_before)
+    result = await db.execute(
+        query.values(**values).execution_options(synchronize_session=False)
+    )
+    if commit:
+        await db.commit()
+    return result.rowcount
+
 async def get_i2v_task_by_id(
     db: AsyncSession,
     task_id: UUID
@@ -64,4 +159,264 @@ async def get_i2v_task_by_id(
     result = await db.execute(
         select(I2vTask).filter(I2vTask.id == task_id)
     )
-    return result.scalar_one_or_none()
\ No newline at end of file
+    return result.scalar_one_or_none()
+
+async def get_i2v_task_by_video_generation_id(
+    db: AsyncSession,
+    video_generation_id: str
+) -> I2vTask | None:
+    """
+    get i2v task by the provider's generation id
+    """
+    result = await db.execute(
+        select(I2vTask)
+        .filter(I2vTask.video_generation_id == video_generation_id)
+        .order_by(desc(I2vTask.created_at))
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+async def get_i2v_tasks_created_between(
+    db: AsyncSession,
+    created_from: int,
+    created_to: int,
+    limit: int
+) -> list[I2vTask]:
+    """
+    get i2v tasks created in [created_from, created_to) ms, newest first
+
+    Served by ix_i2v_task_created_at.
+    """
+    result = await db.execute(
+        select(I2vTask)
+        .filter(I2vTask.created_at >= created_from, I2vTask.created_at < created_to)
+        .order_by(desc(I2vTask.created_at))
+        .limit(limit)
+    )
+    return list(result.scalars().all())
+
+async def get_i2v_tasks_by_ids(
+    db: AsyncSession,
+    task_ids: list[UUID]
+) -> list[I2vTask]:
+    """
+    get i2v tasks in one query
+    """
+    if not task_ids:
+        return []
+    result = await db.execute(
+        select(I2vTask).filter(I2vTask.id.in_(task_ids))
+    )
+    return list(result.scalars().all())
+
+async def get_i2v_tasks_by_status(
+    db: AsyncSession,
+    status: TaskStatus,
+    limit: int,
+    after: Optional[tuple[int, UUID]] = None,
+    updated_before: Optional[int] = None,
+    with_source_image: bool = False
+) -> list[I2vTask]:
+    """
+    get one batch of i2v tasks in a status, ordered by (updated_at, id)
+
+    Pass the (updated_at, id) of the last task of the previous batch as `after`
+    to continue with the next batch. With updated_before only tasks that didn't
+    change since then (ms) are returned, with with_source_image only tasks whose
+    source image wasn't evicted. One status at a time so the rows are read in
+    order from ix_i2v_task_status_updated_at, without sorting them.
+    """
+    query = select(I2vTask).filter(I2vTask.status == status)
+    if updated_before is not None:
+        query = query.filter(I2vTask.updated_at < updated_before)
+    if with_source_image:
+        query = query.filter(I2vTask.source_image_evicted_at.is_(None))
+    if after is not None:
+        updated_at, task_id = after
+        query = query.filter(
+            # the first condition bounds the index range, the second skips the seen ids
+            I2vTask.updated_at >= updated_at,
+            or_(
+                I2vTask.updated_at > updated_at,
+                and_(I2vTask.updated_at == updated_at, I2vTask.id > task_id)
+            )
+        )
+    query = query.order_by(asc(I2vTask.updated_at), asc(I2vTask.id)).limit(limit)
+    result = await db.execute(query)
+    return list(result.scalars().all())
+
+async def claim_i2v_task_finalization(
+    db: AsyncSession,
+    task_id: UUID,
+    lease_ms: int
+) -> bool:
+    """
+    claim the right to finalize a task, across workers
+
+    A single conditional UPDATE moves the task from TASK_SUBMITTED to TASK_FINALIZING.
+    A claim whose holder died can be taken over once it is older than lease_ms.
+
+    Returns:
+        bool: True if this caller owns the finalization
+    """
+    now = int(time.time() * 1000)
+    result = await db.execute(
+        update(I2vTask)
+        .where(
+            I2vTask.id == task_id,
+            or_(
+                I2vTask.status == TaskStatus.TASK_SUBMITTED,
+                and_(
+                    I2vTask.status == TaskStatus.TASK_FINALIZING,
+                    I2vTask.updated_at < now - lease_ms
+                )
+            )
+        )
+        .values(status=TaskStatus.TASK_FINALIZING, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+async def find_reusable_i2v_task(
+    db: AsyncSession,
+    content_hash: str,
+    i2v_type: I2vType,
+    video_provider: VideoGenerationProvider,
+    in_flight_since: int
+) -> I2vTask | None:
+    """
+    find a task for the same content whose result can be shared
+
+    A completed task with an output video is preferred, otherwise the newest task
+    still in flight that was created after in_flight_since (ms).
+    """
+    is_completed = and_(
+        I2vTask.status == TaskStatus.TASK_COMPLETED,
+        I2vTask.output_video_filename.is_not(None)
+    )
+    is_in_flight = and_(
+        I2vTask.status.in_([
+            TaskStatus.IDLE,
+            TaskStatus.PROMPT_GENERATED,
+            TaskStatus.TASK_SUBMITTING,
+            TaskStatus.TASK_SUBMITTED,
+            TaskStatus.TASK_FINALIZING
+        ]),
+        I2vTask.created_at >= in_flight_since
+    )
+    result = await db.execute(
+        select(I2vTask)
+        .filter(
+            I2vTask.content_hash == content_hash,
+            I2vTask.i2v_type == i2v_type,
+            I2vTask.video_generation_provider == video_provider.value,
+            or_(is_completed, is_in_flight)
+        )
+        .order_by(desc(I2vTask.status == TaskStatus.TASK_COMPLETED), desc(I2vTask.created_at))
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+async def get_i2v_tasks_by_source_image_filename(
+    db: AsyncSession,
+    filename: str
+) -> list[I2vTask]:
+    """
+    get the i2v tasks created from a stored image, served by ix_i2v_task_source_image_filename
+    """
+    result = await db.execute(
+        select(I2vTask).filter(I2vTask.source_image_filename == filename)
+    )
+    return list(result.scalars().all())
+
+async def get_i2v_tasks_by_output_video_filename(
+    db: AsyncSession,
+    filename: str
+) -> list[I2vTask]:
+    """
+    get the i2v tasks sharing a stored video, served by ix_i2v_task_output_video_filename
+    """
+    result = await db.execute(
+        select(I2vTask).filter(I2vTask.output_video_filename == filename)
+    )
+    return list(result.scalars().all())
+
+async def mark_source_image_evicted(
+    db: AsyncSession,
+    filename: str,
+    statuses: list[TaskStatus],
+    evicted_at: int
+) -> int:
+    """
+    record that a source image was deleted, on the tasks in the given statuses
+
+    Returns:
+        int: number of updated rows
+    """
+    result = await db.execute(
+        update(I2vTask)
+        .where(
+            I2vTask.source_image_filename == filename,
+            I2vTask.status.in_(statuses),
+            I2vTask.source_image_evicted_at.is_(None)
+        )
+        .values(source_image_evicted_at=evicted_at, updated_at=evicted_at)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount
+
+async def mark_output_video_evicted(
+    db: AsyncSession,
+    filename: str,
+    evicted_at: int
+) -> int:
+    """
+    clear a deleted output video and its derivatives from every task sharing it
+
+    The filename is matched rather than task ids, so a task that started sharing
+    the video meanwhile is cleared as well.
+
+    Returns:
+        int: number of updated rows
+    """
+    result = await db.execute(
+        update(I2vTask)
+        .where(I2vTask.output_video_filename == filename)
+        .values(
+            output_video_filename=None,
+            poster_image_filename=None,
+            preview_video_filename=None,
+            output_video_evicted_at=evicted_at,
+            updated_at=evicted_at
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount
+
+async def rename_i2v_task_files(
+    db: AsyncSession,
+    old_filename: str,
+    new_filename: str
+) -> int:
+    """
+    point the tasks referencing a moved file to its new filename
+
+    updated_at is kept, the file content didn't change.
+
+    Returns:
+        int: number of updated rows
+    """
+    updated = 0
+    for column in (I2vTask.source_image_filename, I2vTask.output_video_filename):
+        result = await db.execute(
+            update(I2vTask)
+            .where(column == old_filename)
+            .values({column: new_filename})
+            .execution_options(synchronize_session=False)
+        )
+        updated += result.rowcount
+    await db.commit()
+    return updated
@@ -22,7 +22,17 @@ class I2vTask(BaseMixin):
     """Image to Video conversion task"""
 
     __tablename__ = "i2v_task"
+    __table_args__ = (
+        Index("ix_i2v_task_content_hash_i2v_type", "content_hash", "i2v_type"),
+        Index("ix_i2v_task_video_generation_id", "video_generation_id"),
+        # id breaks ties of the (updated_at, id) order the scans page by
+        Index("ix_i2v_task_status_updated_at", "status", "updated_at", "id"),
+        Index("ix_i2v_task_created_at", "created_at"),
+        Index("ix_i2v_task_source_image_filename", "source_image_filename"),
+        Index("ix_i2v_task_output_video_filename", "output_video_filename"),
+    )
     source_image_filename = Column(String(length=255), nullable=False)
+    content_hash = Column(String(length=64), nullable=True)
     status: "Column[TaskStatus]" = Column(
         SQLAlchemyEnum(TaskStatus, native_enum=False),
         default=TaskStatus.IDLE,
@@ -34,5 +44,13 @@ class I2vTask(BaseMixin):
     )
     video_generation_provider = Column(Text, nullable=False)
     video_generation_prompt = Column(Text, nullable=True)
-    video_generation_id =  Column(Text, nullable=True)
+    video_generation_id = Column(String(length=64), nullable=True)
     output_video_filename = Column(String(length=255), nullable=True)
+    output_video_size = Column(BigInteger, nullable=True)
+    output_video_sha256 = Column(String(length=64), nullable=True)
+    # derivatives of the output video, set when VIDEO_DERIVATIVES_ENABLED
+    poster_image_filename = Column(String(length=255), nullable=True)
+    preview_video_filename = Column(String(length=255), nullable=True)
+    # ms, set when the asset lifecycle deleted the file
+    source_image_evicted_at = Column(BigInteger, nullable=True)
+    output_video_evicted_at = Column(BigInteger, nullable=True)
@@ -0,0 +1,50 @@
+"""
+Create/Remove/Update/Delete database operations
+"""
+import logging
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.repository.prompt_cache_model import I2vPromptCache
+from app.schema.i2v_task_schema import I2vType
+
+logger = logging.getLogger(__name__)
+
+async def get_prompt_by_cache_key(
+    db: AsyncSession,
+    cache_key: str
+) -> Optional[str]:
+    """
+    get cached prompt
+    """
+    result = await db.execute(
+        select(I2vPromptCache.prompt).filter(I2vPromptCache.cache_key == cache_key)
+    )
+    return result.scalar_one_or_none()
+
+async def save_prompt(
+    db: AsyncSession,
+    cache_key: str,
+    image_sha256: str,
+    i2v_type: I2vType,
+    template_version: int,
+    prompt: str
+) -> None:
+    """
+    save generated prompt, a concurrent insert of the same key wins
+    """
+    db.add(I2vPromptCache(
+        cache_key=cache_key,
+        image_sha256=image_sha256,
+        i2v_type=i2v_type,
+        template_version=template_version,
+        prompt=prompt
+    ))
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        logger.info("prompt cache key already stored: %s", cache_key)
@@ -0,0 +1,21 @@
+"""
+Module to model mapping database tables
+"""
+from sqlalchemy import Column, Integer, String, Text
+from sqlalchemy import Enum as SQLAlchemyEnum
+
+from app.repository.database import BaseMixin
+from app.schema.i2v_task_schema import I2vType
+
+class I2vPromptCache(BaseMixin):
+    """Generated vision prompt, keyed by image content and prompt template"""
+
+    __tablename__ = "i2v_prompt_cache"
+    cache_key = Column(String(length=128), nullable=False, unique=True)
+    image_sha256 = Column(String(length=64), nullable=False)
+    i2v_type: "Column[I2vType]" = Column(
+        SQLAlchemyEnum(I2vType, native_enum=False),
+        nullable=False
+    )
+    template_version = Column(Integer, nullable=False)
+    prompt = Column(Text, nullable=False)
@@ -0,0 +1,145 @@
+"""Streaming task status, server-sent events and WebSocket"""
+import asyncio
+import logging
+from typing import AsyncIterator, List
+from uuid import UUID
+
+import orjson
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from starlette.responses import StreamingResponse
+from starlette.status import HTTP_400_BAD_REQUEST
+
+from app.dependencies import get_api_db_session
+from app.repository import i2v_task_dao
+from app.service.task_events import (
+    is_terminal_event,
+    task_event,
+    task_event_bus,
+)
+from app.settings import SETTINGS
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+def _parse_task_ids(task_ids: List[str]) -> List[str]:
+    """normalized task ids, invalid ones are skipped"""
+    parsed = []
+    for task_id in task_ids:
+        try:
+            parsed.append(str(UUID(task_id)))
+        except (TypeError, ValueError):
+            logger.warning("invalid task id, tid: %s", task_id)
+    return list(dict.fromkeys(parsed))
+
+
+async def _snapshot(task_ids: List[str]) -> List[dict]:
+    """current state of the tasks"""
+    db = await get_api_db_session()
+    try:
+        tasks = await i2v_task_dao.get_i2v_tasks_by_ids(db, [UUID(task_id) for task_id in task_ids])
+    finally:
+        await db.close()
+    return [task_event(task) for task in tasks]
+
+
+@router.get("/i2v/events")
+async def stream_i2v_task_events(request: Request, task_ids: List[str] = Query(...)):
+    """stream task status as server-sent events
+
+    Sends the current state of every task, then each transition. The stream ends
+    once all tasks are completed or failed.
+    """
+    requested = _parse_task_ids(
+        [task_id for value in task_ids for task_id in value.split(",") if task_id]
+    )
+    if not requested or len(requested) > SETTINGS.TASK_EVENTS_MAX_TASK_IDS:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="invalid task_ids")
+
+    # 先订阅再读取当前状态, 避免漏掉中间的变化
+    subscription = task_event_bus.subscribe(requested)
+    try:
+        snapshot = await _snapshot(requested)
+    except Exception:
+        subscription.close()
+        raise
+
+    async def _events() -> AsyncIterator[bytes]:
+        try:
+            pending = set(requested)
+            for event in snapshot:
+                yield _sse(event)
+                if is_terminal_event(event):
+                    pending.discard(event["id"])
+            # unknown tasks never change
+            pending &= {event["id"] for event in snapshot}
+            task_event_bus.remove(subscription, set(requested) - pending)
+            while pending:
+                if await request.is_disconnected():
+                    break
+                event = await subscription.get(timeout=SETTINGS.TASK_EVENTS_HEARTBEAT_SECONDS)
+                if event is None:
+                    yield b": keep-alive\n\n"
+                    continue
+                yield _sse(event)
+                if is_terminal_event(event):
+                    pending.discard(event["id"])
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _sse(event: dict) -> bytes:
+    """format an event as a server-sent event"""
+    return b"event: task\ndata: " + orjson.dumps(event) + b"\n\n"
+
+
+@router.websocket("/ws")
+async def task_status_websocket(websocket: WebSocket):
+    """stream task status over a WebSocket
+
+    Clients send `{"action": "subscribe", "task_ids": [...]}` or `"unsubscribe"`,
+    and receive the current state of newly subscribed tasks followed by every
+    transition.
+    """
+    await websocket.accept()
+    subscription = task_event_bus.subscribe()
+
+    async def _receive() -> None:
+        while True:
+            message = await websocket.receive_json()
+            task_ids = _parse_task_ids(message.get("task_ids") or [])
+            if message.get("action") == "unsubscribe":
+                task_event_bus.remove(subscription, task_ids)
+                continue
+            task_ids = [task_id for task_id in task_ids if task_id not in subscription.task_ids]
+            room = SETTINGS.TASK_EVENTS_MAX_TASK_IDS - len(subscription.task_ids)
+            task_event_bus.add(subscription, task_ids[:max(room, 0)])
+            # 当前状态也通过同一队列发送, 只有一个协程写 websocket
+            for event in await _snapshot(task_ids[:max(room, 0)]):
+                subscription.put(event)
+
+    async def _send() -> None:
+        while True:
+            event = await subscription.get(timeout=SETTINGS.TASK_EVENTS_HEARTBEAT_SECONDS)
+            if event is None:
+                await websocket.send_json({"type": "ping"})
+                continue
+            await websocket.send_json({"type": "task", "data": event})
+
+    tasks = [asyncio.create_task(_receive()), asyncio.create_task(_send())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                logger.error("task status websocket failure: %s", error)
+    finally:
+        for task in tasks:
+            task.cancel()
+        subscription.close()
@@ -1,35 +1,61 @@
 """Routes for resource endpoints"""
 import logging
 import mimetypes
-from fastapi import APIRouter, HTTPException
-from starlette.responses import FileResponse
-from app.utils.file_utils import get_file_path
+import os
+from fastapi import APIRouter, HTTPException, Request
+from starlette.responses import RedirectResponse
+from app.settings import SETTINGS
+from app.utils import file_utils
+from app.utils.file_response import cached_file_response
+from app.utils.storage import storage
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-@router.get("/resource/{filename}")
-async def get_file_content(filename: str):
+@router.api_route("/resource/{filename:path}", methods=["GET", "HEAD"])
+async def get_file_content(filename: str, request: Request):
     """Return file content for direct browser consumption
-    
+
+    Stored files never change, so responses are cacheable as immutable and
+    conditional requests get 304. Range requests get 206 for seeking in videos.
+    With object storage the client is redirected to a presigned URL instead, and
+    the bytes never pass through the app servers.
+
     Args:
-        filename: Name of file to read
+        filename: Relative path of file to read, e.g. output/3f/a2/20250101_1a2b3c4d.mp4
         
     Returns:
-        FileResponse with appropriate mime type
+        Response with appropriate mime type
         
     Raises:
-        HTTPException: 404 if file not found or cannot be read
+        HTTPException: 404 if file not found, outside the asset directory or cannot be read
     """
     try:
-        file_path = get_file_path(filename)
+        download_name = os.path.basename(filename)
+        presigned_url = await storage.presigned_url(filename, download_name=download_name)
+        if presigned_url is not None:
+            # 重定向可以缓存, 但不能超过签名的有效期
+            return RedirectResponse(
+                presigned_url,
+                status_code=302,
+                headers={"Cache-Control": f"private, max-age={SETTINGS.S3_PRESIGNED_URL_EXPIRES_SECONDS // 2}"}
+            )
+
+        file_path = storage.local_path(filename)
         content_type, _ = mimetypes.guess_type(filename)
-        
-        return FileResponse(
-            path=file_path,
+        accel_redirect = None
+        if SETTINGS.RESOURCE_ACCEL_REDIRECT_PREFIX:
+            accel_redirect = SETTINGS.RESOURCE_ACCEL_REDIRECT_PREFIX + os.path.relpath(file_path, file_utils.ASSET_ROOT)
+
+        response = await cached_file_response(
+            request.headers,
+            file_path,
             media_type=content_type,
-            filename=filename
+            filename=download_name,
+            accel_redirect=accel_redirect
         )
+        await storage.mark_served(filename)
+        return response
         
     except FileNotFoundError:
         logger.error(f"File not found: {filename}")
@@ -1,16 +1,45 @@
-import aiohttp
+import base64
 import logging
-from typing import List
+import time
+from typing import List, Optional
+from uuid import UUID
 
 from fastapi import APIRouter, Depends, BackgroundTasks, Request, HTTPException
+from starlette.status import HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN, HTTP_413_REQUEST_ENTITY_TOO_LARGE
 from app.schema.base import ResponseModel, StatusCode
-from app.schema.i2v_task_schema import I2vTaskCreateReuqest, I2vTaskResponse, VideoGenerationProvider, TaskStatus
-from app.dependencies import get_db, get_independent_db_session
-from app.repository import i2v_task_dao
+from app.schema.i2v_task_schema import (
+    I2vTaskCreateReuqest,
+    I2vTaskResponse,
+    I2vType,
+    MinimaxCallbackRequest,
+    TaskStatus,
+    VideoGenerationProvider,
+)
+from app.dependencies import get_db
+from app.repository import i2v_job_dao, i2v_task_dao
 from app.repository.i2v_task_model import I2vTask
-from app.service.llm_service import call_generate_i2v_prompt_agent
-from app.service.i2v_service import VideoGeneratorFactory
-from app.utils.file_utils import save_base64_file, read_file_to_base64, save_binary_file
+from app.service.i2v_service import verify_minimax_callback_token
+from app.service.i2v_task_service import (
+    IN_FLIGHT_PROVIDER_STATUSES,
+    get_task_statuses,
+    process_image_to_video,
+    refresh_submitted_task,
+)
+from app.settings import SETTINGS
+from app.utils.file_utils import (
+    INPUT_DIR,
+    FileTooLargeError,
+    iter_bytes,
+)
+from app.utils.storage import storage
+from app.utils.image_utils import (
+    ImageHandle,
+    InvalidImageError,
+    image_extension,
+    sniff_base64_image,
+    sniff_image_stream,
+)
+from app.utils.multipart_utils import MultipartError, MultipartFileReader
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -26,33 +55,192 @@ async def create_i2v_task(
     """create i2v task"""
     
     try:
-        image_filename = await save_base64_file(
-            i2v_task_request.image_base64,
-            "input.png"
+        mime_type = sniff_base64_image(i2v_task_request.image_base64)
+    except InvalidImageError as e:
+        logger.warning("Create i2v task rejected: %s", e)
+        return ResponseModel(code=StatusCode.ERROR, msg="invalid image")
+
+    try:
+        image_content = base64.b64decode(i2v_task_request.image_base64)
+        saved = await storage.save_stream(
+            iter_bytes(image_content),
+            f"input{image_extension(mime_type)}",
+            INPUT_DIR,
+            content_addressed=True
         )
 
-        task = await i2v_task_dao.create_i2v_task(
-            db,
-            image_filename,
-            VIDEOPROVIDER,
-            i2v_task_request.type
+        # 直接把解码后的图片交给流水线, 不再从磁盘读回
+        image = ImageHandle.from_bytes(image_content, mime_type, saved.sha256)
+        task = await _create_task(
+            db, background_tasks, saved.filename, i2v_task_request.type, image, i2v_task_request.reuse
+        )
+        return ResponseModel(code=StatusCode.SUCCESS, data=task)
+    except Exception as e: # pylint: disable=broad-except
+        logger.error("Create i2v task failed: %s", e, exc_info=True)
+        return ResponseModel(code=StatusCode.ERROR, msg="create task error")
+
+@router.post(
+    "/i2v/upload",
+    response_model=ResponseModel[I2vTaskResponse],
+    response_model_exclude_none=True,
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "image": {"type": "string", "format": "binary"},
+                            "type": {"type": "string", "enum": [t.value for t in I2vType]},
+                        },
+                        "required": ["image"],
+                    }
+                },
+                "application/octet-stream": {"schema": {"type": "string", "format": "binary"}},
+            },
+            "required": True,
+        }
+    },
+)
+async def upload_i2v_task(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    type: Optional[I2vType] = None, # pylint: disable=redefined-builtin
+    reuse: bool = True,
+    db=Depends(get_db)
+):
+    """create i2v task from an uploaded image
+
+    Accepts either a multipart form with an `image` file field, or the raw image bytes
+    as the request body with `?type=` in the query. Both are parsed as they arrive and
+    the image is streamed to storage in chunks, nothing is spooled, so an upload is
+    rejected as soon as it exceeds I2V_UPLOAD_MAX_BYTES. Pass `reuse=false` to generate
+    a new variation of an image submitted before.
+    """
+    max_size = SETTINGS.I2V_UPLOAD_MAX_BYTES
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_size:
+        raise HTTPException(
+            status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"image exceeds {max_size} bytes"
         )
-        background_tasks.add_task(process_image_to_video, task)
+
+    try:
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("multipart/form-data"):
+            form = MultipartFileReader(request.headers, request.stream(), "image", max_size)
+            mime_type, chunks = await sniff_image_stream(form.file_chunks())
+            saved = await storage.save_stream(
+                chunks,
+                f"input{image_extension(mime_type)}",
+                INPUT_DIR,
+                max_size=max_size,
+                content_addressed=True
+            )
+            # the type field may follow the image, it is known once the body is read
+            i2v_type = _parse_i2v_type(form.fields.get("type") or type)
+        else:
+            i2v_type = _parse_i2v_type(type)
+            mime_type, chunks = await sniff_image_stream(request.stream())
+            saved = await storage.save_stream(
+                chunks,
+                f"input{image_extension(mime_type)}",
+                INPUT_DIR,
+                max_size=max_size,
+                content_addressed=True
+            )
+    except FileTooLargeError as e:
+        raise HTTPException(status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e)) from e
+    except (InvalidImageError, MultipartError) as e:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(e)) from e
+
+    try:
+        image = ImageHandle.from_file(saved.filename, mime_type, saved.sha256)
+        task = await _create_task(db, background_tasks, saved.filename, i2v_type, image, reuse)
         return ResponseModel(code=StatusCode.SUCCESS, data=task)
     except Exception as e: # pylint: disable=broad-except
         logger.error("Create i2v task failed: %s", e, exc_info=True)
         return ResponseModel(code=StatusCode.ERROR, msg="create task error")
 
+def _parse_i2v_type(value) -> I2vType:
+    """validate the i2v type of an upload"""
+    try:
+        return I2vType(value)
+    except ValueError as e:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=f"invalid type: {value}") from e
+
+async def _create_task(
+    db,
+    background_tasks: BackgroundTasks,
+    image_filename: str,
+    i2v_type: I2vType,
+    image: ImageHandle,
+    reuse: bool
+) -> I2vTask:
+    """create the task row and start the pipeline
+
+    With reuse, an identical submission gets a copy of a completed task's result, or
+    attaches to a task for the same image that is still in flight. Otherwise the
+    pipeline job is queued for the worker process, or runs in this process as a
+    background task when JOB_QUEUE_ENABLED is off.
+    """
+    content_hash = await image.get_sha256()
+    if reuse:
+        in_flight_since = int(time.time() * 1000) - SETTINGS.DEDUP_IN_FLIGHT_WINDOW_SECONDS * 1000
+        existing = await i2v_task_dao.find_reusable_i2v_task(
+            db, content_hash, i2v_type, VIDEOPROVIDER, in_flight_since
+        )
+        if existing is not None and existing.status == TaskStatus.TASK_COMPLETED:
+            logger.info("reuse result of completed task, tid: %s", existing.id)
+            return await i2v_task_dao.clone_completed_i2v_task(db, existing, image_filename)
+        if existing is not None:
+            logger.info("attach to in-flight task, tid: %s", existing.id)
+            return existing
+
+    if not SETTINGS.JOB_QUEUE_ENABLED:
+        task = await i2v_task_dao.create_i2v_task(
+            db,
+            image_filename,
+            VIDEOPROVIDER,
+            i2v_type,
+            content_hash
+        )
+        background_tasks.add_task(process_image_to_video, task, image)
+        return task
+
+    # 任务和队列记录在同一个事务里提交
+    task = await i2v_task_dao.create_i2v_task(
+        db,
+        image_filename,
+        VIDEOPROVIDER,
+        i2v_type,
+        content_hash,
+        commit=False
+    )
+    await i2v_job_dao.enqueue_i2v_job(db, task.id)
+    return task
+
 @router.post("/i2v/status", response_model=ResponseModel[List[I2vTaskResponse]], response_model_exclude_none=True)
 async def get_i2v_tasks_status(task_ids: List[str], db=Depends(get_db)):
     """get tasks status"""
     try:
-        results = []
+        requested_ids = []
         for task_id in task_ids:
-            task_status = await query_task_status(task_id, db)
-            if task_status:
-                results.append(task_status)
-                
+            try:
+                requested_ids.append(UUID(task_id))
+            except ValueError:
+                logger.warning("invalid task id, tid: %s", task_id)
+
+        # 先查状态缓存, 未命中的任务一次查询取出, 供应商状态由后台 reconciler 同步
+        statuses = await get_task_statuses(db, list(set(requested_ids)))
+
+        results = []
+        for task_id in requested_ids:
+            status = statuses.get(task_id)
+            if status:
+                results.append(status)
+            else:
+                logger.warning("task not found, tid: %s", task_id)
+
         return ResponseModel(
             code=StatusCode.SUCCESS,
             data=results
@@ -64,123 +252,44 @@ async def get_i2v_tasks_status(task_ids: List[str], db=Depends(get_db)):
             msg="get task status failure"
         )
 
-@router.post("/iv2/minimax/get_callback")
-async def get_callback(request: Request):
-    """get callback"""
-    try:
-        json_data = await request.json()
-        challenge = json_data.get("challenge")
-        if challenge is not None:
-          return {"challenge": challenge}
-        else:
-            #TODO@ztp 看文档这里还需要什么特殊处理吗
-            return {"status": "success"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) from e
+# terminal statuses of a Minimax generation
+MINIMAX_FINISHED_STATUSES = ("Success", "Fail")
 
-async def process_image_to_video(task: I2vTask):
-    """start image2video task"""
-    db = await get_independent_db_session()
-    try:
-        image_base64 = await read_file_to_base64(task.source_image_filename)
-        # 生成图片的描述词
-        vision_prompt = await call_generate_i2v_prompt_agent(image_base64, task.i2v_type)
-        logger.info("vision_prompt: %s", vision_prompt)
-
-        update_data = {
-            "video_generation_prompt": vision_prompt,
-            "status": TaskStatus.PROMPT_GENERATED
-        }
-        await i2v_task_dao.update_i2v_task(db, task.id, update_data)
-
-        # 创建图生视频任务
-        generator = VideoGeneratorFactory.create(task.video_generation_provider)
-        video_generator_id = await generator.generate(image_base64, vision_prompt)
-        
-        logger.info("video_generator_id is %s", video_generator_id)
-        if video_generator_id is None:
-            update_data = {
-               "status": TaskStatus.FAILED
-            }
-            logger.info("set video status failed")
-            await i2v_task_dao.update_i2v_task(db, task.id, update_data)
-            return
-
-        update_data = {
-            "video_generation_id": video_generator_id,
-            "status": TaskStatus.TASK_SUBMITTED
-        }
-        await i2v_task_dao.update_i2v_task(db, task.id, update_data)
-        
-    except Exception as e: # pylint: disable=broad-except
-        logger.error("process_image_to_video: %s", e, exc_info=True)
-        await i2v_task_dao.update_i2v_task(db, task.id, {"status": "FAILED"})
-    finally:
-        await db.close()
+@router.post("/iv2/minimax/get_callback")
+async def get_callback(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    token: Optional[str] = None,
+    db=Depends(get_db)
+):
+    """get callback
 
-async def query_task_status(task_id: str, db) -> I2vTask:
-    """query task status"""
+    Answers the URL verification challenge and handles status callbacks. A callback
+    only triggers a status check, the result is confirmed with the provider before
+    the video is downloaded.
+    """
+    if not verify_minimax_callback_token(token):
+        logger.warning("minimax callback rejected, invalid token")
+        raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="invalid callback token")
     try:
-        task = await i2v_task_dao.get_i2v_task_by_id(db, task_id)
-        if not task:
-            logger.warning("task not found, tid: %s", task_id)
-            return None
+        callback = MinimaxCallbackRequest.model_validate(await request.json())
+    except Exception as e:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="invalid callback") from e
 
-        logger.info("query task status %s", task.__dict__)
+    if callback.challenge is not None:
+        return {"challenge": callback.challenge}
 
-        if task.status in [TaskStatus.IDLE, TaskStatus.PROMPT_GENERATED, TaskStatus.FAILED]:
-            return task
-            
-        elif task.status == TaskStatus.TASK_SUBMITTED:
-            try:
-                generator = VideoGeneratorFactory.create(task.video_generation_provider)
-                status, download_url = await generator.check_status(task.video_generation_id)
-
-                if status == TaskStatus.TASK_SUBMITTED:
-                    return task
-
-                if status == TaskStatus.TASK_COMPLETED and download_url:
-                    #TODO@ztp 这里封装一下
-                    try:
-                        async with aiohttp.ClientSession() as session:
-                            async with session.get(download_url) as response:
-                                if response.status != 200:
-                                    raise Exception(f"download video failure: HTTP {response.status}")
-                                video_content = await response.read()
-                        
-                        # 使用file_utils保存视频文件到videos子目录
-                        video_filename = await save_binary_file(
-                            video_content,
-                            "output.mp4"
-                        )
-
-                        update_data = {
-                            "output_video_filename": video_filename,
-                            "status": TaskStatus.TASK_COMPLETED
-                        }
-                        return await i2v_task_dao.update_i2v_task(db, task_id, update_data)
-                        
-                    except Exception as e:
-                        logger.error(f"Error processing video download: {str(e)}")
-                        update_data = {
-                            "status": TaskStatus.FAILED
-                        }
-                        return await i2v_task_dao.update_i2v_task(db, task_id, update_data)
-
-                elif status == TaskStatus.FAILED:
-                    pass
-                    # update_data = {
-                    #     "status": TaskStatus.FAILED
-                    # }
-                    # return await i2v_task_dao.update_i2v_task(db, task_id, update_data)
-            
-            except Exception as e:
-                logger.error("查询任务{task_id}状态失败: {str(e)}")
-                return task
-            
-        elif task.status in [TaskStatus.TASK_COMPLETED, TaskStatus.FAILED]:
-            return task
+    logger.info("minimax callback, task_id: %s, status: %s", callback.task_id, callback.status)
+    if not callback.task_id or callback.status not in MINIMAX_FINISHED_STATUSES:
+        return {"status": "success"}
 
-    except Exception as e: # pylint: disable=broad-except
-        logger.error("query task status error, tid: %s", task_id, exc_info=True)
-        return None
\ No newline at end of file
+    try:
+        task = await i2v_task_dao.get_i2v_task_by_video_generation_id(db, callback.task_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e)) from e
+    if task is None:
+        logger.warning("minimax callback for unknown task_id: %s", callback.task_id)
+    elif task.status in IN_FLIGHT_PROVIDER_STATUSES:
+        # 下载在响应之后进行, 避免回调超时
+        background_tasks.add_task(refresh_submitted_task, task)
+    return {"status": "success"}
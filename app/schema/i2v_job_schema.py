@@ -0,0 +1,10 @@
+"""i2v job schema"""
+
+from enum import Enum
+
+class JobStatus(Enum):
+    """Pipeline job status"""
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
@@ -14,7 +14,9 @@ class TaskStatus(Enum):
     """Task Status"""
     IDLE = "idle"
     PROMPT_GENERATED = "prompt_generated"
+    TASK_SUBMITTING = "task_submitting"  # 正在提交到服务商, 结果未知前不会再次提交
     TASK_SUBMITTED = "task_submitted"
+    TASK_FINALIZING = "task_finalizing"  # 生成完成, 正在下载视频
     TASK_COMPLETED = "task_completed"
     FAILED = "failed"
 
@@ -29,6 +31,18 @@ class I2vTaskCreateReuqest(BaseModel):
 
     type: I2vType
     image_base64: str
+    # 相同图片和类型复用已有结果, 需要新的变体时传 false
+    reuse: bool = True
+
+class MinimaxCallbackRequest(BaseModel):
+    """Minimax status callback, or the challenge sent when the URL is registered"""
+
+    model_config = ConfigDict(extra="allow")
+
+    challenge: Optional[str] = None
+    task_id: Optional[str] = None
+    status: Optional[str] = None
+    file_id: Optional[str] = None
 
 class I2vTaskResponse(BaseModel):
     """I2v Task Response"""
@@ -39,6 +53,11 @@ class I2vTaskResponse(BaseModel):
     i2v_type: I2vType
     video_generation_id: Optional[str]
     output_video_filename: Optional[str]
+    poster_image_filename: Optional[str] = None
+    preview_video_filename: Optional[str] = None
+    # ms, set when the file was deleted by the asset lifecycle
+    source_image_evicted_at: Optional[int] = None
+    output_video_evicted_at: Optional[int] = None
     created_at: int
     updated_at: int
 
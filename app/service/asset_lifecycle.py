@@ -0,0 +1,297 @@
+"""
+Asset lifecycle, deletes stored files that are no longer needed
+
+- source images are deleted ASSET_INPUT_TTL_SECONDS after the last task using them
+  finished, content addressed images shared with a task in flight are kept
+- output videos not served for ASSET_OUTPUT_TTL_SECONDS are deleted, and above
+  ASSET_DISK_QUOTA_BYTES the least recently served ones until the usage is back under
+  the low watermark. The access time of a file tracks serving, see
+  StorageBackend.mark_served. Posters and previews go with their video. Local
+  storage only, use bucket lifecycle rules on S3
+- temp files left behind by interrupted uploads are removed
+
+Task rows are updated before their file is deleted, so the API stops linking a file
+before it disappears.
+
+Runs inside the worker, or standalone with `python -m app.service.asset_lifecycle`.
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import anyio
+
+from app.dependencies import get_independent_db_session, leader_lock
+from app.repository import i2v_task_dao
+from app.schema.i2v_task_schema import TaskStatus
+from app.service.task_events import task_event_bus
+from app.settings import SETTINGS
+from app.utils import file_utils
+from app.utils.storage import LocalStorageBackend, storage
+
+logger = logging.getLogger(__name__)
+
+# only one worker deletes files at a time
+LEADER_LOCK_NAME = "videosnap_asset_lifecycle"
+TERMINAL_STATUSES = [TaskStatus.TASK_COMPLETED, TaskStatus.FAILED]
+# temp files older than this belong to uploads of crashed processes
+STALE_TMP_FILE_SECONDS = 24 * 3600
+
+
+@dataclass
+class AssetFile:
+    """A stored file found on disk"""
+
+    filename: str
+    size: int
+    served_at: float
+
+
+def scan_assets(root: str, tmp_expired_before: float) -> tuple[list[AssetFile], list[str]]:
+    """Walk the asset directory, blocking
+
+    Returns:
+        tuple: stored files, and paths of temp files modified before tmp_expired_before
+    """
+    files = []
+    stale_tmp_paths = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                stat_result = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name.endswith(".tmp"):
+                if stat_result.st_mtime < tmp_expired_before:
+                    stale_tmp_paths.append(path)
+                continue
+            files.append(AssetFile(os.path.relpath(path, root), stat_result.st_size, stat_result.st_atime))
+    return files, stale_tmp_paths
+
+
+def _remove_files(paths: list[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class AssetLifecycleManager:
+    """Periodically enforces the asset TTLs and the disk quota"""
+
+    def __init__(
+        self,
+        interval: float = SETTINGS.ASSET_LIFECYCLE_INTERVAL_SECONDS,
+        batch_size: int = SETTINGS.ASSET_LIFECYCLE_BATCH_SIZE,
+        input_ttl: int = SETTINGS.ASSET_INPUT_TTL_SECONDS,
+        output_ttl: int = SETTINGS.ASSET_OUTPUT_TTL_SECONDS,
+        disk_quota: int = SETTINGS.ASSET_DISK_QUOTA_BYTES,
+        low_watermark: float = SETTINGS.ASSET_QUOTA_LOW_WATERMARK,
+    ):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.input_ttl = input_ttl
+        self.output_ttl = output_ttl
+        self.disk_quota = disk_quota
+        self.low_watermark = low_watermark
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """start the lifecycle loop in the background"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run_forever())
+            logger.info("asset lifecycle started, interval: %ss", self.interval)
+
+    async def stop(self) -> None:
+        """stop the lifecycle loop"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            logger.info("asset lifecycle stopped")
+
+    async def run_forever(self) -> None:
+        """enforce the policies until cancelled"""
+        while True:
+            try:
+                async with leader_lock(LEADER_LOCK_NAME) as acquired:
+                    if acquired:
+                        await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e: # pylint: disable=broad-except
+                logger.error("asset lifecycle failure: %s", e, exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        """one pass over all policies
+
+        Returns:
+            int: number of deleted files
+        """
+        evicted = await self.evict_source_images()
+        if isinstance(storage, LocalStorageBackend):
+            evicted += await self.evict_local_outputs()
+        if evicted:
+            logger.info("asset lifecycle deleted %d files", evicted)
+        return evicted
+
+    async def evict_source_images(self) -> int:
+        """delete the source images of tasks finished longer than the input TTL ago
+
+        Returns:
+            int: number of deleted images
+        """
+        if self.input_ttl <= 0:
+            return 0
+        finished_before = int(time.time() * 1000) - self.input_ttl * 1000
+        evicted = 0
+        visited = set()
+        for status in TERMINAL_STATUSES:
+            after = None
+            while True:
+                db = await get_independent_db_session()
+                try:
+                    tasks = await i2v_task_dao.get_i2v_tasks_by_status(
+                        db, status, self.batch_size, after, finished_before, with_source_image=True
+                    )
+                finally:
+                    await db.close()
+                if not tasks:
+                    break
+                for task in tasks:
+                    if task.source_image_filename in visited:
+                        continue
+                    visited.add(task.source_image_filename)
+                    if await self._evict_source_image(task.source_image_filename, finished_before):
+                        evicted += 1
+                if len(tasks) < self.batch_size:
+                    break
+                after = (tasks[-1].updated_at, tasks[-1].id)
+        return evicted
+
+    async def _evict_source_image(self, filename: str, used_before: int) -> bool:
+        """delete a source image unless it was used since used_before (ms)"""
+        db = await get_independent_db_session()
+        try:
+            tasks = await i2v_task_dao.get_i2v_tasks_by_source_image_filename(db, filename)
+            if any(task.status not in TERMINAL_STATUSES for task in tasks):
+                return False
+            # 内容寻址的图片可能被再次上传, 重新上传会刷新修改时间
+            modified_at = await storage.last_modified(filename)
+            last_used = max(
+                [task.updated_at for task in tasks if task.source_image_evicted_at is None]
+                + [int(modified_at * 1000) if modified_at is not None else 0]
+            )
+            if last_used >= used_before:
+                return False
+            evicted_at = int(time.time() * 1000)
+            await i2v_task_dao.mark_source_image_evicted(db, filename, TERMINAL_STATUSES, evicted_at)
+        finally:
+            await db.close()
+
+        await storage.delete(filename)
+        changes = {"source_image_evicted_at": evicted_at, "updated_at": evicted_at}
+        for task in tasks:
+            if task.source_image_evicted_at is None:
+                await task_event_bus.publish_task(task, changes)
+        logger.info("source image evicted, file: %s, tasks: %d", filename, len(tasks))
+        return True
+
+    async def evict_local_outputs(self) -> int:
+        """delete expired and least recently served outputs, and stale temp files
+
+        Returns:
+            int: number of deleted videos
+        """
+        now = time.time()
+        files, stale_tmp_paths = await anyio.to_thread.run_sync(
+            scan_assets, file_utils.ASSET_ROOT, now - STALE_TMP_FILE_SECONDS
+        )
+        if stale_tmp_paths:
+            await anyio.to_thread.run_sync(_remove_files, stale_tmp_paths)
+            logger.info("stale temp files removed: %d", len(stale_tmp_paths))
+
+        sizes = {file.filename: file.size for file in files}
+        usage = sum(sizes.values())
+        over_quota = 0 < self.disk_quota < usage
+        target_usage = self.disk_quota * self.low_watermark
+        served_before = now - self.output_ttl if self.output_ttl > 0 else None
+        outputs = sorted(
+            (file for file in files if file_utils.asset_class_dir(file.filename) == file_utils.OUTPUT_DIR),
+            key=lambda file: file.served_at,
+        )
+
+        evicted = 0
+        for file in outputs:
+            expired = served_before is not None and file.served_at < served_before
+            if not expired and not (over_quota and usage > target_usage):
+                # sorted by serving time, the remaining files are newer
+                break
+            derivatives = await self._evict_output(file.filename)
+            usage -= file.size + sum(sizes.get(filename, 0) for filename in derivatives)
+            evicted += 1
+        if over_quota and usage > target_usage:
+            logger.warning(
+                "asset disk usage above quota after evicting all outputs, usage: %d, quota: %d",
+                usage, self.disk_quota
+            )
+        return evicted
+
+    async def _evict_output(self, filename: str) -> set[str]:
+        """clear an output video from its tasks, then delete it with its derivatives
+
+        Returns:
+            set[str]: filenames of the deleted derivatives
+        """
+        evicted_at = int(time.time() * 1000)
+        db = await get_independent_db_session()
+        try:
+            tasks = await i2v_task_dao.get_i2v_tasks_by_output_video_filename(db, filename)
+            await i2v_task_dao.mark_output_video_evicted(db, filename, evicted_at)
+        finally:
+            await db.close()
+
+        derivatives = {
+            derivative for task in tasks
+            for derivative in (task.poster_image_filename, task.preview_video_filename) if derivative
+        }
+        for stored_filename in (filename, *derivatives):
+            await storage.delete(stored_filename)
+        changes = {
+            "output_video_filename": None,
+            "poster_image_filename": None,
+            "preview_video_filename": None,
+            "output_video_evicted_at": evicted_at,
+            "updated_at": evicted_at,
+        }
+        for task in tasks:
+            await task_event_bus.publish_task(task, changes)
+        logger.info("output video evicted, file: %s, tasks: %d", filename, len(tasks))
+        return derivatives
+
+
+async def main():
+    """run the asset lifecycle as a standalone process"""
+    await storage.start()
+    await task_event_bus.start()
+    try:
+        await AssetLifecycleManager().run_forever()
+    finally:
+        await task_event_bus.stop()
+        await storage.close()
+
+
+if __name__ == "__main__":
+    from app.app_logging import configure_logging  # pylint: disable=import-outside-toplevel
+
+    configure_logging()
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+"""
+Moves asset files of the flat layout into the sharded directories
+
+Files stored directly in ASSET_ROOT are moved to <input|output>/xx/yy/<name> and the
+task rows referencing them are updated. Each file is hard linked to its new path
+first and unlinked only once the rows point there, so it stays readable throughout.
+Links handed out before keep working, /resource falls back to the sharded path of a
+flat filename. Local storage only. Safe to stop and run again.
+
+    python -m app.service.asset_migration --dry-run
+"""
+import argparse
+import asyncio
+import logging
+import os
+
+from app.dependencies import get_independent_db_session
+from app.repository import i2v_task_dao
+from app.utils import file_utils
+
+logger = logging.getLogger(__name__)
+
+
+def flat_filenames(root: str) -> list[str]:
+    """files stored directly in the asset directory, temp files excluded"""
+    with os.scandir(root) as entries:
+        return sorted(
+            entry.name for entry in entries
+            if entry.is_file(follow_symlinks=False) and not entry.name.endswith(".tmp")
+        )
+
+
+def _link(source: str, target: str) -> None:
+    """make the file available under target as well, blocking"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        # linked by an interrupted run, generated filenames are unique
+        pass
+    except OSError:
+        # no hard links on this filesystem, flat readers resolve the sharded path
+        os.replace(source, target)
+
+
+async def migrate_file(filename: str, dry_run: bool = False) -> str:
+    """move one flat file into its shard
+
+    Returns:
+        str: new filename
+    """
+    new_filename = file_utils.shard_filename(filename, file_utils.asset_class_dir(filename))
+    if dry_run:
+        return new_filename
+    source = file_utils.get_file_path(filename)
+    await asyncio.to_thread(_link, source, file_utils.get_file_path(new_filename))
+    db = await get_independent_db_session()
+    try:
+        updated = await i2v_task_dao.rename_i2v_task_files(db, filename, new_filename)
+    finally:
+        await db.close()
+    await file_utils.delete_file(filename)
+    logger.debug("asset migrated, file: %s -> %s, tasks: %d", filename, new_filename, updated)
+    return new_filename
+
+
+async def main(dry_run: bool, pause: float):
+    """migrate all flat files"""
+    filenames = await asyncio.to_thread(flat_filenames, file_utils.ASSET_ROOT)
+    logger.info("asset migration started, files: %d, dry run: %s", len(filenames), dry_run)
+    for count, filename in enumerate(filenames, start=1):
+        new_filename = await migrate_file(filename, dry_run)
+        if dry_run:
+            logger.info("would move %s -> %s", filename, new_filename)
+        elif count % 1000 == 0:
+            logger.info("asset migration progress: %d/%d", count, len(filenames))
+            # 给线上流量让出 IO
+            await asyncio.sleep(pause)
+    logger.info("asset migration done, files: %d", len(filenames))
+
+
+if __name__ == "__main__":
+    from app.app_logging import configure_logging  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="only log the moves")
+    parser.add_argument("--pause", type=float, default=0.2, help="seconds between batches of 1000 files")
+    args = parser.parse_args()
+    configure_logging()
+    asyncio.run(main(args.dry_run, args.pause))
@@ -1,18 +1,93 @@
 from abc import ABC, abstractmethod
-import aiohttp
+import hmac
 import json
 import logging
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import orjson
 
 from app.schema.i2v_task_schema import VideoGenerationProvider, TaskStatus
+from app.service.rate_limiter import (
+    MINIMAX_GENERATE,
+    MINIMAX_QUERY,
+    RateLimitedError,
+    get_rate_limiter,
+    parse_retry_after,
+)
+from app.service.resilience import (
+    PermanentProviderError,
+    ProviderOutcomeUnknownError,
+    RetryableProviderError,
+    call_with_deadline,
+    get_circuit_breaker,
+    provider_request,
+)
 from app.settings import SETTINGS
+from app.util.http_client import get_http_session
+from app.utils.image_utils import ImageHandle
 
 logger = logging.getLogger(__name__)
 
+# base_resp.status_code of a throttled Minimax request
+MINIMAX_RATE_LIMIT_CODE = 1002
+# base_resp.status_code of transient Minimax errors: unknown error, timeout, internal error
+MINIMAX_TRANSIENT_CODES = (1000, 1001, 1013)
+# HTTP status of a submit the generation service surely did not process
+SUBMIT_UNAVAILABLE_STATUSES = (503,)
+# gateway errors, the generation service may have received the submit before they
+SUBMIT_OUTCOME_UNKNOWN_STATUSES = (502, 504)
+
+
+def _raise_for_throttle(response, result_code=None) -> None:
+    """raise RateLimitedError when a Minimax response signals a rate limit"""
+    if response.status == 429 or result_code == MINIMAX_RATE_LIMIT_CODE:
+        raise RateLimitedError(
+            f"minimax rate limited: {response.status}",
+            parse_retry_after(response.headers.get("Retry-After"))
+        )
+
+def check_minimax_callback_settings() -> None:
+    """Refuse push callbacks without a token, anyone could trigger finalizations
+
+    Raises:
+        ValueError: When MINIMAX_VIDEO_GENERATION_CALLBACK_URL is set without MINIMAX_CALLBACK_TOKEN
+    """
+    if SETTINGS.MINIMAX_VIDEO_GENERATION_CALLBACK_URL and SETTINGS.MINIMAX_CALLBACK_TOKEN is None:
+        raise ValueError("MINIMAX_CALLBACK_TOKEN is required when MINIMAX_VIDEO_GENERATION_CALLBACK_URL is set")
+
+def minimax_callback_url() -> Optional[str]:
+    """Callback URL sent with each generation, None when push callbacks are disabled
+
+    The callback token is added as a query parameter so callbacks can be verified,
+    without a token callbacks stay disabled.
+    """
+    url = SETTINGS.MINIMAX_VIDEO_GENERATION_CALLBACK_URL
+    if not url or SETTINGS.MINIMAX_CALLBACK_TOKEN is None:
+        return None
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query) + [("token", SETTINGS.MINIMAX_CALLBACK_TOKEN.get_secret_value())]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+def verify_minimax_callback_token(token: Optional[str]) -> bool:
+    """Whether a callback carries the configured token, always False without one"""
+    if SETTINGS.MINIMAX_CALLBACK_TOKEN is None:
+        return False
+    expected = SETTINGS.MINIMAX_CALLBACK_TOKEN.get_secret_value()
+    return token is not None and hmac.compare_digest(token.encode(), expected.encode())
+
+def _raise_for_status(response, message: str) -> None:
+    """raise a classified error for a non 200 response of an idempotent query"""
+    if response.status >= 500:
+        raise RetryableProviderError(f"{message} - status {response.status}")
+    if response.status != 200:
+        raise PermanentProviderError(f"{message} - status {response.status}")
+
 class VideoGenerator(ABC):
     """video generator"""
 
     @abstractmethod
-    async def generate(self, image_base64: str, prompt: str):
+    async def generate(self, image: ImageHandle, prompt: str):
         """generate video"""
 
     @abstractmethod
@@ -23,99 +98,163 @@ class VideoGeneratorFactory:
     """video generator factory"""
 
     @staticmethod
-    def create(provider: VideoGenerationProvider) -> VideoGenerator:
-        """create"""
+    def create(provider: VideoGenerationProvider, resilient: bool = True) -> VideoGenerator:
+        """create
+
+        The generator is wrapped with retries and the provider's circuit breaker
+        unless resilient is False.
+        """
         if provider.startswith("MINIMAX"):
-            return MinimaxVideoGenerator()
+            generator, name = MinimaxVideoGenerator(), "minimax"
         else:
             raise ValueError(f"unspport video provider: {provider}")
+        if resilient:
+            return ResilientVideoGenerator(generator, name)
+        return generator
+
+class ResilientVideoGenerator(VideoGenerator):
+    """Retries transient errors of another generator and fails fast while its circuit is open
+
+    Submitting a generation is not idempotent, it is only repeated when the request
+    surely did not reach the provider.
+    """
+
+    def __init__(self, generator: VideoGenerator, name: str):
+        self.generator = generator
+        self.name = name
+        self.breaker = get_circuit_breaker(name)
+
+    async def generate(self, image: ImageHandle, prompt: str):
+        """generate"""
+        return await call_with_deadline(
+            self.generator.generate, image, prompt,
+            idempotent=False, breaker=self.breaker, name=f"{self.name} generate"
+        )
+
+    async def check_status(self, video_generation_id: str) -> tuple[TaskStatus, str | None]:
+        """check status"""
+        return await call_with_deadline(
+            self.generator.check_status, video_generation_id,
+            breaker=self.breaker, name=f"{self.name} check_status"
+        )
 
 class MinimaxVideoGenerator(VideoGenerator):
     """minimax video generator"""
 
-    async def generate(self, image_base64, prompt):
+    async def generate(self, image, prompt):
         """generate"""
         logger.info("MinimaxVideoGenerator.generate invoke() =====> ")
-        payload = json.dumps({
-            "model": "video-01-live2d", 
+        # orjson 直接输出 bytes, 图片只在请求体里再拷贝一次
+        body = {
+            "model": "video-01-live2d",
             "prompt": prompt,
-            "first_frame_image": f"data:image/jpeg;base64,{image_base64}",
+            "first_frame_image": await image.get_data_url(),
             "prompt_optimizer": True,
-            # "callback_url": SETTINGS.MINIMAX_VIDEO_GENERATION_CALLBACK_URL
-        })
+        }
+        callback_url = minimax_callback_url()
+        if callback_url:
+            # 生成状态变化时 Minimax 主动回调, 不必轮询
+            body["callback_url"] = callback_url
+        payload = orjson.dumps(body)
         headers = {
             'authorization': f'Bearer {SETTINGS.MINIMAX_VIDEO_GENERATION_API_KEY.get_secret_value()}',
             'Content-Type': 'application/json'
         }
 
-        try:
-            async with aiohttp.ClientSession() as session:
+        async def _post():
+            session = get_http_session()
+            with provider_request():
                 async with session.post(SETTINGS.MINIMAX_VIDEO_GENERATION_BASE_URL, headers=headers, data=payload) as response:
                     result = await response.text()
+                    _raise_for_throttle(response)
                     if response.status != 200:
                         logger.error("Minimax API error - status %d: %s", response.status, result)
-                        raise Exception(f"Minimax API error: {response.status} - {result}")
-                    
+                        if response.status in SUBMIT_UNAVAILABLE_STATUSES:
+                            raise RetryableProviderError(f"Minimax API error: {response.status} - {result}")
+                        if response.status in SUBMIT_OUTCOME_UNKNOWN_STATUSES:
+                            # 网关超时不代表生成未开始, 重新提交可能产生第二个付费生成
+                            raise ProviderOutcomeUnknownError(f"Minimax API error: {response.status} - {result}")
+                        raise PermanentProviderError(f"Minimax API error: {response.status} - {result}")
+
                     logger.info("Minimax video generation response - status %d: %s", response.status, result)
                     response_data = json.loads(result)
-                    if response_data.get("base_resp", {}).get("status_code") == 0:
+                    status_code = response_data.get("base_resp", {}).get("status_code")
+                    _raise_for_throttle(response, status_code)
+                    if status_code == 0:
                         return response_data.get("task_id")
                     else:
                         return None
-    
+
+        try:
+            return await get_rate_limiter(MINIMAX_GENERATE).run(_post)
         except Exception as e:
             logger.error("Unexpected error when generating video: %s", str(e))
             raise
 
     async def check_status(self, video_generation_id: str) -> tuple[TaskStatus, str | None]:
-        """Check video generation status"""
-        try:
-            task_status = await self._get_task_status(video_generation_id)
-            if task_status.get("status") == "Success":
-                download_url = await self._get_download_url(task_status.get("file_id"))
-                return TaskStatus.TASK_COMPLETED, download_url
-            elif task_status.get("status") == "Fail":
-                return TaskStatus.FAILED, None
-            else:
-                return TaskStatus.TASK_SUBMITTED, None
-        except Exception as e:
-            logger.error("Error checking video status: %s", str(e), exc_info=True)
+        """Check video generation status
+
+        Only a failure reported by the provider fails the task, errors of the query
+        itself are raised so the caller can try again later.
+        """
+        task_status = await self._get_task_status(video_generation_id)
+        if task_status.get("status") == "Success":
+            download_url = await self._get_download_url(task_status.get("file_id"))
+            return TaskStatus.TASK_COMPLETED, download_url
+        elif task_status.get("status") == "Fail":
             return TaskStatus.FAILED, None
+        else:
+            return TaskStatus.TASK_SUBMITTED, None
 
     async def _get_task_status(self, video_generation_id: str) -> dict:
         """Get task status"""
+        return await get_rate_limiter(MINIMAX_QUERY).run(self._query_task_status, video_generation_id)
+
+    async def _query_task_status(self, video_generation_id: str) -> dict:
+        """query task status once"""
         # status_url = f"{SETTINGS.MINIMAX_VIDEO_GENERATION_BASE_URL}/query/video_generation"
         headers = {
             'authorization': f'Bearer {SETTINGS.MINIMAX_VIDEO_GENERATION_API_KEY.get_secret_value()}',
             'content-type': 'application/json'
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{SETTINGS.MINIMAX_VIDEO_GENERATION_STATUS_URL}?task_id={video_generation_id}", headers=headers) as response:
-                logger.info("response: %s", response)
-                if response.status != 200:
-                    raise Exception(f"API error querying status - status {response.status}")
-                result = await response.json()
-                if result.get("base_resp", {}).get("status_code") != 0:
-                    raise Exception(f"Error in status response: {result}")
-                return result
+        session = get_http_session()
+        async with session.get(f"{SETTINGS.MINIMAX_VIDEO_GENERATION_STATUS_URL}?task_id={video_generation_id}", headers=headers) as response:
+            logger.info("response: %s", response)
+            _raise_for_throttle(response)
+            _raise_for_status(response, "API error querying status")
+            result = await response.json()
+            status_code = result.get("base_resp", {}).get("status_code")
+            _raise_for_throttle(response, status_code)
+            if status_code in MINIMAX_TRANSIENT_CODES:
+                raise RetryableProviderError(f"Error in status response: {result}")
+            if status_code != 0:
+                raise PermanentProviderError(f"Error in status response: {result}")
+            return result
 
     async def _get_download_url(self, file_id: str) -> str:
         """Get file download URL"""
+        return await get_rate_limiter(MINIMAX_QUERY).run(self._retrieve_download_url, file_id)
+
+    async def _retrieve_download_url(self, file_id: str) -> str:
+        """retrieve the file download URL once"""
         logger.info("get download url, file id: %s", file_id)
-        file_url = f"{SETTINGS.MINIMAX_VIDEO_GENERATION_BASE_URL}/files/retrieve"
         headers = {
             'authorization': f'Bearer {SETTINGS.MINIMAX_VIDEO_GENERATION_API_KEY.get_secret_value()}',
             'content-type': 'application/json'
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"https://api.minimax.chat/v1/files/retrieve?file_id={file_id}", headers=headers) as response:
-                logger.info("response: %s", response)
-                if response.status != 200:
-                    raise Exception(f"Failed to get download URL - status {response.status}")
-                result = await response.json()
-                download_url = result.get("file", {}).get("download_url")
-                if not download_url:
-                    raise Exception("Download URL not found")
-                return download_url
+        session = get_http_session()
+        async with session.get(SETTINGS.MINIMAX_FILE_RETRIEVE_URL, params={"file_id": file_id}, headers=headers) as response:
+            logger.info("response: %s", response)
+            _raise_for_throttle(response)
+            _raise_for_status(response, "Failed to get download URL")
+            result = await response.json()
+            status_code = result.get("base_resp", {}).get("status_code")
+            _raise_for_throttle(response, status_code)
+            if status_code in MINIMAX_TRANSIENT_CODES:
+                raise RetryableProviderError(f"Error in file retrieve response: {result}")
+            download_url = result.get("file", {}).get("download_url")
+            if not download_url:
+                raise PermanentProviderError("Download URL not found")
+            return download_url
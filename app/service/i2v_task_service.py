@@ -0,0 +1,345 @@
+"""i2v task service"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Optional
+from uuid import UUID
+
+from app.dependencies import get_independent_db_session
+from app.repository import i2v_task_dao
+from app.repository.i2v_task_model import I2vTask
+from app.schema.i2v_task_schema import TaskStatus
+from app.service.i2v_service import VideoGeneratorFactory
+from app.service.llm_service import call_generate_i2v_prompt_agent
+from app.service.prompt_cache import prompt_cache
+from app.service.resilience import PermanentProviderError, ProviderOutcomeUnknownError, is_retryable
+from app.service.task_events import task_event, task_event_bus
+from app.service.task_status_cache import task_status_cache
+from app.service.video_derivatives import generate_video_derivatives
+from app.settings import SETTINGS
+from app.utils.file_utils import OUTPUT_DIR, STREAM_CHUNK_SIZE
+from app.utils.image_utils import ImageHandle, normalize_image
+from app.utils.storage import storage
+from app.util.http_client import get_http_session, download_timeout
+
+logger = logging.getLogger(__name__)
+
+# statuses in which the provider still owns the task
+IN_FLIGHT_PROVIDER_STATUSES = [TaskStatus.TASK_SUBMITTED, TaskStatus.TASK_FINALIZING]
+# statuses before the task is submitted to the provider, TASK_SUBMITTING is not one
+# of them since the provider may already have the request
+PIPELINE_STATUSES = [TaskStatus.IDLE, TaskStatus.PROMPT_GENERATED]
+
+# finalizations running in this process, later callers await the same future
+_finalizing: dict[UUID, "asyncio.Future[I2vTask]"] = {}
+
+
+async def update_task(
+    db,
+    task: I2vTask,
+    update_data: dict[str, Any],
+    expected_status: Optional[TaskStatus | list[TaskStatus]] = None
+) -> bool:
+    """Persist a task transition and publish the new state to status subscribers
+
+    One conditional UPDATE, the task is not reloaded. The in-memory task is left
+    untouched, see _apply.
+
+    Returns:
+        bool: False when the task was not in an expected status
+    """
+    changes = {**update_data, "updated_at": int(time.time() * 1000)}
+    if not await i2v_task_dao.transition_i2v_task(db, task.id, changes, expected_status):
+        logger.info("task transition skipped, tid: %s, expected: %s", task.id, expected_status)
+        return False
+    await task_event_bus.publish_task(task, changes)
+    return True
+
+
+async def get_task_statuses(db, task_ids: list[UUID]) -> dict[UUID, dict]:
+    """status responses of tasks, served from the status cache when possible
+
+    Returns:
+        dict[UUID, dict]: status per task id, unknown tasks are left out
+    """
+    if not SETTINGS.TASK_STATUS_CACHE_ENABLED:
+        return {task.id: task_event(task) for task in await i2v_task_dao.get_i2v_tasks_by_ids(db, task_ids)}
+
+    cached = await task_status_cache.get_many([str(task_id) for task_id in task_ids])
+    statuses = {UUID(task_id): status for task_id, status in cached.items()}
+    missing = [task_id for task_id in task_ids if task_id not in statuses]
+    if missing:
+        for task in await i2v_task_dao.get_i2v_tasks_by_ids(db, missing):
+            status = task_event(task)
+            await task_status_cache.put(status, fill=True)
+            statuses[task.id] = status
+    return statuses
+
+
+def _apply(task: I2vTask, update_data: dict[str, Any]) -> I2vTask:
+    """reflect a persisted update on a detached task instead of reloading it"""
+    for key, value in update_data.items():
+        setattr(task, key, value)
+    return task
+
+
+async def fail_tasks(
+    tasks: list[I2vTask],
+    expected_status: list[TaskStatus],
+    updated_before: Optional[int] = None
+) -> int:
+    """Mark many tasks failed in one statement and publish them
+
+    With updated_before only tasks that didn't change since then (ms) are failed.
+
+    Returns:
+        int: number of tasks that were still in an expected status
+    """
+    if not tasks:
+        return 0
+    changes = {"status": TaskStatus.FAILED, "updated_at": int(time.time() * 1000)}
+    db = await get_independent_db_session()
+    try:
+        failed = await i2v_task_dao.bulk_transition_i2v_tasks(
+            db, [task.id for task in tasks], changes, expected_status, updated_before=updated_before
+        )
+        if failed == len(tasks):
+            for task in tasks:
+                await task_event_bus.publish_task(_apply(task, changes))
+        elif failed:
+            # 部分任务已被并发修改, 按数据库中的状态发布
+            for task in await i2v_task_dao.get_i2v_tasks_by_ids(db, [task.id for task in tasks]):
+                await task_event_bus.publish_task(task)
+    finally:
+        await db.close()
+    logger.info("failed %d of %d tasks", failed, len(tasks))
+    return failed
+
+
+async def fail_in_flight_tasks(tasks: list[I2vTask]) -> int:
+    """Fail submitted tasks, e.g. rejected by the provider or in flight for too long
+
+    A task being finalized is only failed once its finalization lease expired, a
+    running download is left to finish or fail on its own.
+
+    Returns:
+        int: number of tasks that were failed
+    """
+    lease_before = int(time.time() * 1000) - SETTINGS.FINALIZATION_LEASE_SECONDS * 1000
+    failed = await fail_tasks(
+        [task for task in tasks if task.status == TaskStatus.TASK_SUBMITTED], [TaskStatus.TASK_SUBMITTED]
+    )
+    return failed + await fail_tasks(
+        [task for task in tasks if task.status == TaskStatus.TASK_FINALIZING],
+        [TaskStatus.TASK_FINALIZING],
+        updated_before=lease_before,
+    )
+
+
+async def process_image_to_video(
+    task: I2vTask,
+    image: Optional[ImageHandle] = None,
+    requeue_retryable: bool = False
+):
+    """start image2video task
+
+    The image is first normalized for the LLM and the provider, without a handle
+    the source image is read back from storage. A task that already got past the
+    prompt stage, e.g. when a job is run again, is left alone. The task is claimed
+    with PROMPT_GENERATED -> TASK_SUBMITTING before the generation is submitted, so
+    only one caller submits it.
+
+    With requeue_retryable a transient provider error that outlasted the retries,
+    e.g. an open circuit or a provider that stays rate limited, is raised and the
+    task keeps its status, so the job can run again later.
+    """
+    if task.status not in PIPELINE_STATUSES:
+        logger.info("task already submitted, tid: %s, status: %s", task.id, task.status)
+        return
+    if image is None:
+        image = ImageHandle.from_file(task.source_image_filename, sha256=task.content_hash)
+    db = await get_independent_db_session()
+    try:
+        # 缩放并压缩图片, 非图片在调用付费接口前失败
+        normalized = await normalize_image(
+            image,
+            SETTINGS.LLM_IMAGE_MAX_SIDE,
+            SETTINGS.LLM_IMAGE_TARGET_BYTES,
+            SETTINGS.PROVIDER_IMAGE_MAX_SIDE,
+            SETTINGS.PROVIDER_IMAGE_TARGET_BYTES,
+        )
+
+        # 同一图片和类型命中缓存时跳过 LLM
+        image_sha256 = await image.get_sha256()
+        vision_prompt = await prompt_cache.get(image_sha256, task.i2v_type)
+        if vision_prompt is None:
+            # 生成图片的描述词
+            vision_prompt = await call_generate_i2v_prompt_agent(normalized.llm, task.i2v_type)
+            await prompt_cache.put(image_sha256, task.i2v_type, vision_prompt)
+        logger.info("vision_prompt: %s", vision_prompt)
+
+        update_data = {
+            "video_generation_prompt": vision_prompt,
+            "status": TaskStatus.PROMPT_GENERATED
+        }
+        if not await update_task(db, task, update_data, PIPELINE_STATUSES):
+            # 另一个 worker 已经提交了该任务
+            return
+
+        # 提交前认领任务, 重新领取的 job 不会再次提交付费的生成
+        if not await update_task(db, task, {"status": TaskStatus.TASK_SUBMITTING}, TaskStatus.PROMPT_GENERATED):
+            logger.info("task is submitted by another worker, tid: %s", task.id)
+            return
+
+        # 创建图生视频任务
+        generator = VideoGeneratorFactory.create(task.video_generation_provider)
+        try:
+            video_generator_id = await generator.generate(normalized.provider, vision_prompt)
+        except Exception as e: # pylint: disable=broad-except
+            if requeue_retryable and is_retryable(e, idempotent=False):
+                # the provider surely did not get the request, the job submits it again
+                await update_task(db, task, {"status": TaskStatus.PROMPT_GENERATED}, TaskStatus.TASK_SUBMITTING)
+                raise
+            logger.error("submit task failure, tid: %s, error: %s", task.id, e, exc_info=True)
+            await update_task(db, task, {"status": TaskStatus.FAILED}, TaskStatus.TASK_SUBMITTING)
+            return
+
+        logger.info("video_generator_id is %s", video_generator_id)
+        if video_generator_id is None:
+            update_data = {
+               "status": TaskStatus.FAILED
+            }
+            logger.info("set video status failed")
+            await update_task(db, task, update_data, TaskStatus.TASK_SUBMITTING)
+            return
+
+        update_data = {
+            "video_generation_id": video_generator_id,
+            "status": TaskStatus.TASK_SUBMITTED
+        }
+        await update_task(db, task, update_data, TaskStatus.TASK_SUBMITTING)
+
+    except Exception as e: # pylint: disable=broad-except
+        if requeue_retryable and is_retryable(e):
+            raise
+        logger.error("process_image_to_video: %s", e, exc_info=True)
+        await update_task(db, task, {"status": TaskStatus.FAILED}, PIPELINE_STATUSES)
+    finally:
+        await db.close()
+
+
+async def refresh_submitted_task(task: I2vTask) -> I2vTask:
+    """Check a submitted task at the provider and persist the transition
+
+    Once the provider reports success the video is downloaded by exactly one caller,
+    see finalize_task. Writes go through an independent session so tasks can be
+    refreshed concurrently.
+    """
+    if task.status not in IN_FLIGHT_PROVIDER_STATUSES:
+        return task
+
+    status, download_url = await check_submitted_task(task)
+    # FAILED only when the provider failed or rejected the generation
+    if status == TaskStatus.FAILED:
+        await fail_in_flight_tasks([task])
+        return task
+
+    if status != TaskStatus.TASK_COMPLETED or not download_url:
+        return task
+
+    return await finalize_task(task, download_url)
+
+
+async def check_submitted_task(task: I2vTask) -> tuple[Optional[TaskStatus], Optional[str]]:
+    """Ask the provider for the status of a submitted task
+
+    Returns:
+        tuple: Provider status and download URL, FAILED when the provider rejected the
+            task for good, (None, None) when the query failed and may succeed later
+    """
+    try:
+        generator = VideoGeneratorFactory.create(task.video_generation_provider)
+        return await generator.check_status(task.video_generation_id)
+    except Exception as e: # pylint: disable=broad-except
+        if isinstance(e, PermanentProviderError) and not isinstance(e, ProviderOutcomeUnknownError):
+            # 例如未知任务或缺少下载地址, 重新查询不会有不同结果
+            logger.error("task rejected by the provider, tid: %s, error: %s", task.id, e)
+            return TaskStatus.FAILED, None
+        # 查询失败不代表生成失败, 下一轮再查询
+        logger.error("query task status failure, tid: %s, error: %s", task.id, e)
+        return None, None
+
+
+async def finalize_task(task: I2vTask, download_url: str) -> I2vTask:
+    """Download the finished video and complete the task, single-flight
+
+    Concurrent callers in this process share one finalization. Across processes the
+    caller that wins the TASK_SUBMITTED -> TASK_FINALIZING claim downloads, the others
+    return the task as currently stored.
+    """
+    running = _finalizing.get(task.id)
+    if running is not None:
+        return await asyncio.shield(running)
+
+    future: "asyncio.Future[I2vTask]" = asyncio.get_running_loop().create_future()
+    _finalizing[task.id] = future
+    try:
+        result = await _claim_and_finalize(task, download_url)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        # nobody else may be waiting, don't log "exception was never retrieved"
+        future.exception()
+        raise
+    finally:
+        _finalizing.pop(task.id, None)
+
+
+async def _claim_and_finalize(task: I2vTask, download_url: str) -> I2vTask:
+    """claim the task in the database, then download"""
+    db = await get_independent_db_session()
+    try:
+        claimed = await i2v_task_dao.claim_i2v_task_finalization(
+            db, task.id, SETTINGS.FINALIZATION_LEASE_SECONDS * 1000
+        )
+        if not claimed:
+            logger.info("task is finalized by another worker, tid: %s", task.id)
+            return await i2v_task_dao.get_i2v_task_by_id(db, task.id) or task
+
+        try:
+            session = get_http_session()
+            async with session.get(download_url, timeout=download_timeout()) as response:
+                if response.status != 200:
+                    raise Exception(f"download video failure: HTTP {response.status}")
+                # 分块写入存储, 避免整个视频驻留内存
+                saved = await storage.save_stream(
+                    response.content.iter_chunked(STREAM_CHUNK_SIZE),
+                    "output.mp4",
+                    OUTPUT_DIR,
+                    expected_size=response.content_length
+                )
+            logger.info(
+                "video saved, tid: %s, file: %s, size: %d, sha256: %s",
+                task.id, saved.filename, saved.size, saved.sha256
+            )
+
+            update_data = {
+                "output_video_filename": saved.filename,
+                "output_video_size": saved.size,
+                "output_video_sha256": saved.sha256,
+                **await generate_video_derivatives(saved.filename),
+                "status": TaskStatus.TASK_COMPLETED
+            }
+
+        except Exception as e: # pylint: disable=broad-except
+            logger.error(f"Error processing video download: {str(e)}")
+            update_data = {
+                "status": TaskStatus.FAILED
+            }
+        if await update_task(db, task, update_data, TaskStatus.TASK_FINALIZING):
+            return _apply(task, update_data)
+        return await i2v_task_dao.get_i2v_task_by_id(db, task.id) or task
+    finally:
+        await db.close()
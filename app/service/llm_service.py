@@ -2,28 +2,47 @@
 
 import logging
 from litellm import acompletion
+from litellm.exceptions import (
+    APIConnectionError,
+    InternalServerError,
+    RateLimitError,
+    ServiceUnavailableError,
+    Timeout,
+)
 from app.schema.i2v_task_schema import I2vType
+from app.service.rate_limiter import AZURE_CHAT, RateLimitedError, get_rate_limiter
+from app.service.resilience import RetryableProviderError
 from app.util.constant import IMAGINATIVE_SYSTEM_PROMPT, REALISTIC_SYSTEM_PROMPT
+from app.utils.image_utils import ImageHandle
 
 logger = logging.getLogger(__name__)
 
-async def call_generate_i2v_prompt_agent(image_base64: str, i2v_type: I2vType) -> str:
+async def call_generate_i2v_prompt_agent(image: ImageHandle, i2v_type: I2vType) -> str:
     """call generate i2v prompt agent"""
-    message = _generate_message(image_base64, i2v_type)
-    
+    message = _generate_message(await image.get_data_url(), i2v_type)
+
+    async def _complete():
+        try:
+            return await acompletion(
+                model="azure/gpt-4o",  #TODO@ztp 抽为配置
+                messages=message,
+                temperature=1
+            )
+        except RateLimitError as e:
+            raise RateLimitedError(f"azure rate limited: {e}") from e
+        except (APIConnectionError, Timeout, InternalServerError, ServiceUnavailableError) as e:
+            raise RetryableProviderError(f"azure unavailable: {e}") from e
+
     try:
-        response = await acompletion(
-            model="azure/gpt-4o",  #TODO@ztp 抽为配置
-            messages=message,
-            temperature=1
-        )
+        # 限流时排队等待, 不直接失败
+        response = await get_rate_limiter(AZURE_CHAT).run(_complete)
         #TODO@ztp update task status and data
         return response.choices[0].message.content
     except Exception as e: # pylint: disable=broad-except
         logger.error("Failed to generate prompt: %s", e)
         raise e
 
-def _generate_message(image_base64: str, i2v_type: I2vType) -> list:
+def _generate_message(image_url: str, i2v_type: I2vType) -> list:
     """generate message"""
 
     if i2v_type is I2vType.IMAGINATIVE:
@@ -41,7 +60,7 @@ def _generate_message(image_base64: str, i2v_type: I2vType) -> list:
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/jpeg;base64,{image_base64}"
+                        "url": image_url
                     }
                 },
                 {
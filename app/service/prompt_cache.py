@@ -0,0 +1,91 @@
+"""
+Content-addressed cache for generated vision prompts
+
+Two tiers: an in-process LRU in front of the i2v_prompt_cache table, which survives
+restarts and is shared by all workers.
+"""
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+from prometheus_client import Counter
+
+from app.dependencies import get_independent_db_session
+from app.repository import prompt_cache_dao
+from app.schema.i2v_task_schema import I2vType
+from app.settings import SETTINGS
+from app.util.constant import PROMPT_TEMPLATE_VERSION
+
+logger = logging.getLogger(__name__)
+
+PROMPT_CACHE_REQUESTS = Counter(
+    "i2v_prompt_cache_requests_total",
+    "Vision prompt cache lookups",
+    ["tier", "result"],
+)
+
+
+def build_cache_key(image_sha256: str, i2v_type: I2vType, template_version: int = PROMPT_TEMPLATE_VERSION) -> str:
+    """cache key of a generated prompt"""
+    return f"{image_sha256}:{i2v_type.value}:v{template_version}"
+
+
+class PromptCache:
+    """Vision prompt cache with an in-process LRU and a persistent table"""
+
+    def __init__(self, max_size: int = SETTINGS.PROMPT_CACHE_LRU_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+
+    def _remember(self, key: str, prompt: str) -> None:
+        """put into the LRU tier"""
+        self._entries[key] = prompt
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get(self, image_sha256: str, i2v_type: I2vType) -> Optional[str]:
+        """look up a prompt, memory first, then the database"""
+        key = build_cache_key(image_sha256, i2v_type)
+
+        prompt = self._entries.get(key)
+        if prompt is not None:
+            self._entries.move_to_end(key)
+            PROMPT_CACHE_REQUESTS.labels("memory", "hit").inc()
+            return prompt
+        PROMPT_CACHE_REQUESTS.labels("memory", "miss").inc()
+
+        db = await get_independent_db_session()
+        try:
+            prompt = await prompt_cache_dao.get_prompt_by_cache_key(db, key)
+        except Exception as e: # pylint: disable=broad-except
+            logger.error("load prompt cache failure: %s", e)
+            prompt = None
+        finally:
+            await db.close()
+
+        if prompt is None:
+            PROMPT_CACHE_REQUESTS.labels("database", "miss").inc()
+            return None
+        PROMPT_CACHE_REQUESTS.labels("database", "hit").inc()
+        self._remember(key, prompt)
+        return prompt
+
+    async def put(self, image_sha256: str, i2v_type: I2vType, prompt: str) -> None:
+        """store a generated prompt in both tiers"""
+        key = build_cache_key(image_sha256, i2v_type)
+        self._remember(key, prompt)
+
+        db = await get_independent_db_session()
+        try:
+            await prompt_cache_dao.save_prompt(
+                db, key, image_sha256, i2v_type, PROMPT_TEMPLATE_VERSION, prompt
+            )
+        except Exception as e: # pylint: disable=broad-except
+            # 缓存写入失败不影响任务
+            logger.error("save prompt cache failure: %s", e)
+        finally:
+            await db.close()
+
+
+prompt_cache = PromptCache()
@@ -0,0 +1,238 @@
+"""
+Rate limiting and adaptive concurrency for outbound provider calls
+
+Every provider endpoint gets a token bucket for its requests per minute and an
+AIMD concurrency limit: the limit grows by one per window of successful calls and
+is halved on a 429, or shrunk when latency exceeds the target. Throttled calls wait
+for capacity and are retried instead of failing the task.
+
+Limits are per process, size them for the number of API and worker processes.
+"""
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from prometheus_client import Counter, Gauge
+
+from app.settings import SETTINGS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+AZURE_CHAT = "azure_chat"
+MINIMAX_GENERATE = "minimax_generate"
+MINIMAX_QUERY = "minimax_query"
+
+# a burst of throttled responses only shrinks the limit once per cooldown
+DECREASE_COOLDOWN_SECONDS = 2.0
+LATENCY_DECREASE_FACTOR = 0.9
+THROTTLE_DECREASE_FACTOR = 0.5
+THROTTLE_BACKOFF_BASE_SECONDS = 1.0
+THROTTLE_BACKOFF_MAX_SECONDS = 60.0
+
+CONCURRENCY_LIMIT = Gauge(
+    "provider_concurrency_limit",
+    "Current adaptive concurrency limit of a provider endpoint",
+    ["endpoint"],
+)
+IN_FLIGHT = Gauge(
+    "provider_requests_in_flight",
+    "Provider requests currently running",
+    ["endpoint"],
+)
+THROTTLED = Counter(
+    "provider_throttled_total",
+    "Provider responses signalling a rate limit",
+    ["endpoint"],
+)
+
+
+class RateLimitedError(Exception):
+    """Raised when a provider signals a rate limit, e.g. HTTP 429"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """seconds of a Retry-After header, only the delay form is supported"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """Token bucket refilled continuously, waiters are served in order"""
+
+    def __init__(self, requests_per_minute: float, capacity: int):
+        self.rate = requests_per_minute / 60
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """hand out no tokens for a while, e.g. after a 429"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self) -> None:
+        """wait for a token"""
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class EndpointLimiter:
+    """Token bucket plus AIMD concurrency limit of one provider endpoint"""
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float,
+        max_concurrency: int,
+        latency_target: Optional[float] = None,
+        min_concurrency: int = 1,
+        max_wait: float = SETTINGS.RATE_LIMIT_MAX_WAIT_SECONDS,
+    ):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.latency_target = latency_target
+        self.max_wait = max_wait
+        self.bucket = TokenBucket(requests_per_minute, self.max_concurrency)
+        self._limit = float(self.max_concurrency)
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+        CONCURRENCY_LIMIT.labels(name).set(self.concurrency_limit)
+
+    @property
+    def concurrency_limit(self) -> int:
+        """number of calls allowed to run at once right now"""
+        return max(self.min_concurrency, int(self._limit))
+
+    def _increase(self) -> None:
+        self._limit = min(float(self.max_concurrency), self._limit + 1 / self._limit)
+        CONCURRENCY_LIMIT.labels(self.name).set(self.concurrency_limit)
+
+    def _decrease(self, factor: float) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < DECREASE_COOLDOWN_SECONDS:
+            return
+        self._last_decrease = now
+        self._limit = max(float(self.min_concurrency), self._limit * factor)
+        CONCURRENCY_LIMIT.labels(self.name).set(self.concurrency_limit)
+        logger.info("%s concurrency limit lowered to %d", self.name, self.concurrency_limit)
+
+    @asynccontextmanager
+    async def slot(self):
+        """hold a concurrency slot and a rate token for one call
+
+        A RateLimitedError raised inside the block lowers the limit and pauses the
+        bucket, slow successful calls lower it slightly, fast ones raise it.
+        """
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.concurrency_limit)
+            self._in_flight += 1
+        IN_FLIGHT.labels(self.name).inc()
+        try:
+            await self.bucket.acquire()
+            started = time.monotonic()
+            try:
+                yield
+            except RateLimitedError as e:
+                THROTTLED.labels(self.name).inc()
+                self._decrease(THROTTLE_DECREASE_FACTOR)
+                self.bucket.pause(e.retry_after if e.retry_after is not None else THROTTLE_BACKOFF_BASE_SECONDS)
+                raise
+            latency = time.monotonic() - started
+            if self.latency_target and latency > self.latency_target:
+                self._decrease(LATENCY_DECREASE_FACTOR)
+            else:
+                self._increase()
+        finally:
+            IN_FLIGHT.labels(self.name).dec()
+            async with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    async def run(self, func: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        """run a call under the limits, waiting and retrying while it is throttled
+
+        Raises:
+            RateLimitedError: When the endpoint stays throttled for longer than max_wait
+        """
+        deadline = time.monotonic() + self.max_wait
+        attempt = 0
+        while True:
+            try:
+                async with self.slot():
+                    return await func(*args, **kwargs)
+            except RateLimitedError as e:
+                attempt += 1
+                delay = e.retry_after
+                if delay is None:
+                    backoff = min(THROTTLE_BACKOFF_MAX_SECONDS, THROTTLE_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1))
+                    delay = random.uniform(backoff / 2, backoff)
+                if time.monotonic() + delay > deadline:
+                    logger.warning("%s still throttled after %d attempts", self.name, attempt)
+                    raise
+                logger.info("%s throttled, retry in %.1fs, attempt: %d", self.name, delay, attempt)
+                await asyncio.sleep(delay)
+
+
+_limiters: dict[str, EndpointLimiter] = {}
+
+
+def _endpoint_config(endpoint: str) -> tuple[float, int, float]:
+    """requests per minute, max concurrency and latency target of an endpoint"""
+    if endpoint == AZURE_CHAT:
+        return (
+            SETTINGS.AZURE_CHAT_RPM,
+            SETTINGS.AZURE_CHAT_MAX_CONCURRENCY,
+            SETTINGS.AZURE_CHAT_LATENCY_TARGET_SECONDS,
+        )
+    if endpoint == MINIMAX_GENERATE:
+        return (
+            SETTINGS.MINIMAX_GENERATE_RPM,
+            SETTINGS.MINIMAX_GENERATE_MAX_CONCURRENCY,
+            SETTINGS.MINIMAX_GENERATE_LATENCY_TARGET_SECONDS,
+        )
+    if endpoint == MINIMAX_QUERY:
+        return (
+            SETTINGS.MINIMAX_QUERY_RPM,
+            SETTINGS.MINIMAX_QUERY_MAX_CONCURRENCY,
+            SETTINGS.MINIMAX_QUERY_LATENCY_TARGET_SECONDS,
+        )
+    raise ValueError(f"unknown provider endpoint: {endpoint}")
+
+
+def get_rate_limiter(endpoint: str) -> EndpointLimiter:
+    """Get the limiter of a provider endpoint, created on first use"""
+    limiter = _limiters.get(endpoint)
+    if limiter is None:
+        requests_per_minute, max_concurrency, latency_target = _endpoint_config(endpoint)
+        limiter = EndpointLimiter(endpoint, requests_per_minute, max_concurrency, latency_target)
+        _limiters[endpoint] = limiter
+    return limiter
@@ -0,0 +1,281 @@
+"""
+Retry, deadline and circuit breaker primitives for provider calls
+
+Provider errors are classified as retryable (connection failures, timeouts, 5xx) or
+permanent. Retryable errors are retried with jittered exponential backoff, and
+repeated ones open the provider's circuit so later calls fail fast instead of piling
+up hung connections. Callers that own queued work requeue it on CircuitOpenError.
+"""
+import asyncio
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Iterator, Optional, TypeVar
+
+import aiohttp
+from prometheus_client import Gauge
+
+from app.service.rate_limiter import RateLimitedError
+from app.settings import SETTINGS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+_CIRCUIT_STATE_VALUES = {CIRCUIT_CLOSED: 0, CIRCUIT_HALF_OPEN: 1, CIRCUIT_OPEN: 2}
+
+CIRCUIT_STATE = Gauge(
+    "provider_circuit_state",
+    "Circuit breaker state of a provider, 0 closed, 1 half open, 2 open",
+    ["provider"],
+)
+
+
+class ProviderError(Exception):
+    """Error returned by a provider call"""
+
+
+class RetryableProviderError(ProviderError):
+    """Transient provider error, the call may succeed when repeated"""
+
+
+class PermanentProviderError(ProviderError):
+    """Provider rejected the call, repeating it won't help"""
+
+
+class ProviderOutcomeUnknownError(PermanentProviderError):
+    """The provider may or may not have acted on the call, e.g. after a gateway timeout
+
+    Not repeated, but counted as a provider failure by the circuit breaker.
+    """
+
+
+class CircuitOpenError(RetryableProviderError):
+    """Raised without calling the provider while its circuit is open"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        # seconds until the breaker lets a probe through
+        self.retry_after = retry_after
+
+
+def is_retryable(error: BaseException, idempotent: bool = True) -> bool:
+    """Whether a failed call may be repeated
+
+    For calls that are not idempotent, e.g. submitting a paid generation, errors that
+    leave it unknown whether the provider received the request are not retryable.
+    """
+    if isinstance(error, (RetryableProviderError, RateLimitedError)):
+        return True
+    if isinstance(error, aiohttp.ClientConnectorError):
+        # the connection was never established
+        return True
+    if not idempotent:
+        return False
+    return isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError))
+
+
+class _CallState:
+    """how far the current call of call_with_deadline got"""
+
+    def __init__(self):
+        self.request_sent = False
+        # the last error the provider answered with, it did not act on the request
+        self.rejection: Optional[BaseException] = None
+
+
+_call_state: ContextVar[Optional[_CallState]] = ContextVar("provider_call_state", default=None)
+
+
+@contextmanager
+def provider_request() -> Iterator[None]:
+    """Mark the span in which a request is on its way to the provider
+
+    A non idempotent call that misses its deadline inside this span may have reached
+    the provider. Outside of it, e.g. while waiting for the rate limiter or in backoff,
+    it surely did not and can be repeated.
+    """
+    state = _call_state.get()
+    if state is None:
+        yield
+        return
+    state.request_sent = True
+    try:
+        yield
+    except Exception as e:
+        if is_retryable(e, idempotent=False):
+            # 服务方明确拒绝或连接未建立, 请求没有被处理
+            state.request_sent = False
+            state.rejection = e
+        raise
+    state.request_sent = False
+    state.rejection = None
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """full jitter exponential backoff before the given retry attempt"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures, lets one probe through after a cooldown"""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = SETTINGS.CIRCUIT_FAILURE_THRESHOLD,
+        recovery_timeout: float = SETTINGS.CIRCUIT_RECOVERY_SECONDS,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = CIRCUIT_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        CIRCUIT_STATE.labels(name).set(_CIRCUIT_STATE_VALUES[self.state])
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.warning("%s circuit %s -> %s", self.name, self.state, state)
+            self.state = state
+            CIRCUIT_STATE.labels(self.name).set(_CIRCUIT_STATE_VALUES[state])
+
+    def before_call(self) -> None:
+        """admit a call, or fail fast
+
+        Raises:
+            CircuitOpenError: While the circuit is open, or a half open probe is running
+        """
+        if self.state == CIRCUIT_OPEN:
+            remaining = self._opened_at + self.recovery_timeout - time.monotonic()
+            if remaining > 0:
+                raise CircuitOpenError(f"{self.name} circuit open, retry in {remaining:.0f}s", remaining)
+            self._set_state(CIRCUIT_HALF_OPEN)
+        if self.state == CIRCUIT_HALF_OPEN:
+            if self._probing:
+                raise CircuitOpenError(f"{self.name} circuit half open, probe running")
+            self._probing = True
+
+    def record_success(self) -> None:
+        """the provider answered"""
+        self._failures = 0
+        self._probing = False
+        self._set_state(CIRCUIT_CLOSED)
+
+    def release(self) -> None:
+        """the call was abandoned without an outcome, e.g. cancelled"""
+        self._probing = False
+
+    def record_failure(self) -> None:
+        """the provider failed with a retryable error"""
+        self._failures += 1
+        self._probing = False
+        if self.state == CIRCUIT_HALF_OPEN or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            self._set_state(CIRCUIT_OPEN)
+
+
+async def call_with_retry(
+    func: Callable[..., Awaitable[T]],
+    *args: Any,
+    attempts: int = SETTINGS.PROVIDER_RETRY_ATTEMPTS,
+    base_delay: float = SETTINGS.PROVIDER_RETRY_BASE_DELAY_SECONDS,
+    max_delay: float = SETTINGS.PROVIDER_RETRY_MAX_DELAY_SECONDS,
+    idempotent: bool = True,
+    breaker: Optional[CircuitBreaker] = None,
+    name: str = "provider call",
+    **kwargs: Any,
+) -> T:
+    """Call func, retrying retryable errors with jittered backoff
+
+    Throttling is not retried here, the rate limiter already waited for capacity.
+
+    Raises:
+        CircuitOpenError: When the breaker rejects the call
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            if breaker is not None:
+                breaker.release()
+            raise
+        except RateLimitedError:
+            if breaker is not None:
+                breaker.record_success()
+            raise
+        except Exception as e: # pylint: disable=broad-except
+            if breaker is not None:
+                if is_retryable(e) or isinstance(e, ProviderOutcomeUnknownError):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            if attempt >= attempts or not is_retryable(e, idempotent):
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            logger.warning("%s failed, retry in %.1fs, attempt: %d, error: %r", name, delay, attempt, e)
+            await asyncio.sleep(delay)
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+
+async def call_with_deadline(
+    func: Callable[..., Awaitable[T]],
+    *args: Any,
+    deadline: float = SETTINGS.PROVIDER_CALL_DEADLINE_SECONDS,
+    idempotent: bool = True,
+    name: str = "provider call",
+    **kwargs: Any,
+) -> T:
+    """Retry func within an overall deadline
+
+    Raises:
+        RetryableProviderError: When an idempotent call misses the deadline, or a non
+            idempotent one misses it before its request was sent, see provider_request
+        RateLimitedError: When a non idempotent call misses it while throttled
+        ProviderOutcomeUnknownError: When a non idempotent call misses it while its
+            request is on the way, the provider may have received it
+    """
+    state = _CallState()
+    token = _call_state.set(state)
+    try:
+        return await asyncio.wait_for(
+            call_with_retry(func, *args, idempotent=idempotent, name=name, **kwargs),
+            timeout=deadline,
+        )
+    except asyncio.TimeoutError as e:
+        if idempotent:
+            raise RetryableProviderError(f"{name} missed its {deadline}s deadline") from e
+        if state.request_sent:
+            raise ProviderOutcomeUnknownError(f"{name} missed its {deadline}s deadline") from e
+        if isinstance(state.rejection, RateLimitedError):
+            raise RateLimitedError(
+                f"{name} missed its {deadline}s deadline while throttled", state.rejection.retry_after
+            ) from e
+        raise RetryableProviderError(f"{name} missed its {deadline}s deadline before sending a request") from e
+    finally:
+        _call_state.reset(token)
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Get the circuit breaker of a provider, created on first use"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = CircuitBreaker(name)
+        _breakers[name] = breaker
+    return breaker
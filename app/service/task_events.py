@@ -0,0 +1,264 @@
+"""
+Task status event bus feeding the streaming status endpoints
+
+Status updates of the pipeline are published here and delivered to the SSE and
+WebSocket subscribers of the task. Updates happen in other API workers and in the
+worker process, so events are fanned out across processes: through Redis pub/sub
+when REDIS_URL is set, otherwise every process polls the tasks its own subscribers
+watch.
+"""
+import asyncio
+import logging
+from typing import Any, Iterable, Optional
+from uuid import UUID
+
+import orjson
+
+from app.dependencies import get_api_db_session
+from app.repository import i2v_task_dao
+from app.repository.i2v_task_model import I2vTask
+from app.schema.i2v_task_schema import I2vTaskResponse, TaskStatus
+from app.service.task_status_cache import task_status_cache
+from app.settings import SETTINGS
+
+logger = logging.getLogger(__name__)
+
+TASK_EVENTS_CHANNEL = "videosnap:i2v_task_events"
+TERMINAL_STATUSES = (TaskStatus.TASK_COMPLETED.value, TaskStatus.FAILED.value)
+
+
+def task_event(task: I2vTask, changes: Optional[dict[str, Any]] = None) -> dict:
+    """event payload of a task, same fields as the status response
+
+    changes are applied on top of the loaded task, so a task updated without a
+    reload can still be published.
+    """
+    response = I2vTaskResponse.model_validate(task)
+    if changes:
+        response = response.model_copy(
+            update={key: value for key, value in changes.items() if key in I2vTaskResponse.model_fields}
+        )
+    return response.model_dump(mode="json")
+
+
+def is_terminal_event(event: dict) -> bool:
+    """whether the task won't change anymore"""
+    return event.get("status") in TERMINAL_STATUSES
+
+
+class TaskSubscription:
+    """Events of a set of tasks for one client connection"""
+
+    def __init__(self, bus: "TaskEventBus", max_queue_size: int = SETTINGS.TASK_EVENTS_QUEUE_SIZE):
+        self.bus = bus
+        self.task_ids: set[str] = set()
+        self._queue: "asyncio.Queue[dict]" = asyncio.Queue(maxsize=max_queue_size)
+
+    def put(self, event: dict) -> None:
+        """queue an event, dropping the oldest one when the client is slow"""
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(event)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """next event, None when nothing arrived within the timeout"""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        """stop receiving events"""
+        self.bus.unsubscribe(self)
+
+
+class TaskEventBus:
+    """In-process pub/sub of task status events"""
+
+    def __init__(self):
+        self._subscriptions: dict[str, set[TaskSubscription]] = {}
+        # last delivered (status, updated_at) per task, so fan-out duplicates are dropped
+        self._delivered: dict[str, tuple] = {}
+        self._fanout: Optional["RedisFanout | DatabasePollFanout"] = None
+
+    def subscribe(self, task_ids: Iterable[str] = ()) -> TaskSubscription:
+        """open a subscription to the events of some tasks"""
+        subscription = TaskSubscription(self)
+        self.add(subscription, task_ids)
+        return subscription
+
+    def add(self, subscription: TaskSubscription, task_ids: Iterable[str]) -> None:
+        """extend a subscription to more tasks"""
+        for task_id in task_ids:
+            subscription.task_ids.add(task_id)
+            self._subscriptions.setdefault(task_id, set()).add(subscription)
+
+    def remove(self, subscription: TaskSubscription, task_ids: Iterable[str]) -> None:
+        """stop delivering events of some tasks to a subscription"""
+        for task_id in list(task_ids):
+            subscription.task_ids.discard(task_id)
+            subscribers = self._subscriptions.get(task_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[task_id]
+                    self._delivered.pop(task_id, None)
+
+    def unsubscribe(self, subscription: TaskSubscription) -> None:
+        """close a subscription"""
+        self.remove(subscription, list(subscription.task_ids))
+
+    def watched_task_ids(self) -> list[str]:
+        """tasks with at least one subscriber in this process"""
+        return list(self._subscriptions)
+
+    def dispatch(self, event: dict) -> None:
+        """deliver an event to the local subscribers of its task"""
+        task_id = event.get("id")
+        if SETTINGS.TASK_STATUS_CACHE_ENABLED:
+            task_status_cache.refresh(event)
+        subscribers = self._subscriptions.get(task_id)
+        if not subscribers:
+            return
+        version = (event.get("status"), event.get("updated_at"))
+        if self._delivered.get(task_id) == version:
+            return
+        self._delivered[task_id] = version
+        for subscription in subscribers:
+            subscription.put(event)
+
+    async def publish(self, event: dict) -> None:
+        """publish an event to the subscribers in all processes and to the status cache"""
+        if SETTINGS.TASK_STATUS_CACHE_ENABLED:
+            await task_status_cache.put(event)
+        if self._fanout is not None:
+            try:
+                await self._fanout.publish(event)
+                return
+            except Exception as e: # pylint: disable=broad-except
+                logger.error("publish task event failure: %s", e)
+        self.dispatch(event)
+
+    async def publish_task(self, task: I2vTask, changes: Optional[dict[str, Any]] = None) -> None:
+        """publish the current state of a task, never raises"""
+        try:
+            await self.publish(task_event(task, changes))
+        except Exception as e: # pylint: disable=broad-except
+            logger.error("publish task event failure, tid: %s, error: %s", task.id, e)
+
+    async def start(self) -> None:
+        """start the cross-process fan-out"""
+        if self._fanout is not None:
+            return
+        if SETTINGS.REDIS_URL:
+            self._fanout = RedisFanout(self, SETTINGS.REDIS_URL)
+        else:
+            self._fanout = DatabasePollFanout(self, SETTINGS.TASK_EVENTS_POLL_INTERVAL_SECONDS)
+        await self._fanout.start()
+
+    async def stop(self) -> None:
+        """stop the cross-process fan-out"""
+        if self._fanout is not None:
+            await self._fanout.stop()
+            self._fanout = None
+
+
+class RedisFanout:
+    """Fans events out to all processes through a Redis channel"""
+
+    def __init__(self, bus: TaskEventBus, url: str):
+        self.bus = bus
+        self.url = url
+        self._redis = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        import aioredis  # pylint: disable=import-outside-toplevel
+
+        self._redis = aioredis.from_url(self.url)
+        self._listener = asyncio.create_task(self._listen())
+        logger.info("task events fan out through redis")
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
+
+    async def publish(self, event: dict) -> None:
+        # our own listener delivers the event to the local subscribers as well
+        await self._redis.publish(TASK_EVENTS_CHANNEL, orjson.dumps(event))
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(TASK_EVENTS_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self.bus.dispatch(orjson.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e: # pylint: disable=broad-except
+                logger.error("task events redis listener failure: %s", e)
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+
+class DatabasePollFanout:
+    """Polls the tasks watched by local subscribers, used without Redis"""
+
+    def __init__(self, bus: TaskEventBus, interval: float):
+        self.bus = bus
+        self.interval = interval
+        self._poller: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._poller = asyncio.create_task(self._poll_forever())
+        logger.info("task events fan out by polling, interval: %ss", self.interval)
+
+    async def stop(self) -> None:
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+
+    async def publish(self, event: dict) -> None:
+        # other processes see the update on their next poll
+        self.bus.dispatch(event)
+
+    async def poll_once(self) -> None:
+        """load the watched tasks and dispatch the ones that changed"""
+        task_ids = [UUID(task_id) for task_id in self.bus.watched_task_ids()]
+        if not task_ids:
+            return
+        db = await get_api_db_session()
+        try:
+            tasks = await i2v_task_dao.get_i2v_tasks_by_ids(db, task_ids)
+        finally:
+            await db.close()
+        for task in tasks:
+            self.bus.dispatch(task_event(task))
+
+    async def _poll_forever(self) -> None:
+        while True:
+            try:
+                await self.poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e: # pylint: disable=broad-except
+                logger.error("task events poll failure: %s", e)
+            await asyncio.sleep(self.interval)
+
+
+task_event_bus = TaskEventBus()
@@ -0,0 +1,210 @@
+"""
+Background reconciler advancing submitted tasks by polling the video provider
+
+Runs inside the app lifespan, or standalone with `python -m app.service.task_reconciler`.
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from app.dependencies import get_independent_db_session, leader_lock
+from app.repository import i2v_task_dao
+from app.repository.i2v_task_model import I2vTask
+from app.service.i2v_service import minimax_callback_url
+from app.schema.i2v_task_schema import TaskStatus
+from app.service.i2v_task_service import (
+    IN_FLIGHT_PROVIDER_STATUSES,
+    check_submitted_task,
+    fail_in_flight_tasks,
+    fail_tasks,
+    finalize_task,
+)
+from app.settings import SETTINGS
+
+logger = logging.getLogger(__name__)
+
+# only one reconciler across all workers polls at a time
+LEADER_LOCK_NAME = "videosnap_task_reconciler"
+
+
+def default_interval() -> float:
+    """poll interval, slow when the provider pushes status callbacks"""
+    if minimax_callback_url():
+        return SETTINGS.RECONCILER_CALLBACK_INTERVAL_SECONDS
+    return SETTINGS.RECONCILER_INTERVAL_SECONDS
+
+
+def default_min_idle() -> float:
+    """with push callbacks only tasks without a recent update are polled"""
+    if minimax_callback_url():
+        return SETTINGS.RECONCILER_CALLBACK_INTERVAL_SECONDS
+    return 0
+
+
+class TaskReconciler:
+    """Periodically polls submitted tasks and persists their transitions
+
+    With push callbacks enabled it only catches callbacks that never arrived.
+    """
+
+    def __init__(
+        self,
+        interval: Optional[float] = None,
+        batch_size: int = SETTINGS.RECONCILER_BATCH_SIZE,
+        concurrency: int = SETTINGS.RECONCILER_CONCURRENCY,
+    ):
+        self.interval = interval if interval is not None else default_interval()
+        self.min_idle = default_min_idle()
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """start the reconcile loop in the background"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run_forever())
+            logger.info("task reconciler started, interval: %ss", self.interval)
+
+    async def stop(self) -> None:
+        """stop the reconcile loop"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            logger.info("task reconciler stopped")
+
+    async def run_forever(self) -> None:
+        """reconcile until cancelled"""
+        while True:
+            try:
+                await self.run_once_as_leader()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e: # pylint: disable=broad-except
+                logger.error("task reconcile failure: %s", e, exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def run_once_as_leader(self) -> int:
+        """run one pass if no other worker is reconciling
+
+        On MySQL the pass holds a named lock so that the uvicorn workers don't poll
+        the same tasks in parallel.
+        """
+        async with leader_lock(LEADER_LOCK_NAME) as acquired:
+            if not acquired:
+                return 0
+            return await self.run_once()
+
+    async def run_once(self) -> int:
+        """poll every submitted task once, batch by batch
+
+        Tasks stuck in finalization are included so that an expired claim gets retried.
+        Tasks the provider reports as failed, and tasks in flight for longer than
+        TASK_IN_FLIGHT_TIMEOUT_SECONDS, are failed with one statement per batch, as
+        are tasks whose submission never finished, see fail_stale_submissions. A task
+        being finalized only times out once its finalization lease expired, so a
+        running download is never failed.
+
+        Returns:
+            int: number of tasks that left the submitted state
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _check(task: I2vTask) -> tuple[I2vTask, Optional[TaskStatus], Optional[str]]:
+            async with semaphore:
+                status, download_url = await check_submitted_task(task)
+                return task, status, download_url
+
+        async def _finalize(task: I2vTask, download_url: str) -> I2vTask:
+            async with semaphore:
+                return await finalize_task(task, download_url)
+
+        async def _reconcile(tasks: list[I2vTask]) -> int:
+            now = int(time.time() * 1000)
+            expire_before = now - SETTINGS.TASK_IN_FLIGHT_TIMEOUT_SECONDS * 1000
+            lease_before = now - SETTINGS.FINALIZATION_LEASE_SECONDS * 1000
+            expired = [
+                task for task in tasks if task.created_at < expire_before
+                and (task.status == TaskStatus.TASK_SUBMITTED or task.updated_at < lease_before)
+            ]
+            checked = await asyncio.gather(*(_check(task) for task in tasks if task not in expired))
+
+            if expired:
+                logger.warning("%d tasks in flight for too long are failed", len(expired))
+            # 下载中的任务可能刚被重新认领, 只有租约仍过期时才失败
+            failed = await fail_in_flight_tasks(
+                expired + [task for task, status, _ in checked if status == TaskStatus.FAILED]
+            )
+
+            finalized = await asyncio.gather(*(
+                _finalize(task, download_url) for task, status, download_url in checked
+                if status == TaskStatus.TASK_COMPLETED and download_url
+            ))
+            return failed + sum(1 for task in finalized if task.status not in IN_FLIGHT_PROVIDER_STATUSES)
+
+        transitioned = await self.fail_stale_submissions()
+        # tasks changed during this pass are not visited twice
+        updated_before = int(time.time() * 1000) - self.min_idle * 1000
+        for status in IN_FLIGHT_PROVIDER_STATUSES:
+            after = None
+            while True:
+                db = await get_independent_db_session()
+                try:
+                    tasks = await i2v_task_dao.get_i2v_tasks_by_status(
+                        db, status, self.batch_size, after, updated_before
+                    )
+                finally:
+                    await db.close()
+                if not tasks:
+                    break
+                transitioned += await _reconcile(tasks)
+                if len(tasks) < self.batch_size:
+                    break
+                after = (tasks[-1].updated_at, tasks[-1].id)
+
+        if transitioned:
+            logger.info("task reconciler advanced %d tasks", transitioned)
+        return transitioned
+
+    async def fail_stale_submissions(self) -> int:
+        """fail tasks left in TASK_SUBMITTING, e.g. by a worker that died while submitting
+
+        Whether the provider got the request is unknown, submitting again could start
+        a second paid generation.
+
+        Returns:
+            int: number of failed tasks
+        """
+        updated_before = int(time.time() * 1000) - SETTINGS.SUBMISSION_TIMEOUT_SECONDS * 1000
+        db = await get_independent_db_session()
+        try:
+            tasks = await i2v_task_dao.get_i2v_tasks_by_status(
+                db, TaskStatus.TASK_SUBMITTING, self.batch_size, updated_before=updated_before
+            )
+        finally:
+            await db.close()
+        if tasks:
+            logger.warning("%d tasks stuck while submitting are failed", len(tasks))
+        return await fail_tasks(tasks, [TaskStatus.TASK_SUBMITTING], updated_before=updated_before)
+
+
+async def main():
+    """run the reconciler as a standalone process"""
+    from app.util.http_client import init_http_client, close_http_client  # pylint: disable=import-outside-toplevel
+
+    await init_http_client()
+    try:
+        await TaskReconciler().run_forever()
+    finally:
+        await close_http_client()
+
+
+if __name__ == "__main__":
+    from app.app_logging import configure_logging  # pylint: disable=import-outside-toplevel
+
+    configure_logging()
+    asyncio.run(main())
@@ -0,0 +1,233 @@
+"""
+Read-through cache of task status responses
+
+Completed and failed tasks only change when the asset lifecycle deletes their files,
+they are kept in an in-process LRU. In-flight tasks are cached for a short TTL only,
+and every published transition overwrites the cached entry, so readers see the new
+status right away.
+
+With REDIS_URL set the entries are shared through Redis, so all API workers agree on
+the in-flight state; the terminal LRU stays in front of it without expiry, evictions
+reach it through the task event bus. Without Redis an eviction published by the
+worker never reaches the API processes, terminal entries expire after
+TASK_STATUS_CACHE_LOCAL_TERMINAL_TTL_SECONDS then.
+"""
+import logging
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import orjson
+from prometheus_client import Counter
+
+from app.schema.i2v_task_schema import TaskStatus
+from app.settings import SETTINGS
+
+logger = logging.getLogger(__name__)
+
+TASK_STATUS_CACHE_PREFIX = "videosnap:i2v_task_status:"
+TERMINAL_STATUSES = (TaskStatus.TASK_COMPLETED.value, TaskStatus.FAILED.value)
+
+TASK_STATUS_CACHE_REQUESTS = Counter(
+    "i2v_task_status_cache_requests_total",
+    "Task status cache lookups",
+    ["tier", "result"],
+)
+
+
+def _is_terminal(status: dict) -> bool:
+    return status.get("status") in TERMINAL_STATUSES
+
+
+def _is_newer(status: dict, cached: Optional[dict]) -> bool:
+    """whether status may replace the cached entry"""
+    if cached is None:
+        return True
+    if _is_terminal(cached):
+        return False
+    return (status.get("updated_at") or 0) >= (cached.get("updated_at") or 0)
+
+
+class LocalStatusCacheBackend:
+    """In-process backend, each worker process has its own entries"""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        # task id -> (expires at, status)
+        self._entries: dict[str, tuple[float, dict]] = {}
+
+    async def get_many(self, task_ids: list[str]) -> dict[str, dict]:
+        now = time.monotonic()
+        found = {}
+        for task_id in task_ids:
+            entry = self._entries.get(task_id)
+            if entry is None:
+                continue
+            if entry[0] <= now:
+                del self._entries[task_id]
+                continue
+            found[task_id] = entry[1]
+        return found
+
+    async def put(self, status: dict, fill: bool = False) -> None:
+        task_id = status["id"]
+        cached = self._entries.get(task_id)
+        if cached is not None and cached[0] > time.monotonic():
+            if fill or not _is_newer(status, cached[1]):
+                return
+        self._entries.pop(task_id, None)
+        self._entries[task_id] = (time.monotonic() + self.ttl, status)
+        while len(self._entries) > self.max_size:
+            # dicts keep insertion order, the first entry expires first
+            del self._entries[next(iter(self._entries))]
+
+    async def close(self) -> None:
+        self._entries.clear()
+
+
+class RedisStatusCacheBackend:
+    """Backend shared by all processes through Redis"""
+
+    def __init__(self, url: str, ttl: float, terminal_ttl: int):
+        self.url = url
+        self.ttl = ttl
+        self.terminal_ttl = terminal_ttl
+        self._redis = None
+
+    def _client(self):
+        if self._redis is None:
+            import aioredis  # pylint: disable=import-outside-toplevel
+
+            self._redis = aioredis.from_url(self.url)
+        return self._redis
+
+    async def get_many(self, task_ids: list[str]) -> dict[str, dict]:
+        values = await self._client().mget([TASK_STATUS_CACHE_PREFIX + task_id for task_id in task_ids])
+        return {
+            task_id: orjson.loads(value) for task_id, value in zip(task_ids, values) if value is not None
+        }
+
+    async def put(self, status: dict, fill: bool = False) -> None:
+        # a read-through fill never replaces an entry written by a transition
+        if _is_terminal(status):
+            await self._client().set(
+                TASK_STATUS_CACHE_PREFIX + status["id"], orjson.dumps(status), ex=self.terminal_ttl, nx=fill
+            )
+        else:
+            await self._client().set(
+                TASK_STATUS_CACHE_PREFIX + status["id"], orjson.dumps(status), px=int(self.ttl * 1000), nx=fill
+            )
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
+
+
+class TaskStatusCache:
+    """Terminal task LRU in front of a short lived status backend"""
+
+    def __init__(
+        self,
+        backend: "LocalStatusCacheBackend | RedisStatusCacheBackend",
+        max_size: int = SETTINGS.TASK_STATUS_CACHE_SIZE,
+        terminal_ttl: Optional[float] = None,
+    ):
+        self.backend = backend
+        self.max_size = max_size
+        # None keeps terminal entries until they are evicted from the LRU
+        self.terminal_ttl = terminal_ttl
+        # task id -> (expires at or None, status)
+        self._terminal: "OrderedDict[str, tuple[Optional[float], dict]]" = OrderedDict()
+
+    def _remember(self, status: dict) -> None:
+        """put into the terminal LRU"""
+        task_id = status["id"]
+        expires_at = time.monotonic() + self.terminal_ttl if self.terminal_ttl is not None else None
+        self._terminal[task_id] = (expires_at, status)
+        self._terminal.move_to_end(task_id)
+        while len(self._terminal) > self.max_size:
+            self._terminal.popitem(last=False)
+
+    def _terminal_status(self, task_id: Optional[str]) -> Optional[dict]:
+        """terminal LRU entry of a task, expired ones are dropped"""
+        entry = self._terminal.get(task_id)
+        if entry is None:
+            return None
+        expires_at, status = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._terminal[task_id]
+            return None
+        return status
+
+    async def get_many(self, task_ids: Iterable[str]) -> dict[str, dict]:
+        """cached statuses of the tasks, missing ones are left out"""
+        found = {}
+        missing = []
+        for task_id in task_ids:
+            status = self._terminal_status(task_id)
+            if status is None:
+                missing.append(task_id)
+                continue
+            self._terminal.move_to_end(task_id)
+            found[task_id] = status
+        if found:
+            TASK_STATUS_CACHE_REQUESTS.labels("terminal", "hit").inc(len(found))
+        if not missing:
+            return found
+
+        try:
+            cached = await self.backend.get_many(missing)
+        except Exception as e: # pylint: disable=broad-except
+            logger.error("load task status cache failure: %s", e)
+            cached = {}
+        if cached:
+            TASK_STATUS_CACHE_REQUESTS.labels("backend", "hit").inc(len(cached))
+        if len(missing) > len(cached):
+            TASK_STATUS_CACHE_REQUESTS.labels("backend", "miss").inc(len(missing) - len(cached))
+        for status in cached.values():
+            if _is_terminal(status):
+                self._remember(status)
+        found.update(cached)
+        return found
+
+    async def put(self, status: dict, fill: bool = False) -> None:
+        """cache a task status, never raises
+
+        fill is set for statuses loaded from the database, which may be older than a
+        transition written meanwhile and don't replace a cached entry.
+        """
+        if _is_terminal(status):
+            self._remember(status)
+        try:
+            await self.backend.put(status, fill)
+        except Exception as e: # pylint: disable=broad-except
+            logger.error("save task status cache failure, tid: %s, error: %s", status.get("id"), e)
+
+    def refresh(self, status: dict) -> None:
+        """replace the terminal entry of a task changed by another process, e.g. a deleted output"""
+        cached = self._terminal_status(status.get("id"))
+        if cached is not None and _is_terminal(status) and status["updated_at"] > cached["updated_at"]:
+            self._remember(status)
+
+    async def close(self) -> None:
+        """release the backend connection"""
+        await self.backend.close()
+
+
+def create_task_status_cache() -> TaskStatusCache:
+    """status cache with the backend of the settings"""
+    if SETTINGS.REDIS_URL:
+        backend = RedisStatusCacheBackend(
+            SETTINGS.REDIS_URL,
+            SETTINGS.TASK_STATUS_CACHE_TTL_SECONDS,
+            SETTINGS.TASK_STATUS_CACHE_REDIS_TERMINAL_TTL_SECONDS,
+        )
+    else:
+        backend = LocalStatusCacheBackend(SETTINGS.TASK_STATUS_CACHE_TTL_SECONDS, SETTINGS.TASK_STATUS_CACHE_SIZE)
+        return TaskStatusCache(backend, terminal_ttl=SETTINGS.TASK_STATUS_CACHE_LOCAL_TERMINAL_TTL_SECONDS)
+    return TaskStatusCache(backend)
+
+
+task_status_cache = create_task_status_cache()
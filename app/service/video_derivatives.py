@@ -0,0 +1,72 @@
+"""
+Poster frames and preview renditions of generated videos
+
+They are rendered right after the video is downloaded, before the task completes,
+so the completion event already carries them and a grid of finished tasks doesn't
+have to pull the full videos. Failures are logged and leave the fields empty, they
+never fail the task.
+"""
+import asyncio
+import logging
+import os
+import tempfile
+from typing import Any
+
+import aiofiles
+
+from app.settings import SETTINGS
+from app.utils import file_utils
+from app.utils.storage import storage
+from app.utils.video_utils import render_poster, render_preview
+
+logger = logging.getLogger(__name__)
+
+
+async def _save_derivative(path: str, original_filename: str) -> str:
+    """store a rendered file, they are small enough to be read at once"""
+    async with aiofiles.open(path, "rb") as f:
+        content = await f.read()
+    saved = await storage.save_stream(file_utils.iter_bytes(content), original_filename, file_utils.DERIVED_DIR)
+    return saved.filename
+
+
+async def generate_video_derivatives(video_filename: str) -> dict[str, Any]:
+    """Render and store the poster and preview of a stored video, never raises
+
+    Returns:
+        dict: poster_image_filename and preview_video_filename, each one only when it
+            could be generated, empty when VIDEO_DERIVATIVES_ENABLED is off
+    """
+    if not SETTINGS.VIDEO_DERIVATIVES_ENABLED:
+        return {}
+    try:
+        # ffmpeg reads remote storage through a presigned URL
+        source = storage.local_path(video_filename) or await storage.presigned_url(video_filename)
+    except Exception as e: # pylint: disable=broad-except
+        logger.error("video derivative source failure, file: %s, error: %s", video_filename, e)
+        return {}
+    if source is None:
+        return {}
+
+    derivatives = {}
+    with tempfile.TemporaryDirectory(prefix="videosnap-") as tmp_dir:
+        poster_path = os.path.join(tmp_dir, "poster.jpg")
+        preview_path = os.path.join(tmp_dir, "preview.mp4")
+        renders = {
+            "poster_image_filename": (poster_path, render_poster(
+                source, poster_path, SETTINGS.VIDEO_POSTER_MAX_WIDTH, SETTINGS.VIDEO_POSTER_OFFSET_SECONDS
+            )),
+            "preview_video_filename": (preview_path, render_preview(
+                source, preview_path, SETTINGS.VIDEO_PREVIEW_MAX_WIDTH, SETTINGS.VIDEO_PREVIEW_BITRATE
+            )),
+        }
+        results = await asyncio.gather(*(render for _, render in renders.values()), return_exceptions=True)
+        for (field, (path, _)), result in zip(renders.items(), results):
+            try:
+                if isinstance(result, Exception):
+                    raise result
+                derivatives[field] = await _save_derivative(path, os.path.basename(path))
+            except Exception as e: # pylint: disable=broad-except
+                logger.error("video derivative failure, file: %s, %s, error: %s", video_filename, field, e)
+    logger.info("video derivatives generated, file: %s, derivatives: %s", video_filename, derivatives)
+    return derivatives
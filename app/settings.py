@@ -3,6 +3,7 @@ Module to load configurations from environment
 """
 import logging
 import os
+from typing import Optional
 
 from dotenv import load_dotenv
 from pydantic import SecretStr
@@ -27,9 +28,177 @@ class AppSettings(BaseSettings):
 
     MINIMAX_VIDEO_GENERATION_API_KEY: SecretStr
     MINIMAX_VIDEO_GENERATION_BASE_URL: str
+    # leave empty to disable push callbacks and rely on polling
     MINIMAX_VIDEO_GENERATION_CALLBACK_URL: str
+    # shared secret appended to the callback URL, callbacks without it are rejected,
+    # required when the callback URL is set
+    MINIMAX_CALLBACK_TOKEN: Optional[SecretStr] = None
     MINIMAX_VIDEO_GENERATION_STATUS_URL: str
-    
+    MINIMAX_FILE_RETRIEVE_URL: str = "https://api.minimax.chat/v1/files/retrieve"
+
+    # asset storage, "local" keeps files in the asset directory, "s3" in an S3 compatible bucket
+    STORAGE_BACKEND: str = "local"
+    AWS_S3_BUCKET_NAME: Optional[str] = None
+    # set for S3 compatible stores such as MinIO, e.g. http://minio:9000
+    AWS_S3_ENDPOINT_URL: Optional[str] = None
+    AWS_REGION_NAME: Optional[str] = None
+    # credentials fall back to the default AWS chain, e.g. an instance role
+    AWS_ACCESS_KEY_ID: Optional[str] = None
+    AWS_SECRET_ACCESS_KEY: Optional[SecretStr] = None
+    S3_KEY_PREFIX: str = ""
+    S3_MULTIPART_PART_SIZE: int = 8 * 1024 * 1024
+    S3_PRESIGNED_URL_EXPIRES_SECONDS: int = 3600
+
+    # /resource delivery, stored files are immutable so clients and the CDN may cache them for long
+    RESOURCE_CACHE_MAX_AGE_SECONDS: int = 365 * 24 * 3600
+    # when set, delivery is handed to nginx with X-Accel-Redirect to this internal location,
+    # e.g. /protected-asset/, which serves the file with sendfile
+    RESOURCE_ACCEL_REDIRECT_PREFIX: Optional[str] = None
+
+    # poster JPEG and low bitrate preview of completed videos, needs ffmpeg
+    VIDEO_DERIVATIVES_ENABLED: bool = False
+    FFMPEG_PATH: str = "ffmpeg"
+    # ffmpeg processes running at once per process
+    VIDEO_DERIVATIVE_CONCURRENCY: int = 2
+    VIDEO_DERIVATIVE_TIMEOUT_SECONDS: float = 120
+    VIDEO_POSTER_MAX_WIDTH: int = 640
+    VIDEO_POSTER_OFFSET_SECONDS: float = 1
+    VIDEO_PREVIEW_MAX_WIDTH: int = 480
+    VIDEO_PREVIEW_BITRATE: str = "300k"
+
+    # asset lifecycle, enforced by the worker process
+    ASSET_LIFECYCLE_ENABLED: bool = True
+    ASSET_LIFECYCLE_INTERVAL_SECONDS: float = 600
+    ASSET_LIFECYCLE_BATCH_SIZE: int = 500
+    # source images are deleted this long after their task finished, 0 keeps them
+    ASSET_INPUT_TTL_SECONDS: int = 7 * 24 * 3600
+    # output videos not served for this long are deleted, 0 keeps them (local storage)
+    ASSET_OUTPUT_TTL_SECONDS: int = 0
+    # above the quota the least recently served outputs are deleted until the disk usage
+    # falls below quota * low watermark, 0 disables the quota (local storage)
+    ASSET_DISK_QUOTA_BYTES: int = 0
+    ASSET_QUOTA_LOW_WATERMARK: float = 0.9
+    # serving a file updates its access time at most once per interval
+    ASSET_SERVED_TOUCH_INTERVAL_SECONDS: int = 3600
+
+    # mysql connection
+    DB_USER: str = "videosnap"
+    DB_PASS: SecretStr = SecretStr("videosnap")
+    DB_HOST: str = "mysql"
+    DB_PORT: int = 3306
+    DB_NAME: str = "videosnap"
+    # separate pools so pipeline writes can't starve the API reads
+    DB_API_POOL_SIZE: int = 10
+    DB_API_MAX_OVERFLOW: int = 10
+    DB_PIPELINE_POOL_SIZE: int = 10
+    DB_PIPELINE_MAX_OVERFLOW: int = 5
+    # max seconds to wait for a pooled connection before failing the request
+    DB_POOL_TIMEOUT_SECONDS: float = 10
+    DB_POOL_RECYCLE_SECONDS: int = 3600
+    DB_POOL_PRE_PING: bool = True
+    # open the pool connections on startup instead of on the first requests
+    DB_POOL_WARMUP: bool = True
+
+    # max size of an image uploaded to /i2v/upload
+    I2V_UPLOAD_MAX_BYTES: int = 20 * 1024 * 1024
+
+    # image normalization before the LLM and provider calls
+    IMAGE_PROCESS_POOL_SIZE: int = 2
+    LLM_IMAGE_MAX_SIDE: int = 1024
+    LLM_IMAGE_TARGET_BYTES: int = 300 * 1024
+    PROVIDER_IMAGE_MAX_SIDE: int = 1280
+    PROVIDER_IMAGE_TARGET_BYTES: int = 1024 * 1024
+
+    # identical submissions attach to an in-flight task created within this window
+    DEDUP_IN_FLIGHT_WINDOW_SECONDS: int = 3600
+
+    # in-process tier of the vision prompt cache, the database tier is unbounded
+    PROMPT_CACHE_LRU_SIZE: int = 1024
+
+    # durable pipeline job queue, drained by `python -m app.worker`
+    # when disabled the pipeline runs as a background task of the API process
+    JOB_QUEUE_ENABLED: bool = True
+    WORKER_CONCURRENCY: int = 8
+    WORKER_POLL_INTERVAL_SECONDS: float = 1
+    # the worker renews the lease of its running jobs every heartbeat, a job whose
+    # lease was not renewed for JOB_LEASE_SECONDS is claimed again
+    JOB_LEASE_SECONDS: int = 600
+    JOB_HEARTBEAT_SECONDS: float = 60
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_BACKOFF_SECONDS: float = 30
+    WORKER_SHUTDOWN_TIMEOUT_SECONDS: float = 60
+
+    # per process rate and concurrency limits of the provider endpoints
+    # a requests per minute of 0 disables the token bucket
+    AZURE_CHAT_RPM: float = 60
+    AZURE_CHAT_MAX_CONCURRENCY: int = 8
+    AZURE_CHAT_LATENCY_TARGET_SECONDS: float = 30
+    MINIMAX_GENERATE_RPM: float = 20
+    MINIMAX_GENERATE_MAX_CONCURRENCY: int = 4
+    MINIMAX_GENERATE_LATENCY_TARGET_SECONDS: float = 20
+    MINIMAX_QUERY_RPM: float = 120
+    MINIMAX_QUERY_MAX_CONCURRENCY: int = 10
+    MINIMAX_QUERY_LATENCY_TARGET_SECONDS: float = 5
+    # a throttled call waits at most this long for capacity before giving up
+    RATE_LIMIT_MAX_WAIT_SECONDS: float = 300
+
+    # retries and circuit breaker around the video provider
+    PROVIDER_RETRY_ATTEMPTS: int = 4
+    PROVIDER_RETRY_BASE_DELAY_SECONDS: float = 1
+    PROVIDER_RETRY_MAX_DELAY_SECONDS: float = 20
+    # overall deadline of one provider call including retries and rate limit waits
+    PROVIDER_CALL_DEADLINE_SECONDS: float = 600
+    CIRCUIT_FAILURE_THRESHOLD: int = 5
+    CIRCUIT_RECOVERY_SECONDS: float = 30
+
+    # streaming task status, events fan out across processes through redis when set
+    REDIS_URL: Optional[str] = None
+    # without redis each process polls the tasks its subscribers watch
+    TASK_EVENTS_POLL_INTERVAL_SECONDS: float = 2
+    TASK_EVENTS_HEARTBEAT_SECONDS: float = 15
+    TASK_EVENTS_QUEUE_SIZE: int = 100
+    TASK_EVENTS_MAX_TASK_IDS: int = 100
+
+    # read-through cache of /i2v/status, shared through redis when REDIS_URL is set
+    TASK_STATUS_CACHE_ENABLED: bool = True
+    # completed and failed tasks kept in memory per process
+    TASK_STATUS_CACHE_SIZE: int = 10000
+    # in-flight tasks, transitions overwrite the entry before it expires
+    TASK_STATUS_CACHE_TTL_SECONDS: float = 2
+    TASK_STATUS_CACHE_REDIS_TERMINAL_TTL_SECONDS: int = 7 * 24 * 3600
+    # without redis the API processes don't see asset evictions published by the
+    # worker, their completed and failed tasks are reloaded after this long
+    TASK_STATUS_CACHE_LOCAL_TERMINAL_TTL_SECONDS: float = 300
+
+    # event loop lag sampling, exported as event_loop_lag_seconds
+    EVENT_LOOP_MONITOR_INTERVAL_SECONDS: float = 0.5
+    EVENT_LOOP_LAG_WARN_SECONDS: float = 1
+
+    # shared aiohttp client pool
+    HTTP_CLIENT_POOL_SIZE: int = 100
+    HTTP_CLIENT_POOL_SIZE_PER_HOST: int = 20
+    HTTP_CLIENT_KEEPALIVE_TIMEOUT: float = 60
+    HTTP_CLIENT_DNS_CACHE_TTL: int = 300
+    HTTP_CLIENT_CONNECT_TIMEOUT: float = 10
+    HTTP_CLIENT_READ_TIMEOUT: float = 60
+    HTTP_CLIENT_TOTAL_TIMEOUT: float = 120
+    HTTP_CLIENT_DOWNLOAD_TIMEOUT: float = 900
+
+    # background reconciler polling submitted tasks at the provider
+    RECONCILER_ENABLED: bool = True
+    RECONCILER_INTERVAL_SECONDS: float = 10
+    # with push callbacks enabled polling is only a safety net
+    RECONCILER_CALLBACK_INTERVAL_SECONDS: float = 300
+    RECONCILER_BATCH_SIZE: int = 100
+    RECONCILER_CONCURRENCY: int = 10
+    # tasks still in flight at the provider after this long are failed
+    TASK_IN_FLIGHT_TIMEOUT_SECONDS: int = 24 * 3600
+    # a finalization claim older than this is taken over by another worker
+    FINALIZATION_LEASE_SECONDS: int = 1800
+    # a task still submitting after this long is failed, whether the provider got the
+    # request is unknown so it is never submitted again
+    SUBMISSION_TIMEOUT_SECONDS: int = 1800
+
     model_config = SettingsConfigDict(env_file=os.getenv("ENV_FILE"), env_file_encoding="utf-8", extra="ignore")
 
 
@@ -80,4 +80,6 @@ REALISTIC_SYSTEM_PROMPT = """
 - 起始状态
 - 主要运动过程
 - 最终状态
-"""
\ No newline at end of file
+"""
+# 修改上面的提示词后递增, 使旧的描述词缓存失效
+PROMPT_TEMPLATE_VERSION = 1
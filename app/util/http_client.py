@@ -0,0 +1,109 @@
+"""
+Shared aiohttp client pool used by all outbound provider and download calls
+"""
+import logging
+from typing import Optional
+
+import aiohttp
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+from app.settings import SETTINGS
+
+logger = logging.getLogger(__name__)
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def _create_session() -> aiohttp.ClientSession:
+    """create the pooled client session"""
+    connector = aiohttp.TCPConnector(
+        limit=SETTINGS.HTTP_CLIENT_POOL_SIZE,
+        limit_per_host=SETTINGS.HTTP_CLIENT_POOL_SIZE_PER_HOST,
+        keepalive_timeout=SETTINGS.HTTP_CLIENT_KEEPALIVE_TIMEOUT,
+        use_dns_cache=True,
+        ttl_dns_cache=SETTINGS.HTTP_CLIENT_DNS_CACHE_TTL,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=SETTINGS.HTTP_CLIENT_TOTAL_TIMEOUT,
+        sock_connect=SETTINGS.HTTP_CLIENT_CONNECT_TIMEOUT,
+        sock_read=SETTINGS.HTTP_CLIENT_READ_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def init_http_client() -> aiohttp.ClientSession:
+    """Create the shared session, called from app startup"""
+    global _session  # pylint: disable=global-statement
+    if _session is None or _session.closed:
+        _session = _create_session()
+        logger.info(
+            "http client pool started, limit: %s, limit per host: %s",
+            SETTINGS.HTTP_CLIENT_POOL_SIZE,
+            SETTINGS.HTTP_CLIENT_POOL_SIZE_PER_HOST,
+        )
+    return _session
+
+
+async def close_http_client() -> None:
+    """Close the shared session, called from app shutdown"""
+    global _session  # pylint: disable=global-statement
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("http client pool closed")
+    _session = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Get the shared session
+
+    Lazily creates the session for entry points that run without the app lifespan.
+    Must be called from inside a running event loop.
+    """
+    global _session  # pylint: disable=global-statement
+    if _session is None or _session.closed:
+        _session = _create_session()
+    return _session
+
+
+def download_timeout() -> aiohttp.ClientTimeout:
+    """Timeout for large file downloads, overrides the default total timeout"""
+    return aiohttp.ClientTimeout(
+        total=SETTINGS.HTTP_CLIENT_DOWNLOAD_TIMEOUT,
+        sock_connect=SETTINGS.HTTP_CLIENT_CONNECT_TIMEOUT,
+        sock_read=SETTINGS.HTTP_CLIENT_READ_TIMEOUT,
+    )
+
+
+class HttpClientPoolCollector(Collector):
+    """Prometheus collector exposing connection pool usage of the shared session"""
+
+    def collect(self):
+        limit = GaugeMetricFamily(
+            "http_client_pool_limit", "Max connections of the shared http client pool"
+        )
+        in_use = GaugeMetricFamily(
+            "http_client_pool_connections_in_use",
+            "Connections currently acquired from the shared http client pool",
+            labels=["host"],
+        )
+        idle = GaugeMetricFamily(
+            "http_client_pool_connections_idle",
+            "Keep-alive connections idling in the shared http client pool",
+            labels=["host"],
+        )
+
+        connector = _session.connector if _session is not None and not _session.closed else None
+        if connector is not None:
+            limit.add_metric([], connector.limit)
+            # aiohttp does not expose pool usage publicly, read the connector bookkeeping
+            for key, conns in getattr(connector, "_acquired_per_host", {}).items():
+                in_use.add_metric([key.host], len(conns))
+            for key, conns in getattr(connector, "_conns", {}).items():
+                idle.add_metric([key.host], len(conns))
+        else:
+            limit.add_metric([], 0)
+
+        yield limit
+        yield in_use
+        yield idle
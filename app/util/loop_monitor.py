@@ -0,0 +1,60 @@
+"""
+Event loop lag of the process
+
+A task sleeps for a fixed interval and measures how late it wakes up. Lag means a
+callback held the loop, e.g. CPU bound work or a blocking call, and every request
+handled by the process waited that long.
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from prometheus_client import Gauge
+
+from app.settings import SETTINGS
+
+logger = logging.getLogger(__name__)
+
+EVENT_LOOP_LAG = Gauge("event_loop_lag_seconds", "Delay of the latest event loop wake-up")
+
+
+class EventLoopLagMonitor:
+    """Samples the event loop lag into the event_loop_lag_seconds gauge"""
+
+    def __init__(
+        self,
+        interval: float = SETTINGS.EVENT_LOOP_MONITOR_INTERVAL_SECONDS,
+        warn_threshold: float = SETTINGS.EVENT_LOOP_LAG_WARN_SECONDS,
+    ):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """start sampling in the background"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self) -> None:
+        """stop sampling"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_forever(self) -> None:
+        """sample until cancelled"""
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - started - self.interval, 0)
+            EVENT_LOOP_LAG.set(lag)
+            if lag >= self.warn_threshold:
+                logger.warning("event loop blocked for %.3fs", lag)
+
+
+loop_monitor = EventLoopLagMonitor()
@@ -1,12 +1,11 @@
 import logging
-import aiohttp
 from fastapi import HTTPException
 
 from typing import Optional
 from uuid import uuid4
-from aiohttp import ClientSession
 from app.settings import SETTINGS
 from app.dependencies import get_s3_client
+from app.util.http_client import get_http_session
 
 logger = logging.getLogger(__name__)
 
@@ -39,13 +38,13 @@ async def download_image(image_url: str) -> Optional[bytes]:
     :return: Image data in bytes or None
     """
     try:
-        async with ClientSession() as session:
-            async with session.get(image_url) as response:
-                if response.status == 200:
-                    return await response.read()
-                else:
-                    logger.error("Failed to download image from URL: %s", image_url)
-                    return None
+        session = get_http_session()
+        async with session.get(image_url) as response:
+            if response.status == 200:
+                return await response.read()
+            else:
+                logger.error("Failed to download image from URL: %s", image_url)
+                return None
     except Exception as e:
         logger.error("Failed to download image: %s", e)
         return None
@@ -68,15 +67,15 @@ async def upload_image(token: str, file_name: str) -> dict:
         logger.info("Successfully retrieved file %s from S3", file_name)
         
         # 上传到 Musisoul 服务
-        async with aiohttp.ClientSession() as session:
-            files = {'init_img': file_data}
-            async with session.post(url, headers=headers, data=files) as response:
-                if response.status == 200:
-                    response_json = await response.json()
-                    return response_json['info']
-                else:
-                    logger.error("HTTP error: %s", await response.text())
-                    raise HTTPException(status_code=response.status, detail="Failed to upload image.")
+        session = get_http_session()
+        files = {'init_img': file_data}
+        async with session.post(url, headers=headers, data=files) as response:
+            if response.status == 200:
+                response_json = await response.json()
+                return response_json['info']
+            else:
+                logger.error("HTTP error: %s", await response.text())
+                raise HTTPException(status_code=response.status, detail="Failed to upload image.")
     except Exception as e:
         logger.error("upload image error: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error when uploading image.") from e
\ No newline at end of file
@@ -0,0 +1,296 @@
+"""
+Cacheable file responses with conditional requests and byte ranges
+
+Stored resources never change once written, generated filenames are unique, so
+responses carry a strong ETag and an immutable Cache-Control. Conditional requests
+are answered with 304, Range requests with 206, multiple ranges as
+multipart/byteranges.
+
+The body is sent with the ASGI zero-copy extension (sendfile) when the server
+offers it, otherwise read in large chunks off the event loop.
+"""
+import os
+import stat
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Mapping, Optional
+from urllib.parse import quote
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from app.settings import SETTINGS
+
+ZEROCOPY_EXTENSION = "http.response.zerocopy"
+
+# a range request with more ranges than this is answered with the whole file
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiableError(ValueError):
+    """None of the requested ranges overlaps the file"""
+
+
+def strong_etag(stat_result: os.stat_result) -> str:
+    """ETag of a stored file, size and mtime identify its content as files are never rewritten"""
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def cache_headers(stat_result: os.stat_result) -> dict[str, str]:
+    """validator and caching headers shared by 200, 206 and 304 responses"""
+    return {
+        "etag": strong_etag(stat_result),
+        "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "cache-control": f"public, max-age={SETTINGS.RESOURCE_CACHE_MAX_AGE_SECONDS}, immutable",
+        "accept-ranges": "bytes",
+    }
+
+
+def content_disposition(filename: str) -> str:
+    """attachment Content-Disposition, same as FileResponse"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match uses the weak comparison"""
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def _not_modified_since(header: str, stat_result: os.stat_result) -> bool:
+    try:
+        return int(stat_result.st_mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def is_not_modified(request_headers: Headers, stat_result: os.stat_result) -> bool:
+    """whether a GET or HEAD can be answered with 304 Not Modified"""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-Modified-Since is ignored when If-None-Match is present
+        return _etag_matches(if_none_match, strong_etag(stat_result))
+    if_modified_since = request_headers.get("if-modified-since")
+    return if_modified_since is not None and _not_modified_since(if_modified_since, stat_result)
+
+
+def parse_range_header(header: str, size: int) -> Optional[list[tuple[int, int]]]:
+    """byte ranges of a Range header as sorted, merged (start, end) pairs, end exclusive
+
+    Returns:
+        None when the header is malformed or asks for too many ranges, the whole file
+        is sent then
+
+    Raises:
+        RangeNotSatisfiableError: When no range overlaps the file
+    """
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs.strip():
+        return None
+    specs_list = specs.split(",")
+    if len(specs_list) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs_list:
+        first, sep, last = spec.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if not first:
+                # suffix range, the last n bytes
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, end = max(size - length, 0), size
+            else:
+                start = int(first)
+                end = int(last) + 1 if last else size
+                if start < 0 or (last and end <= start):
+                    return None
+                end = min(end, size)
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    if not ranges:
+        raise RangeNotSatisfiableError(header)
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        if start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _if_range_matches(header: str, stat_result: os.stat_result) -> bool:
+    """If-Range uses the strong comparison, a date must match the modification time exactly"""
+    if header.startswith('"'):
+        return header == strong_etag(stat_result)
+    try:
+        return int(parsedate_to_datetime(header).timestamp()) == int(stat_result.st_mtime)
+    except (TypeError, ValueError):
+        return False
+
+
+class CachedFileResponse(FileResponse):
+    """FileResponse with immutable caching headers and byte range support"""
+
+    chunk_size = 1024 * 1024
+
+    def __init__(
+        self,
+        path: str,
+        stat_result: os.stat_result,
+        ranges: Optional[list[tuple[int, int]]] = None,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: Optional[str] = None,
+        filename: Optional[str] = None,
+    ):
+        self.ranges = ranges or []
+        self.boundary = uuid.uuid4().hex if len(self.ranges) > 1 else None
+        self.part_type = media_type or "application/octet-stream"
+        if self.boundary is not None:
+            media_type = f"multipart/byteranges; boundary={self.boundary}"
+        super().__init__(
+            path,
+            status_code=206 if self.ranges else 200,
+            headers={**cache_headers(stat_result), **(headers or {})},
+            media_type=media_type,
+            filename=filename,
+            stat_result=stat_result,
+        )
+
+    def set_stat_headers(self, stat_result: os.stat_result) -> None:
+        size = stat_result.st_size
+        if len(self.ranges) == 1:
+            start, end = self.ranges[0]
+            self.headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+            content_length = end - start
+        elif self.ranges:
+            content_length = sum(
+                len(self._part_header(start, end, size)) + end - start + 2 for start, end in self.ranges
+            ) + len(self._closing_boundary())
+        else:
+            content_length = size
+        self.headers["content-length"] = str(content_length)
+
+    def _part_header(self, start: int, end: int, size: int) -> bytes:
+        return (
+            f"--{self.boundary}\r\n"
+            f"content-type: {self.part_type}\r\n"
+            f"content-range: bytes {start}-{end - 1}/{size}\r\n\r\n"
+        ).encode("latin-1")
+
+    def _closing_boundary(self) -> bytes:
+        return f"--{self.boundary}--\r\n".encode("latin-1")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        zerocopy = ZEROCOPY_EXTENSION in scope.get("extensions", {})
+        size = self.stat_result.st_size
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            if not self.ranges:
+                await self._send_range(send, file, 0, size, zerocopy, more_body=False)
+            elif self.boundary is None:
+                start, end = self.ranges[0]
+                await self._send_range(send, file, start, end, zerocopy, more_body=False)
+            else:
+                for start, end in self.ranges:
+                    await send({
+                        "type": "http.response.body",
+                        "body": self._part_header(start, end, size),
+                        "more_body": True,
+                    })
+                    await self._send_range(send, file, start, end, zerocopy, more_body=True)
+                    await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+                await send({"type": "http.response.body", "body": self._closing_boundary(), "more_body": False})
+
+    async def _send_range(
+        self, send: Send, file: anyio.AsyncFile, start: int, end: int, zerocopy: bool, more_body: bool
+    ) -> None:
+        """send the bytes start..end of the open file"""
+        if zerocopy:
+            # the server copies from the file descriptor to the socket in the kernel
+            await send({
+                "type": ZEROCOPY_EXTENSION,
+                "file": file.wrapped,
+                "offset": start,
+                "count": end - start,
+                "more_body": more_body,
+            })
+            return
+        await file.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = await file.read(min(self.chunk_size, remaining))
+            if not chunk:
+                raise IOError(f"File {self.path} shrank while being sent")
+            remaining -= len(chunk)
+            await send({
+                "type": "http.response.body",
+                "body": chunk,
+                "more_body": more_body or remaining > 0,
+            })
+        if end == start:
+            await send({"type": "http.response.body", "body": b"", "more_body": more_body})
+
+
+async def cached_file_response(
+    request_headers: Headers,
+    path: str,
+    media_type: Optional[str] = None,
+    filename: Optional[str] = None,
+    accel_redirect: Optional[str] = None,
+) -> Response:
+    """Response for a stored file honoring conditional and Range request headers
+
+    Args:
+        request_headers: Headers of the request
+        path: Physical path of the file
+        media_type: Content type, guessed from the filename when missing
+        filename: Download filename of the Content-Disposition header
+        accel_redirect: Internal location to hand the delivery over to the reverse
+            proxy with X-Accel-Redirect, it serves ranges and sendfile itself
+
+    Raises:
+        FileNotFoundError: When the file does not exist
+    """
+    stat_result = await anyio.to_thread.run_sync(os.stat, path)
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise FileNotFoundError(path)
+
+    if is_not_modified(request_headers, stat_result):
+        return Response(status_code=304, headers=cache_headers(stat_result))
+
+    if accel_redirect is not None:
+        headers = {**cache_headers(stat_result), "x-accel-redirect": accel_redirect}
+        if filename is not None:
+            headers["content-disposition"] = content_disposition(filename)
+        return Response(headers=headers, media_type=media_type)
+
+    ranges = None
+    range_header = request_headers.get("range")
+    if_range = request_headers.get("if-range")
+    if range_header is not None and (if_range is None or _if_range_matches(if_range, stat_result)):
+        try:
+            ranges = parse_range_header(range_header, stat_result.st_size)
+        except RangeNotSatisfiableError:
+            return Response(
+                status_code=416,
+                headers={"content-range": f"bytes */{stat_result.st_size}", "accept-ranges": "bytes"},
+            )
+    return CachedFileResponse(path, stat_result, ranges, media_type=media_type, filename=filename)
@@ -1,12 +1,33 @@
 import os
 import base64
+import hashlib
 import uuid
 import aiofiles
+import mimetypes
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Tuple
+from typing import AsyncIterator, Optional, Tuple
 
 ASSET_ROOT = "asset"  # Base storage path
+STREAM_CHUNK_SIZE = 256 * 1024  # Chunk size for streamed reads and writes
+INPUT_DIR = "input"  # Uploaded source images
+OUTPUT_DIR = "output"  # Generated videos
+DERIVED_DIR = "derived"  # Posters and previews of generated videos
+ASSET_CLASS_DIRS = (INPUT_DIR, OUTPUT_DIR, DERIVED_DIR)
+
+
+class FileTooLargeError(IOError):
+    """Raised when streamed content exceeds the allowed size"""
+
+
+@dataclass
+class SavedFile:
+    """Result of a streamed save"""
+
+    filename: str
+    size: int
+    sha256: str
 
 async def ensure_directory(directory: str) -> None:
     """Ensure directory exists"""
@@ -17,13 +38,26 @@ def generate_filename(original_filename: str) -> str:
     ext = os.path.splitext(original_filename)[1]
     return f"{datetime.now().strftime('%Y%m%d')}_{uuid.uuid4().hex[:8]}{ext}"
 
+def shard_filename(basename: str, sub_dir: str = "") -> str:
+    """Sharded relative path of a file, e.g. output/3f/a2/20250101_1a2b3c4d.mp4
+
+    Two levels of hash prefix directories keep every directory small.
+    """
+    digest = hashlib.md5(basename.encode("utf-8"), usedforsecurity=False).hexdigest()
+    return os.path.join(sub_dir, digest[:2], digest[2:4], basename)
+
+def asset_class_dir(filename: str) -> str:
+    """Class directory of a file, the one it is stored in, by its type for flat filenames"""
+    class_dir = filename.split(os.sep, 1)[0]
+    if class_dir in ASSET_CLASS_DIRS and class_dir != filename:
+        return class_dir
+    mime_type, _ = mimetypes.guess_type(filename)
+    return OUTPUT_DIR if mime_type and mime_type.startswith("video/") else INPUT_DIR
+
 async def generate_file_path(original_filename: str, sub_dir: str = "") -> str:
     """Generate filename for storage"""
-    new_filename = generate_filename(original_filename)
-    
-    if sub_dir:
-        new_filename = os.path.join(sub_dir, new_filename)
-    
+    new_filename = shard_filename(generate_filename(original_filename), sub_dir)
+
     full_path = os.path.join(ASSET_ROOT, new_filename)
     await ensure_directory(os.path.dirname(full_path))
     
@@ -66,6 +100,102 @@ async def save_binary_file(binary_content: bytes, original_filename: str, sub_di
         
     return filename
 
+async def save_stream_file(
+    chunks: AsyncIterator[bytes],
+    original_filename: str,
+    sub_dir: str = "",
+    expected_size: Optional[int] = None,
+    max_size: Optional[int] = None,
+    content_addressed: bool = False
+) -> SavedFile:
+    """Save streamed file content with bounded memory
+
+    Chunks are written to a temp file next to the target which is renamed into place
+    once complete, so readers never see a partial file.
+
+    Content addressed files are named after the sha256 of their content, identical
+    content is stored once.
+
+    Args:
+        chunks: Async iterator of file content chunks
+        original_filename: Original filename
+        sub_dir: Subdirectory name, e.g. 'images', 'videos'
+        expected_size: Size announced by the source, a mismatch discards the file
+        max_size: Abort as soon as more than this many bytes arrived
+        content_addressed: Name the file after its content hash
+
+    Returns:
+        SavedFile: Generated filename, size in bytes and sha256 hex digest
+
+    Raises:
+        FileTooLargeError: When more than max_size bytes arrived
+        IOError: When fewer or more bytes than expected_size arrived
+    """
+    filename = await generate_file_path(original_filename, sub_dir)
+    full_path = os.path.join(ASSET_ROOT, filename)
+    tmp_path = f"{full_path}.{uuid.uuid4().hex[:8]}.tmp"
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, 'wb') as f:
+            async for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    raise FileTooLargeError(f"File exceeds {max_size} bytes")
+                await f.write(chunk)
+        if expected_size is not None and size != expected_size:
+            raise IOError(f"Incomplete file: received {size} of {expected_size} bytes")
+        if content_addressed:
+            filename = content_addressed_filename(digest.hexdigest(), original_filename, sub_dir)
+            full_path = os.path.join(ASSET_ROOT, filename)
+            await ensure_directory(os.path.dirname(full_path))
+        os.replace(tmp_path, full_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return SavedFile(filename=filename, size=size, sha256=digest.hexdigest())
+
+def content_addressed_filename(sha256: str, original_filename: str, sub_dir: str = "") -> str:
+    """Filename of content addressed storage, named after the content hash"""
+    return shard_filename(f"{sha256}{os.path.splitext(original_filename)[1]}", sub_dir)
+
+async def iter_bytes(content: bytes) -> AsyncIterator[bytes]:
+    """Async iterator over in-memory content, for the streaming save functions"""
+    for start in range(0, len(content), STREAM_CHUNK_SIZE):
+        yield content[start:start + STREAM_CHUNK_SIZE]
+
+async def delete_file(relative_path: str) -> None:
+    """Delete a stored file, missing files are ignored
+
+    Args:
+        relative_path: Relative path of file
+    """
+    try:
+        os.remove(get_file_path(relative_path))
+    except FileNotFoundError:
+        pass
+
+def validate_filename(relative_path: str) -> str:
+    """Normalized relative path of a stored file
+
+    Raises:
+        FileNotFoundError: When the path is absolute or leaves the asset directory
+    """
+    normalized = os.path.normpath(relative_path)
+    if (
+        not relative_path
+        or os.path.isabs(normalized)
+        or normalized == os.pardir
+        or normalized.startswith(os.pardir + os.sep)
+        or "\0" in normalized
+    ):
+        raise FileNotFoundError(f"Invalid file path: {relative_path}")
+    return normalized
+
 def get_file_path(relative_path: str) -> str:
     """Get full physical path of file
     
@@ -74,8 +204,26 @@ def get_file_path(relative_path: str) -> str:
         
     Returns:
         str: Full physical path of file
+
+    Raises:
+        FileNotFoundError: When the path leaves the asset directory
+    """
+    return os.path.join(ASSET_ROOT, validate_filename(relative_path))
+
+async def read_file(relative_path: str) -> bytes:
+    """Read file content
+
+    Args:
+        relative_path: Relative path of file
+
+    Returns:
+        bytes: File content
+
+    Raises:
+        FileNotFoundError: When file does not exist
     """
-    return os.path.join(ASSET_ROOT, relative_path)
+    async with aiofiles.open(get_file_path(relative_path), "rb") as f:
+        return await f.read()
 
 async def read_file_to_base64(relative_path: str) -> str:
     """Read file and convert to base64 encoding
@@ -0,0 +1,287 @@
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from app.settings import SETTINGS
+from app.utils.storage import storage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IMAGE_MIME_TYPE = "image/jpeg"
+
+# magic bytes of the image formats we accept
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+IMAGE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/bmp": ".bmp",
+}
+SNIFF_SIZE = 12
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+class InvalidImageError(ValueError):
+    """Raised when content is not an image we can process"""
+
+
+class ImageHandle:
+    """Source image shared by the pipeline stages
+
+    The image is read and base64 encoded at most once, on first use, and the
+    resulting `data:` URL is shared by the LLM and video provider calls. A handle
+    built from the request payload skips the disk round trip entirely.
+    """
+
+    def __init__(
+        self,
+        data: Optional[bytes] = None,
+        base64_data: Optional[str] = None,
+        filename: Optional[str] = None,
+        mime_type: str = DEFAULT_IMAGE_MIME_TYPE,
+        sha256: Optional[str] = None,
+    ):
+        self.filename = filename
+        self.mime_type = mime_type
+        self._data = data
+        self._base64_data = base64_data
+        self._data_url: Optional[str] = None
+        self._sha256 = sha256
+
+    @classmethod
+    def from_bytes(
+        cls, data: bytes, mime_type: str = DEFAULT_IMAGE_MIME_TYPE, sha256: Optional[str] = None
+    ) -> "ImageHandle":
+        """Handle for raw image bytes"""
+        return cls(data=data, mime_type=mime_type, sha256=sha256)
+
+    @classmethod
+    def from_base64(
+        cls, base64_data: str, mime_type: str = DEFAULT_IMAGE_MIME_TYPE, sha256: Optional[str] = None
+    ) -> "ImageHandle":
+        """Handle for an already base64 encoded image, e.g. from the request body"""
+        return cls(base64_data=base64_data, mime_type=mime_type, sha256=sha256)
+
+    @classmethod
+    def from_file(
+        cls, filename: str, mime_type: str = DEFAULT_IMAGE_MIME_TYPE, sha256: Optional[str] = None
+    ) -> "ImageHandle":
+        """Handle for a stored image, read lazily"""
+        return cls(filename=filename, mime_type=mime_type, sha256=sha256)
+
+    async def get_bytes(self) -> bytes:
+        """Get the raw image bytes, decoding or reading them on first use"""
+        if self._data is None:
+            if self._base64_data is not None:
+                self._data = base64.b64decode(self._base64_data)
+            elif self._data_url is not None:
+                self._data = base64.b64decode(self._data_url.split(",", 1)[1])
+            else:
+                self._data = await storage.read(self.filename)
+        return self._data
+
+    async def get_sha256(self) -> str:
+        """Get the sha256 hex digest of the image content"""
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(await self.get_bytes()).hexdigest()
+        return self._sha256
+
+    async def get_data_url(self) -> str:
+        """Get the `data:` URL of the image, encoding it on first use
+
+        Only the data URL is kept afterwards, the raw bytes and the plain base64
+        string are released.
+        """
+        if self._data_url is None:
+            if self._base64_data is None:
+                self._base64_data = base64.b64encode(await self.get_bytes()).decode("ascii")
+            self._data_url = f"data:{self.mime_type};base64,{self._base64_data}"
+            self._data = None
+            self._base64_data = None
+        return self._data_url
+
+
+class NormalizedImage:
+    """Renditions of a source image sized for each consumer"""
+
+    def __init__(self, llm: ImageHandle, provider: ImageHandle):
+        self.llm = llm
+        self.provider = provider
+
+
+def sniff_image_mime_type(head: bytes) -> Optional[str]:
+    """Detect the image format from the first bytes of the content
+
+    Returns:
+        Optional[str]: Mime type, or None if the content is not a supported image
+    """
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    return None
+
+
+def sniff_base64_image(base64_content: str) -> str:
+    """Detect the image format of base64 encoded content
+
+    Raises:
+        InvalidImageError: When the content is not a supported image
+    """
+    try:
+        head = base64.b64decode(base64_content[:16])
+    except ValueError as e:
+        raise InvalidImageError("image is not valid base64") from e
+    mime_type = sniff_image_mime_type(head)
+    if mime_type is None:
+        raise InvalidImageError("unsupported image format")
+    return mime_type
+
+
+async def sniff_image_stream(chunks: AsyncIterator[bytes]) -> Tuple[str, AsyncIterator[bytes]]:
+    """Detect the image format of streamed content without consuming it
+
+    Returns:
+        Tuple[str, AsyncIterator[bytes]]: Mime type and an iterator over the full content
+
+    Raises:
+        InvalidImageError: When the content is not a supported image
+    """
+    head = b""
+    async for chunk in chunks:
+        head += chunk
+        if len(head) >= SNIFF_SIZE:
+            break
+
+    mime_type = sniff_image_mime_type(head)
+    if mime_type is None:
+        raise InvalidImageError("unsupported image format")
+
+    async def _replay() -> AsyncIterator[bytes]:
+        yield head
+        async for chunk in chunks:
+            yield chunk
+
+    return mime_type, _replay()
+
+
+def image_extension(mime_type: str) -> str:
+    """File extension for a sniffed mime type"""
+    return IMAGE_EXTENSIONS.get(mime_type, ".jpg")
+
+
+def init_image_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Create the process pool running image normalization"""
+    global _process_pool  # pylint: disable=global-statement
+    if _process_pool is None:
+        # spawn, forking a process with a running event loop and threads is unsafe
+        _process_pool = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+
+def shutdown_image_process_pool() -> None:
+    """Shut down the image process pool"""
+    global _process_pool  # pylint: disable=global-statement
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def _encode_jpeg(image: Image.Image, target_bytes: int) -> bytes:
+    """encode as JPEG, lowering the quality until the target size is met"""
+    data = b""
+    for quality in (90, 85, 80, 75, 70, 60, 50):
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+        data = buffer.getvalue()
+        if len(data) <= target_bytes:
+            break
+    return data
+
+
+def _normalize_image_sync(data: bytes, renditions: list[Tuple[int, int]]) -> list[bytes]:
+    """Decode an image once and produce JPEG renditions
+
+    Runs in the process pool.
+
+    Args:
+        data: Source image content
+        renditions: (max side in pixels, target size in bytes) per rendition
+
+    Returns:
+        list[bytes]: JPEG content per rendition
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        # JPEG 可以在解码时直接降采样
+        largest = max(max_side for max_side, _ in renditions)
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel("A"))
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise InvalidImageError(f"cannot decode image: {e}") from e
+
+    results = []
+    for max_side, target_bytes in renditions:
+        rendition = image.copy()
+        rendition.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        results.append(_encode_jpeg(rendition, target_bytes))
+    return results
+
+
+async def normalize_image(
+    image: ImageHandle,
+    llm_max_side: int,
+    llm_target_bytes: int,
+    provider_max_side: int,
+    provider_target_bytes: int,
+) -> NormalizedImage:
+    """Downscale and re-encode the source image for the LLM and the video provider
+
+    The work runs in the process pool so the event loop is never blocked. When both
+    consumers end up with the same rendition they share one handle.
+
+    Raises:
+        InvalidImageError: When the content is not a decodable image
+    """
+    data = await image.get_bytes()
+    if sniff_image_mime_type(data[:SNIFF_SIZE]) is None:
+        raise InvalidImageError("unsupported image format")
+
+    loop = asyncio.get_running_loop()
+    llm_data, provider_data = await loop.run_in_executor(
+        init_image_process_pool(SETTINGS.IMAGE_PROCESS_POOL_SIZE),
+        _normalize_image_sync,
+        data,
+        [(llm_max_side, llm_target_bytes), (provider_max_side, provider_target_bytes)],
+    )
+    logger.info(
+        "image normalized, source: %d bytes, llm: %d bytes, provider: %d bytes",
+        len(data), len(llm_data), len(provider_data)
+    )
+
+    provider = ImageHandle.from_bytes(provider_data, "image/jpeg")
+    if llm_data == provider_data:
+        return NormalizedImage(llm=provider, provider=provider)
+    return NormalizedImage(llm=ImageHandle.from_bytes(llm_data, "image/jpeg"), provider=provider)
@@ -0,0 +1,138 @@
+from typing import AsyncIterator, Dict, List, Optional
+
+import multipart
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import parse_options_header
+from starlette.datastructures import Headers
+
+from app.utils.file_utils import FileTooLargeError
+
+MAX_FIELD_SIZE = 1024  # Text fields sent along with an upload are short
+MULTIPART_OVERHEAD = 64 * 1024  # Allowed body size beyond the file: boundaries, part headers and fields
+
+
+class MultipartError(ValueError):
+    """Raised when a multipart body is malformed or not the expected form"""
+
+
+class MultipartFileReader:
+    """Streams the file of a multipart/form-data body without spooling it
+
+    The body is parsed as it arrives, the content of the single file part is handed
+    on chunk by chunk and the text fields are collected in `fields`. Fields sent after
+    the file are only known once `file_chunks()` is exhausted.
+    """
+
+    def __init__(
+        self,
+        headers: Headers,
+        stream: AsyncIterator[bytes],
+        file_field: str,
+        max_size: int,
+        max_fields: int = 1,
+    ):
+        _, params = parse_options_header(headers.get("content-type", ""))
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise MultipartError("missing multipart boundary")
+
+        self.fields: Dict[str, str] = {}
+        self.file_field = file_field
+        self.max_size = max_size
+        self.max_fields = max_fields
+        self._stream = stream
+        self._pending: List[bytes] = []
+        self._header_field = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._part_name: Optional[str] = None
+        self._part_value = b""
+        self._in_file = False
+        self._file_started = False
+        self._file_finished = False
+        self._parser = multipart.MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+        })
+
+    async def file_chunks(self) -> AsyncIterator[bytes]:
+        """Content of the file part as the body arrives
+
+        Raises:
+            MultipartError: When the body is malformed or holds no complete file part
+            FileTooLargeError: When the body exceeds max_size plus MULTIPART_OVERHEAD
+        """
+        received = 0
+        async for chunk in self._stream:
+            received += len(chunk)
+            if received > self.max_size + MULTIPART_OVERHEAD:
+                raise FileTooLargeError(f"content exceeds {self.max_size} bytes")
+            self._write(chunk)
+            if self._pending:
+                data = b"".join(self._pending)
+                self._pending.clear()
+                yield data
+        self._parser.finalize()
+        if not self._file_started:
+            raise MultipartError(f"{self.file_field} file is required")
+        if not self._file_finished:
+            raise MultipartError("incomplete multipart body")
+
+    def _write(self, chunk: bytes) -> None:
+        """feed a chunk to the parser, parser errors are reported as MultipartError"""
+        try:
+            self._parser.write(chunk)
+        except MultipartParseError as e:
+            raise MultipartError(f"malformed multipart body: {e}") from e
+
+    def _on_part_begin(self) -> None:
+        self._disposition = b""
+        self._part_name = None
+        self._part_value = b""
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        if self._header_field.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        name = options.get(b"name")
+        if name is None:
+            raise MultipartError('part without a "name" in its content-disposition')
+        self._part_name = name.decode("latin-1")
+        if b"filename" in options:
+            if self._part_name != self.file_field:
+                raise MultipartError(f"unexpected file field {self._part_name}")
+            if self._file_started:
+                raise MultipartError(f"only one {self.file_field} file is accepted")
+            self._in_file = self._file_started = True
+        elif len(self.fields) >= self.max_fields:
+            raise MultipartError(f"too many fields, maximum is {self.max_fields}")
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_file:
+            self._pending.append(data[start:end])
+            return
+        self._part_value += data[start:end]
+        if len(self._part_value) > MAX_FIELD_SIZE:
+            raise MultipartError(f"field {self._part_name} exceeds {MAX_FIELD_SIZE} bytes")
+
+    def _on_part_end(self) -> None:
+        if self._in_file:
+            self._in_file = False
+            self._file_finished = True
+        else:
+            self.fields[self._part_name] = self._part_value.decode("utf-8", errors="replace")
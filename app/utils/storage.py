@@ -0,0 +1,347 @@
+"""
+Asset storage backends
+
+Uploaded images and generated videos are stored through the backend selected by
+STORAGE_BACKEND:
+
+- local: the ASSET_ROOT directory, every process serving /resource needs the disk
+- s3: an S3 compatible bucket, e.g. AWS S3 or MinIO, shared by all replicas; videos
+  are delivered by redirecting to presigned URLs
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import AsyncExitStack
+from typing import AsyncIterator, Optional
+
+import anyio
+from botocore.exceptions import ClientError
+
+from app.dependencies import get_s3_client
+from app.settings import SETTINGS
+from app.utils import file_utils
+from app.utils.file_response import content_disposition
+from app.utils.file_utils import FileTooLargeError, SavedFile
+
+logger = logging.getLogger(__name__)
+
+LOCAL_STORAGE = "local"
+S3_STORAGE = "s3"
+
+
+class StorageBackend(ABC):
+    """Where assets are stored, files are addressed by their relative filename"""
+
+    async def start(self) -> None:
+        """open connections, called from app startup"""
+
+    async def close(self) -> None:
+        """release connections, called from app shutdown"""
+
+    @abstractmethod
+    async def save_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        original_filename: str,
+        sub_dir: str = "",
+        expected_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        content_addressed: bool = False,
+    ) -> SavedFile:
+        """Save streamed content under a generated filename, see file_utils.save_stream_file
+
+        Raises:
+            FileTooLargeError: When more than max_size bytes arrived
+            IOError: When fewer or more bytes than expected_size arrived
+        """
+
+    @abstractmethod
+    async def read(self, filename: str) -> bytes:
+        """Read a stored file
+
+        Raises:
+            FileNotFoundError: When file does not exist
+        """
+
+    @abstractmethod
+    async def exists(self, filename: str) -> bool:
+        """Whether a file is stored"""
+
+    @abstractmethod
+    async def delete(self, filename: str) -> None:
+        """Delete a stored file, missing files are ignored"""
+
+    @abstractmethod
+    async def last_modified(self, filename: str) -> Optional[float]:
+        """Unix time the file was written, None when it does not exist"""
+
+    def local_path(self, filename: str) -> Optional[str]:
+        """Physical path of a file stored on this host, None for remote storage"""
+        return None
+
+    async def mark_served(self, filename: str) -> None:
+        """Record that a file was delivered, for evicting the least recently served ones"""
+
+    async def presigned_url(self, filename: str, download_name: Optional[str] = None) -> Optional[str]:
+        """Temporary URL to download a file directly from the storage, None when not supported"""
+        return None
+
+
+class LocalStorageBackend(StorageBackend):
+    """Files in the ASSET_ROOT directory"""
+
+    async def save_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        original_filename: str,
+        sub_dir: str = "",
+        expected_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        content_addressed: bool = False,
+    ) -> SavedFile:
+        return await file_utils.save_stream_file(
+            chunks, original_filename, sub_dir, expected_size, max_size, content_addressed
+        )
+
+    async def read(self, filename: str) -> bytes:
+        return await file_utils.read_file(filename)
+
+    async def exists(self, filename: str) -> bool:
+        return os.path.isfile(file_utils.get_file_path(filename))
+
+    async def delete(self, filename: str) -> None:
+        await file_utils.delete_file(filename)
+
+    async def last_modified(self, filename: str) -> Optional[float]:
+        try:
+            return os.stat(file_utils.get_file_path(filename)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def local_path(self, filename: str) -> Optional[str]:
+        path = file_utils.get_file_path(filename)
+        if os.sep not in file_utils.validate_filename(filename) and not os.path.exists(path):
+            # 迁移到分片目录之前发出的旧链接
+            path = file_utils.get_file_path(
+                file_utils.shard_filename(filename, file_utils.asset_class_dir(filename))
+            )
+        return path
+
+    async def mark_served(self, filename: str) -> None:
+        # the access time tracks serving, mtime stays the ETag and isn't touched
+        path = self.local_path(filename)
+        try:
+            stat_result = await anyio.to_thread.run_sync(os.stat, path)
+            now = time.time()
+            if now - stat_result.st_atime >= SETTINGS.ASSET_SERVED_TOUCH_INTERVAL_SECONDS:
+                await anyio.to_thread.run_sync(os.utime, path, (now, stat_result.st_mtime))
+        except OSError as e:
+            logger.warning("mark file served failure, file: %s, error: %s", filename, e)
+
+
+class S3StorageBackend(StorageBackend):
+    """Objects in an S3 compatible bucket
+
+    Content is streamed to the bucket with a multipart upload, one part buffered in
+    memory at a time, so large videos never sit in memory or on local disk.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        key_prefix: str = "",
+        part_size: int = SETTINGS.S3_MULTIPART_PART_SIZE,
+        presigned_url_expires: int = SETTINGS.S3_PRESIGNED_URL_EXPIRES_SECONDS,
+    ):
+        self.bucket = bucket
+        self.key_prefix = key_prefix
+        # S3 rejects parts smaller than 5 MiB, except the last one
+        self.part_size = max(part_size, 5 * 1024 * 1024)
+        self.presigned_url_expires = presigned_url_expires
+        self._client = None
+        self._exit_stack: Optional[AsyncExitStack] = None
+
+    def _key(self, filename: str) -> str:
+        return self.key_prefix + file_utils.validate_filename(filename)
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._exit_stack = AsyncExitStack()
+            self._client = await self._exit_stack.enter_async_context(get_s3_client())
+            logger.info("s3 storage started, bucket: %s", self.bucket)
+
+    async def close(self) -> None:
+        if self._exit_stack is not None:
+            await self._exit_stack.aclose()
+            self._exit_stack = None
+            self._client = None
+
+    async def _get_client(self):
+        """the shared client, opened on first use for entry points without the lifespan"""
+        await self.start()
+        return self._client
+
+    async def save_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        original_filename: str,
+        sub_dir: str = "",
+        expected_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        content_addressed: bool = False,
+    ) -> SavedFile:
+        filename = file_utils.shard_filename(file_utils.generate_filename(original_filename), sub_dir)
+        # 内容寻址的文件要等哈希算完才知道文件名, 先上传到临时 key
+        upload_filename = f"{filename}.{uuid.uuid4().hex[:8]}.tmp" if content_addressed else filename
+        content_type = mimetypes.guess_type(original_filename)[0] or "application/octet-stream"
+
+        digest = hashlib.sha256()
+        size = 0
+        upload = _MultipartUpload(
+            await self._get_client(), self.bucket, self._key(upload_filename), content_type
+        )
+        buffer = bytearray()
+        try:
+            async for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    raise FileTooLargeError(f"File exceeds {max_size} bytes")
+                buffer += chunk
+                if len(buffer) >= self.part_size:
+                    await upload.upload_part(bytes(buffer))
+                    buffer.clear()
+            if expected_size is not None and size != expected_size:
+                raise IOError(f"Incomplete file: received {size} of {expected_size} bytes")
+            await upload.complete(bytes(buffer))
+        except BaseException:
+            await upload.abort()
+            raise
+
+        if content_addressed:
+            filename = file_utils.content_addressed_filename(digest.hexdigest(), original_filename, sub_dir)
+            await self._move(upload_filename, filename)
+        return SavedFile(filename=filename, size=size, sha256=digest.hexdigest())
+
+    async def _move(self, source: str, target: str) -> None:
+        """rename an object, identical content already stored under target is kept"""
+        client = await self._get_client()
+        try:
+            if not await self.exists(target):
+                await client.copy_object(
+                    Bucket=self.bucket,
+                    Key=self._key(target),
+                    CopySource={"Bucket": self.bucket, "Key": self._key(source)},
+                )
+        finally:
+            await self.delete(source)
+
+    async def read(self, filename: str) -> bytes:
+        client = await self._get_client()
+        try:
+            response = await client.get_object(Bucket=self.bucket, Key=self._key(filename))
+        except ClientError as e:
+            if _is_not_found(e):
+                raise FileNotFoundError(f"File not found: {filename}") from e
+            raise
+        async with response["Body"] as body:
+            return await body.read()
+
+    async def exists(self, filename: str) -> bool:
+        client = await self._get_client()
+        try:
+            await client.head_object(Bucket=self.bucket, Key=self._key(filename))
+            return True
+        except ClientError as e:
+            if _is_not_found(e):
+                return False
+            raise
+
+    async def delete(self, filename: str) -> None:
+        client = await self._get_client()
+        await client.delete_object(Bucket=self.bucket, Key=self._key(filename))
+
+    async def last_modified(self, filename: str) -> Optional[float]:
+        client = await self._get_client()
+        try:
+            response = await client.head_object(Bucket=self.bucket, Key=self._key(filename))
+        except ClientError as e:
+            if _is_not_found(e):
+                return None
+            raise
+        return response["LastModified"].timestamp()
+
+    async def presigned_url(self, filename: str, download_name: Optional[str] = None) -> Optional[str]:
+        client = await self._get_client()
+        params = {"Bucket": self.bucket, "Key": self._key(filename)}
+        if download_name is not None:
+            params["ResponseContentDisposition"] = content_disposition(download_name)
+        return await client.generate_presigned_url(
+            "get_object", Params=params, ExpiresIn=self.presigned_url_expires
+        )
+
+
+class _MultipartUpload:
+    """Upload of one object, a single PUT unless it grows beyond one part"""
+
+    def __init__(self, client, bucket: str, key: str, content_type: str):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.upload_id: Optional[str] = None
+        self.parts: list[dict] = []
+
+    async def upload_part(self, data: bytes) -> None:
+        if self.upload_id is None:
+            response = await self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type
+            )
+            self.upload_id = response["UploadId"]
+        part_number = len(self.parts) + 1
+        response = await self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=data
+        )
+        self.parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+
+    async def complete(self, data: bytes) -> None:
+        """upload the remaining data and finish the object"""
+        if self.upload_id is None:
+            await self.client.put_object(
+                Bucket=self.bucket, Key=self.key, Body=data, ContentType=self.content_type
+            )
+            return
+        if data:
+            await self.upload_part(data)
+        await self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": self.parts}
+        )
+
+    async def abort(self) -> None:
+        """discard uploaded parts, S3 keeps and bills them otherwise"""
+        if self.upload_id is None:
+            return
+        try:
+            await self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except Exception as e: # pylint: disable=broad-except
+            logger.error("abort multipart upload failure, key: %s, error: %s", self.key, e)
+
+
+def _is_not_found(error: ClientError) -> bool:
+    return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+
+def create_storage() -> StorageBackend:
+    """storage backend of the settings"""
+    if SETTINGS.STORAGE_BACKEND == S3_STORAGE:
+        if not SETTINGS.AWS_S3_BUCKET_NAME:
+            raise ValueError("AWS_S3_BUCKET_NAME is required for the s3 storage backend")
+        return S3StorageBackend(SETTINGS.AWS_S3_BUCKET_NAME, SETTINGS.S3_KEY_PREFIX)
+    return LocalStorageBackend()
+
+
+storage = create_storage()
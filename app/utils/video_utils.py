@@ -0,0 +1,99 @@
+"""
+Poster frames and preview renditions of videos with ffmpeg
+
+ffmpeg runs as a child process, so the encoding never blocks the event loop. At most
+VIDEO_DERIVATIVE_CONCURRENCY of them run at once per process, ffmpeg already uses
+several cores per encode.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from app.settings import SETTINGS
+
+logger = logging.getLogger(__name__)
+
+_ffmpeg_slots: Optional[asyncio.Semaphore] = None
+
+
+class FfmpegError(RuntimeError):
+    """Raised when ffmpeg fails or runs too long"""
+
+
+def _slots() -> asyncio.Semaphore:
+    global _ffmpeg_slots  # pylint: disable=global-statement
+    if _ffmpeg_slots is None:
+        _ffmpeg_slots = asyncio.Semaphore(SETTINGS.VIDEO_DERIVATIVE_CONCURRENCY)
+    return _ffmpeg_slots
+
+
+async def run_ffmpeg(args: list[str], timeout: float = SETTINGS.VIDEO_DERIVATIVE_TIMEOUT_SECONDS) -> None:
+    """Run ffmpeg with the given arguments once a slot is free
+
+    Raises:
+        FfmpegError: When ffmpeg exits with an error or doesn't finish within timeout
+    """
+    async with _slots():
+        try:
+            process = await asyncio.create_subprocess_exec(
+                SETTINGS.FFMPEG_PATH, "-nostdin", "-hide_banner", "-loglevel", "error", "-y", *args,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except OSError as e:
+            raise FfmpegError(f"cannot start ffmpeg: {e}") from e
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+        except BaseException:
+            # timeout or cancellation, don't leave the encoder running
+            process.kill()
+            await process.wait()
+            raise
+    if process.returncode != 0:
+        raise FfmpegError(f"ffmpeg exited with {process.returncode}: {stderr.decode(errors='replace')[-500:]}")
+
+
+def _scale_filter(max_width: int) -> str:
+    """downscale to at most max_width, keeping the aspect ratio and an even height"""
+    return f"scale='min({max_width},iw)':-2"
+
+
+async def render_poster(source: str, target: str, max_width: int, offset: float) -> None:
+    """Extract one frame as JPEG
+
+    Args:
+        source: Path or URL of the video
+        target: Path of the JPEG to write
+        max_width: Max width of the poster in pixels
+        offset: Seconds into the video, the first frame is often black
+
+    Raises:
+        FfmpegError: When no frame could be extracted
+    """
+    await run_ffmpeg([
+        "-ss", str(offset), "-i", source,
+        "-frames:v", "1", "-vf", _scale_filter(max_width), "-q:v", "3",
+        target,
+    ])
+
+
+async def render_preview(source: str, target: str, max_width: int, bitrate: str) -> None:
+    """Encode a small H.264 MP4 without audio, playable while it downloads
+
+    Args:
+        source: Path or URL of the video
+        target: Path of the MP4 to write
+        max_width: Max width of the preview in pixels
+        bitrate: Target video bitrate, e.g. 300k
+
+    Raises:
+        FfmpegError: When the encoding failed
+    """
+    await run_ffmpeg([
+        "-i", source, "-an",
+        "-vf", _scale_filter(max_width),
+        "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+        "-b:v", bitrate, "-maxrate", bitrate, "-bufsize", bitrate,
+        "-movflags", "+faststart",
+        target,
+    ])
@@ -0,0 +1,230 @@
+"""
+Pipeline worker draining the i2v job queue
+
+Runs apart from the API tier with `python -m app.worker`, scale it by starting more
+processes. Each process runs up to WORKER_CONCURRENCY jobs at a time.
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+import uuid
+from typing import Optional
+
+from app.dependencies import get_independent_db_session
+from app.lifetime import export_provider_env
+from app.repository import i2v_job_dao, i2v_task_dao
+from app.repository.database import dispose_engines, pipeline_engine, warm_up_pool
+from app.repository.i2v_job_model import I2vJob
+from app.schema.i2v_task_schema import TaskStatus
+from app.service.asset_lifecycle import AssetLifecycleManager
+from app.service.i2v_service import check_minimax_callback_settings
+from app.service.i2v_task_service import PIPELINE_STATUSES, process_image_to_video, update_task
+from app.service.rate_limiter import RateLimitedError
+from app.service.resilience import CircuitOpenError
+from app.service.task_events import task_event_bus
+from app.service.task_reconciler import TaskReconciler
+from app.service.task_status_cache import task_status_cache
+from app.settings import SETTINGS
+from app.util.http_client import init_http_client, close_http_client
+from app.util.loop_monitor import loop_monitor
+from app.utils.image_utils import init_image_process_pool, shutdown_image_process_pool
+from app.utils.storage import storage
+
+logger = logging.getLogger(__name__)
+
+
+class I2vWorker:
+    """Claims queued jobs and runs the image to video pipeline for them"""
+
+    def __init__(
+        self,
+        concurrency: int = SETTINGS.WORKER_CONCURRENCY,
+        poll_interval: float = SETTINGS.WORKER_POLL_INTERVAL_SECONDS,
+        lease_seconds: int = SETTINGS.JOB_LEASE_SECONDS,
+        heartbeat_interval: float = SETTINGS.JOB_HEARTBEAT_SECONDS,
+        max_attempts: int = SETTINGS.JOB_MAX_ATTEMPTS,
+        retry_backoff: float = SETTINGS.JOB_RETRY_BACKOFF_SECONDS,
+    ):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._running: set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+
+    def stop(self) -> None:
+        """stop claiming new jobs, running jobs are finished"""
+        if not self._stopping.is_set():
+            logger.info("worker stopping, running jobs: %d", len(self._running))
+            self._stopping.set()
+
+    async def run(self, shutdown_timeout: float = SETTINGS.WORKER_SHUTDOWN_TIMEOUT_SECONDS) -> None:
+        """claim and run jobs until stopped"""
+        logger.info("worker %s started, concurrency: %d", self.worker_id, self.concurrency)
+        while not self._stopping.is_set():
+            claimed = 0
+            free = self.concurrency - len(self._running)
+            if free > 0:
+                try:
+                    claimed = await self.run_once(free)
+                except Exception as e: # pylint: disable=broad-except
+                    logger.error("claim jobs failure: %s", e, exc_info=True)
+
+            # 队列里还有任务且有空闲槽位时立即继续, 否则等待槽位释放或下一轮轮询
+            if claimed and claimed == free:
+                await self._wait_for_slot()
+            elif not claimed:
+                await self._sleep(self.poll_interval)
+
+        if self._running:
+            # unfinished jobs are claimed again once their lease expires
+            _, pending = await asyncio.wait(self._running, timeout=shutdown_timeout)
+            for job_task in pending:
+                job_task.cancel()
+        logger.info("worker %s stopped", self.worker_id)
+
+    async def run_once(self, limit: int) -> int:
+        """claim up to limit jobs and start them
+
+        Returns:
+            int: number of claimed jobs
+        """
+        db = await get_independent_db_session()
+        try:
+            jobs = await i2v_job_dao.claim_i2v_jobs(
+                db, self.worker_id, limit, self.lease_seconds * 1000
+            )
+        finally:
+            await db.close()
+
+        for job in jobs:
+            job_task = asyncio.create_task(self.run_job(job))
+            self._running.add(job_task)
+            job_task.add_done_callback(self._running.discard)
+        return len(jobs)
+
+    async def run_job(self, job: I2vJob) -> None:
+        """run the pipeline of one job and record the outcome
+
+        The lease is renewed while the job runs, however long the provider calls take.
+        """
+        logger.info("run job, jid: %s, tid: %s, attempt: %d", job.id, job.task_id, job.attempts)
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            await self._run_job(job)
+        finally:
+            heartbeat.cancel()
+
+    async def _run_job(self, job: I2vJob) -> None:
+        db = await get_independent_db_session()
+        try:
+            task = None
+            try:
+                task = await i2v_task_dao.get_i2v_task_by_id(db, job.task_id)
+                if task is None:
+                    logger.warning("task of job not found, jid: %s, tid: %s", job.id, job.task_id)
+                else:
+                    await process_image_to_video(task, requeue_retryable=True)
+            except (CircuitOpenError, RateLimitedError) as e:
+                # 服务商不可用或持续限流, 不计入重试次数, 恢复后再运行
+                delay = e.retry_after if e.retry_after is not None else self.retry_backoff
+                logger.warning("job deferred for %.0fs, jid: %s, error: %s", delay, job.id, e)
+                retry_at = int((time.time() + delay) * 1000)
+                await i2v_job_dao.fail_i2v_job(db, job.id, self.worker_id, str(e), retry_at, count_attempt=False)
+                return
+            except Exception as e: # pylint: disable=broad-except
+                logger.error("job failure, jid: %s, error: %s", job.id, e, exc_info=True)
+                retry_at: Optional[int] = None
+                if job.attempts < self.max_attempts:
+                    retry_at = int((time.time() + self.retry_backoff * job.attempts) * 1000)
+                await i2v_job_dao.fail_i2v_job(db, job.id, self.worker_id, str(e), retry_at)
+                if retry_at is None and task is not None:
+                    await update_task(db, task, {"status": TaskStatus.FAILED}, PIPELINE_STATUSES)
+                return
+
+            if not await i2v_job_dao.complete_i2v_job(db, job.id, self.worker_id):
+                logger.warning("job lease lost before completion, jid: %s", job.id)
+        finally:
+            await db.close()
+
+    async def _heartbeat(self, job: I2vJob) -> None:
+        """renew the lease of a running job until cancelled"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                db = await get_independent_db_session()
+                try:
+                    renewed = await i2v_job_dao.renew_i2v_job_lease(db, job.id, self.worker_id)
+                finally:
+                    await db.close()
+            except Exception as e: # pylint: disable=broad-except
+                # the lease outlasts a few missed heartbeats
+                logger.error("renew job lease failure, jid: %s, error: %s", job.id, e)
+                continue
+            if not renewed:
+                logger.warning("job lease lost, jid: %s", job.id)
+                return
+
+    async def _wait_for_slot(self) -> None:
+        """wait until a running job finishes or the worker is stopped"""
+        stopping = asyncio.create_task(self._stopping.wait())
+        try:
+            await asyncio.wait({stopping, *self._running}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stopping.cancel()
+
+    async def _sleep(self, seconds: float) -> None:
+        """sleep, waking up early when the worker is stopped"""
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main():
+    """run the worker process until SIGTERM or SIGINT"""
+    check_minimax_callback_settings()
+    loop_monitor.start()
+    export_provider_env()
+    if SETTINGS.DB_POOL_WARMUP:
+        await warm_up_pool(pipeline_engine, SETTINGS.DB_PIPELINE_POOL_SIZE)
+    await init_http_client()
+    await storage.start()
+    init_image_process_pool(SETTINGS.IMAGE_PROCESS_POOL_SIZE)
+    await task_event_bus.start()
+    reconciler = TaskReconciler()
+    if SETTINGS.RECONCILER_ENABLED:
+        reconciler.start()
+    asset_lifecycle = AssetLifecycleManager()
+    if SETTINGS.ASSET_LIFECYCLE_ENABLED:
+        asset_lifecycle.start()
+
+    worker = I2vWorker()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+    try:
+        await worker.run()
+    finally:
+        await reconciler.stop()
+        await asset_lifecycle.stop()
+        await task_event_bus.stop()
+        await task_status_cache.close()
+        await close_http_client()
+        await storage.close()
+        shutdown_image_process_pool()
+        await dispose_engines()
+        await loop_monitor.stop()
+
+
+if __name__ == "__main__":
+    from app.app_logging import configure_logging  # pylint: disable=import-outside-toplevel
+
+    configure_logging()
+    asyncio.run(main())
@@ -0,0 +1 @@
+"""Load test of the i2v pipeline against stub providers, see run.py"""
@@ -0,0 +1,268 @@
+"""
+Open-loop load against a running app, and the report of what it measured
+
+Tasks are created with POST /i2v at Poisson arrival times of the given rate. Sends
+don't wait for earlier responses and latency is counted from the scheduled send
+time, so a saturated server shows up as latency instead of quietly lowering the
+load. Every created task is polled with POST /i2v/status like a client would,
+until it completes or fails.
+"""
+import asyncio
+import base64
+import io
+import math
+import os
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Optional
+
+import aiohttp
+from PIL import Image
+
+CREATE_ENDPOINT = "POST /i2v"
+STATUS_ENDPOINT = "POST /i2v/status"
+TERMINAL_STATUSES = ("task_completed", "failed")
+LOOP_LAG_PATTERN = re.compile(r"^event_loop_lag_seconds (\S+)$", re.MULTILINE)
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """nearest rank percentile of sorted values"""
+    if not sorted_values:
+        return float("nan")
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    """count, p50, p95, p99 and max of samples"""
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "p50": percentile(ordered, 0.50),
+        "p95": percentile(ordered, 0.95),
+        "p99": percentile(ordered, 0.99),
+        "max": ordered[-1] if ordered else float("nan"),
+    }
+
+
+def sample_image(size: int = 768) -> bytes:
+    """a photo sized JPEG, noisy enough not to compress to nothing"""
+    image = Image.effect_noise((size, size), 64).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+@dataclass
+class LoadResult:
+    """Everything measured during a run"""
+
+    # seconds of the load phase, and until the last task finished
+    duration: float = 0
+    total_duration: float = 0
+    # endpoint -> latencies in seconds of successful requests
+    latencies: dict[str, list[float]] = field(default_factory=lambda: defaultdict(list))
+    # "endpoint outcome" -> count, outcome is ok, an HTTP status or the error type
+    outcomes: Counter = field(default_factory=Counter)
+    # seconds from the create request until a poll saw the task finished
+    end_to_end: list[float] = field(default_factory=list)
+    tasks: Counter = field(default_factory=Counter)
+    loop_lag: list[float] = field(default_factory=list)
+    # process role -> RSS samples in bytes
+    memory: dict[str, list[int]] = field(default_factory=lambda: defaultdict(list))
+
+
+class LoadDriver:
+    """Creates tasks at a fixed arrival rate and follows them to completion"""
+
+    def __init__(
+        self,
+        base_url: str,
+        rate: float,
+        duration: float,
+        poll_interval: float = 2,
+        task_timeout: float = 600,
+        reuse_ratio: float = 0.0,
+        i2v_type: str = "realistic",
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.rate = rate
+        self.duration = duration
+        self.poll_interval = poll_interval
+        self.task_timeout = task_timeout
+        self.reuse_ratio = reuse_ratio
+        self.i2v_type = i2v_type
+        self.result = LoadResult()
+        self._image = sample_image()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _payload(self) -> dict:
+        if random.random() < self.reuse_ratio:
+            # identical submissions exercise the dedup path
+            return {"type": self.i2v_type, "image_base64": base64.b64encode(self._image).decode(), "reuse": True}
+        # bytes after the JPEG end marker change the content hash, not the image
+        image = self._image + os.urandom(16)
+        return {"type": self.i2v_type, "image_base64": base64.b64encode(image).decode(), "reuse": False}
+
+    async def _post(self, endpoint: str, path: str, payload, scheduled_at: float) -> Optional[dict]:
+        """send one request, latency counts from scheduled_at"""
+        try:
+            async with self._session.post(self.base_url + path, json=payload) as response:
+                body = await response.json(content_type=None)
+                if response.status != 200 or body.get("code") != 200:
+                    self.result.outcomes[f"{endpoint} {response.status}/{body.get('code')}"] += 1
+                    return None
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            self.result.outcomes[f"{endpoint} {type(e).__name__}"] += 1
+            return None
+        self.result.latencies[endpoint].append(time.monotonic() - scheduled_at)
+        self.result.outcomes[f"{endpoint} ok"] += 1
+        return body
+
+    async def _task_client(self, scheduled_at: float) -> None:
+        """create a task and poll it until it finished"""
+        body = await self._post(CREATE_ENDPOINT, "/i2v", self._payload(), scheduled_at)
+        if body is None:
+            self.result.tasks["create failed"] += 1
+            return
+        task = body["data"]
+        self.result.tasks["created"] += 1
+        while task.get("status") not in TERMINAL_STATUSES:
+            if time.monotonic() - scheduled_at > self.task_timeout:
+                self.result.tasks["timed out"] += 1
+                return
+            await asyncio.sleep(self.poll_interval)
+            body = await self._post(STATUS_ENDPOINT, "/i2v/status", [task["id"]], time.monotonic())
+            if body is not None and body["data"]:
+                task = body["data"][0]
+        self.result.tasks[task["status"]] += 1
+        self.result.end_to_end.append(time.monotonic() - scheduled_at)
+
+    async def run(self) -> LoadResult:
+        """run the load, then wait for the created tasks up to task_timeout"""
+        timeout = aiohttp.ClientTimeout(total=120)
+        # no client side connection limit, queueing belongs to the server
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as session:
+            self._session = session
+            clients = []
+            started = time.monotonic()
+            scheduled_at = started
+            while True:
+                scheduled_at += random.expovariate(self.rate)
+                if scheduled_at - started >= self.duration:
+                    break
+                await asyncio.sleep(max(scheduled_at - time.monotonic(), 0))
+                clients.append(asyncio.create_task(self._task_client(scheduled_at)))
+            self.result.duration = time.monotonic() - started
+            await asyncio.gather(*clients)
+            self.result.total_duration = time.monotonic() - started
+        return self.result
+
+
+class ResourceSampler:
+    """Samples the app's event loop lag gauge and the memory of the processes under test"""
+
+    def __init__(self, base_url: str, pids: dict[str, int], interval: float = 0.5):
+        self.metrics_url = base_url.rstrip("/") + "/admin/metrics"
+        self.pids = pids
+        self.interval = interval
+
+    async def run(self, result: LoadResult, stop: asyncio.Event) -> None:
+        """sample until stop is set, uvicorn workers answer the scrapes in turn"""
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+            while not stop.is_set():
+                try:
+                    async with session.get(self.metrics_url) as response:
+                        match = LOOP_LAG_PATTERN.search(await response.text())
+                        if match:
+                            result.loop_lag.append(float(match.group(1)))
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    pass
+                for role, pid in self.pids.items():
+                    result.memory[role].append(sum(process_tree_rss(pid).values()))
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+
+def process_tree_rss(pid: int) -> dict[int, int]:
+    """resident memory in bytes of a process and its descendants, Linux only"""
+    children: dict[int, list[int]] = defaultdict(list)
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding="utf-8") as f:
+                # the command name may contain spaces, the parent pid follows it
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children[parent].append(int(entry))
+
+    rss = {}
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status", encoding="utf-8") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss[current] = int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+        pending.extend(children.get(current, []))
+    return rss
+
+
+def format_report(result: LoadResult, stub_stats: Optional[dict] = None) -> str:
+    """human readable report of a run"""
+    lines = [f"load phase: {result.duration:.1f}s"]
+    lines.append(f"{'endpoint':<20}{'ok':>8}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for endpoint in (CREATE_ENDPOINT, STATUS_ENDPOINT):
+        stats = summarize(result.latencies.get(endpoint, []))
+        errors = sum(
+            count for key, count in result.outcomes.items()
+            if key.startswith(endpoint + " ") and not key.endswith(" ok")
+        )
+        # creates happen during the load phase, polls until the last task finished
+        elapsed = result.duration if endpoint == CREATE_ENDPOINT else result.total_duration
+        rate = stats["count"] / elapsed if elapsed else 0
+        lines.append(
+            f"{endpoint:<20}{stats['count']:>8}{errors:>8}{rate:>9.1f}"
+            + "".join(f"{stats[key] * 1000:>10.1f}" for key in ("p50", "p95", "p99", "max"))
+        )
+    failures = {key: count for key, count in result.outcomes.items() if not key.endswith(" ok")}
+    if failures:
+        lines.append(f"request errors: {dict(sorted(failures.items()))}")
+
+    e2e = summarize(result.end_to_end)
+    lines.append(f"tasks: {dict(sorted(result.tasks.items()))}")
+    lines.append(
+        "end to end s (poll interval resolution): "
+        + ", ".join(f"{key} {e2e[key]:.1f}" for key in ("p50", "p95", "p99", "max"))
+    )
+    completed = result.tasks.get("task_completed", 0)
+    if result.duration and result.total_duration:
+        lines.append(
+            f"throughput: {result.tasks.get('created', 0) / result.duration:.2f} tasks created/s during the load, "
+            f"{completed / result.total_duration:.2f} completed/s until the last task finished"
+        )
+
+    if result.loop_lag:
+        lag = summarize(result.loop_lag)
+        lines.append(
+            f"app event loop lag ms ({lag['count']} samples): "
+            + ", ".join(f"{key} {lag[key] * 1000:.1f}" for key in ("p50", "p95", "p99", "max"))
+        )
+    for role, samples in result.memory.items():
+        if samples:
+            mib = [sample / 1024 / 1024 for sample in samples]
+            lines.append(f"{role} rss MiB: start {mib[0]:.0f}, max {max(mib):.0f}, end {mib[-1]:.0f}")
+    if stub_stats:
+        lines.append(f"stub providers: {stub_stats}")
+    return "\n".join(lines)
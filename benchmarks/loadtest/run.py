@@ -0,0 +1,229 @@
+"""
+Load test of the full i2v pipeline against local stub providers
+
+Starts the stub providers, migrates the database, starts the real app with uvicorn
+and the job worker, drives /i2v and /i2v/status at the given arrival rate and
+reports throughput, latency percentiles per endpoint, end to end task time, the
+app's event loop lag and the memory of the app and worker processes.
+
+The app-side provider rate limits are lifted by default so that the stubs' --*-rps
+options model the provider quotas; pass --app-env to change any app setting.
+
+Needs MySQL, the migrations use MySQL syntax:
+
+    docker compose -f benchmarks/loadtest/docker-compose.yml up -d
+    python -m benchmarks.loadtest.run --rate 5 --duration 120 --generation-seconds 20
+    python -m benchmarks.loadtest.run --rate 20 --callbacks --minimax-rps 10 --app-env WORKER_CONCURRENCY=32
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.request import urlopen
+
+from benchmarks.loadtest import stub_providers
+from benchmarks.loadtest.driver import LoadDriver, ResourceSampler, format_report, summarize
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# options passed through to the stub server
+STUB_OPTIONS = (
+    "azure_latency_ms", "azure_error_rate", "azure_rps",
+    "minimax_latency_ms", "minimax_error_rate", "minimax_rps",
+    "generation_seconds", "fail_rate", "video_kb",
+)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    """poll url until it answers, fail early when the process died"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(process.args)} exited with {process.returncode}")
+        try:
+            with urlopen(url, timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} not up after {timeout}s")
+
+
+def app_settings(args: argparse.Namespace, stub_url: str, app_url: str) -> dict[str, str]:
+    """settings of the app under test, pointing at the stubs and the load test database"""
+    settings = {
+        "VIDEOSNAP_API_KEY": "loadtest",
+        "AZURE_API_KEY": "stub",
+        "AZURE_API_BASE": stub_url,
+        "AZURE_API_VERSION": "2024-08-01-preview",
+        "MINIMAX_VIDEO_GENERATION_API_KEY": "stub",
+        "MINIMAX_VIDEO_GENERATION_BASE_URL": f"{stub_url}/v1/video_generation",
+        "MINIMAX_VIDEO_GENERATION_STATUS_URL": f"{stub_url}/v1/query/video_generation",
+        "MINIMAX_FILE_RETRIEVE_URL": f"{stub_url}/v1/files/retrieve",
+        "MINIMAX_VIDEO_GENERATION_CALLBACK_URL": f"{app_url}/iv2/minimax/get_callback" if args.callbacks else "",
+        "MINIMAX_CALLBACK_TOKEN": "loadtest",
+        "DB_HOST": args.db_host,
+        "DB_PORT": str(args.db_port),
+        "DB_USER": args.db_user,
+        "DB_PASS": args.db_pass,
+        "DB_NAME": args.db_name,
+        # the stubs model the provider quotas
+        "AZURE_CHAT_RPM": "0",
+        "MINIMAX_GENERATE_RPM": "0",
+        "MINIMAX_QUERY_RPM": "0",
+        "ASSET_LIFECYCLE_ENABLED": "false",
+    }
+    for item in args.app_env:
+        key, _, value = item.partition("=")
+        settings[key] = value
+    return settings
+
+
+def migrate(settings: dict[str, str], work_dir: str) -> None:
+    """upgrade the load test database to the latest revision"""
+    url = (
+        f"mysql+pymysql://{settings['DB_USER']}:{settings['DB_PASS']}"
+        f"@{settings['DB_HOST']}:{settings['DB_PORT']}/{settings['DB_NAME']}"
+    )
+    script = (
+        "from alembic import command\n"
+        "from alembic.config import Config\n"
+        f"config = Config({os.path.join(REPO_ROOT, 'alembic.ini')!r})\n"
+        f"config.set_main_option('script_location', {os.path.join(REPO_ROOT, 'migrations', 'alembic')!r})\n"
+        f"config.set_main_option('sqlalchemy.url', {url!r})\n"
+        "command.upgrade(config, 'head')\n"
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=work_dir, env=app_environment(work_dir), check=True)
+
+
+def app_environment(work_dir: str) -> dict[str, str]:
+    env = dict(os.environ)
+    env["ENV_FILE"] = os.path.join(work_dir, "loadtest.env")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    env["PYTHONUNBUFFERED"] = "1"
+    return env
+
+
+def start(command: list[str], work_dir: str, log_name: str) -> subprocess.Popen:
+    """start a process in the work directory, output goes to a log file there"""
+    log = open(os.path.join(work_dir, log_name), "wb")  # pylint: disable=consider-using-with
+    return subprocess.Popen(  # pylint: disable=consider-using-with
+        command, cwd=work_dir, env=app_environment(work_dir), stdout=log, stderr=subprocess.STDOUT
+    )
+
+
+def stop(process: subprocess.Popen, timeout: float = 30) -> None:
+    """SIGTERM, the worker drains its jobs, then SIGKILL"""
+    if process.poll() is None:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+async def drive(args: argparse.Namespace, app_url: str, pids: dict[str, int]):
+    driver = LoadDriver(
+        app_url, args.rate, args.duration, args.poll_interval, args.task_timeout, args.reuse_ratio
+    )
+    stopped = asyncio.Event()
+    sampler = asyncio.create_task(ResourceSampler(app_url, pids).run(driver.result, stopped))
+    try:
+        return await driver.run()
+    finally:
+        stopped.set()
+        await sampler
+
+
+def main(args: argparse.Namespace) -> None:
+    work_dir = tempfile.mkdtemp(prefix="videosnap-loadtest-")
+    stub_port, app_port = free_port(), free_port()
+    stub_url, app_url = f"http://127.0.0.1:{stub_port}", f"http://127.0.0.1:{app_port}"
+    settings = app_settings(args, stub_url, app_url)
+    with open(os.path.join(work_dir, "loadtest.env"), "w", encoding="utf-8") as f:
+        f.writelines(f"{key}={value}\n" for key, value in settings.items())
+    print(f"logs and assets in {work_dir}")
+
+    processes = []
+    try:
+        stub_args = [
+            arg for name, value in vars(args).items() if name in STUB_OPTIONS
+            for arg in (f"--{name.replace('_', '-')}", str(value))
+        ]
+        stubs = start(
+            [sys.executable, "-m", "benchmarks.loadtest.stub_providers", "--port", str(stub_port), *stub_args],
+            work_dir, "stub_providers.log",
+        )
+        processes.append(stubs)
+        wait_until_up(f"{stub_url}/stats", stubs)
+
+        migrate(settings, work_dir)
+
+        app = start([
+            sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(app_port),
+            "--workers", str(args.workers), "--timeout-keep-alive", "300", "--no-access-log",
+        ], work_dir, "app.log")
+        processes.append(app)
+        pids = {"app": app.pid}
+        for index in range(args.worker_processes):
+            worker = start([sys.executable, "-m", "app.worker"], work_dir, f"worker-{index}.log")
+            processes.append(worker)
+            pids[f"worker-{index}"] = worker.pid
+        wait_until_up(f"{app_url}/", app)
+
+        print(f"driving {args.rate}/s for {args.duration}s against {args.workers} app workers")
+        result = asyncio.run(drive(args, app_url, pids))
+        with urlopen(f"{stub_url}/stats", timeout=5) as response:
+            stub_stats = json.loads(response.read())
+        print(format_report(result, stub_stats))
+
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({
+                    "rate": args.rate,
+                    "duration": result.duration,
+                    "endpoints": {endpoint: summarize(values) for endpoint, values in result.latencies.items()},
+                    "outcomes": dict(result.outcomes),
+                    "tasks": dict(result.tasks),
+                    "end_to_end": summarize(result.end_to_end),
+                    "loop_lag": summarize(result.loop_lag),
+                    "memory_max": {role: max(samples) for role, samples in result.memory.items() if samples},
+                    "stub_providers": stub_stats,
+                }, f, indent=2)
+    finally:
+        for process in reversed(processes):
+            stop(process)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=2, help="task arrivals per second")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of load")
+    parser.add_argument("--poll-interval", type=float, default=2, help="status polling interval per task")
+    parser.add_argument("--task-timeout", type=float, default=600, help="give up following a task after this")
+    parser.add_argument("--reuse-ratio", type=float, default=0.0, help="fraction of identical, deduplicated submissions")
+    parser.add_argument("--workers", type=int, default=4, help="uvicorn workers")
+    parser.add_argument("--worker-processes", type=int, default=1, help="job worker processes")
+    parser.add_argument("--callbacks", action="store_true", help="stubs push status callbacks instead of polling")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE", help="app setting override")
+    parser.add_argument("--json", help="also write the results to this file")
+    group = parser.add_argument_group("database")
+    group.add_argument("--db-host", default="127.0.0.1")
+    group.add_argument("--db-port", type=int, default=3307)
+    group.add_argument("--db-user", default="videosnap")
+    group.add_argument("--db-pass", default="videosnap")
+    group.add_argument("--db-name", default="videosnap_loadtest")
+    stub_providers.add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,282 @@
+"""
+Local stand-ins for the Azure OpenAI and Minimax APIs
+
+Serves the endpoints the pipeline calls, with configurable latency, error rate and
+rate limiting per provider:
+
+- POST /openai/deployments/{deployment}/chat/completions   Azure chat completion
+- POST /v1/video_generation                                Minimax generation
+- GET  /v1/query/video_generation?task_id=                 Minimax status
+- GET  /v1/files/retrieve?file_id=                         Minimax file lookup
+- GET  /download/{file_id}.mp4                             the generated video
+- GET  /stats                                              request counters
+
+A generation succeeds after --generation-seconds, or fails for --fail-rate of them.
+When the request carries a callback_url the stub posts the result there, like
+Minimax does. Above --*-rps requests per second Azure answers 429 with Retry-After,
+Minimax answers base_resp 1002.
+
+    python -m benchmarks.loadtest.stub_providers --port 9100 --minimax-rps 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Optional
+
+import aiohttp
+from aiohttp import web
+
+# base_resp codes of the Minimax API
+MINIMAX_OK = 0
+MINIMAX_RATE_LIMITED = 1002
+MINIMAX_INTERNAL_ERROR = 1013
+
+
+@dataclass
+class ProviderBehavior:
+    """How one stubbed provider answers"""
+
+    latency_ms: float = 50
+    # the latency varies uniformly by this fraction in both directions
+    jitter: float = 0.5
+    error_rate: float = 0.0
+    # 0 disables the rate limit
+    rate_limit_rps: float = 0
+    retry_after_seconds: int = 1
+    _tokens: float = field(default=0, init=False)
+    _refilled_at: float = field(default_factory=time.monotonic, init=False)
+
+    async def delay(self) -> None:
+        """wait for the simulated processing time"""
+        latency = self.latency_ms * (1 + random.uniform(-self.jitter, self.jitter))
+        await asyncio.sleep(max(latency, 0) / 1000)
+
+    def throttled(self) -> bool:
+        """token bucket with one second of burst"""
+        if self.rate_limit_rps <= 0:
+            return False
+        now = time.monotonic()
+        self._tokens = min(self.rate_limit_rps, self._tokens + (now - self._refilled_at) * self.rate_limit_rps)
+        self._refilled_at = now
+        if self._tokens < 1:
+            return True
+        self._tokens -= 1
+        return False
+
+    def failed(self) -> bool:
+        return random.random() < self.error_rate
+
+
+@dataclass
+class Generation:
+    """A simulated Minimax video generation"""
+
+    task_id: str
+    file_id: str
+    ready_at: float
+    succeeds: bool
+    callback_url: Optional[str] = None
+
+    def status(self) -> str:
+        if time.monotonic() < self.ready_at:
+            return "Processing"
+        return "Success" if self.succeeds else "Fail"
+
+
+class StubProviders:
+    """State and handlers of the stub server"""
+
+    def __init__(
+        self,
+        azure: ProviderBehavior,
+        minimax: ProviderBehavior,
+        generation_seconds: float = 30,
+        fail_rate: float = 0.0,
+        video_bytes: int = 1024 * 1024,
+    ):
+        self.azure = azure
+        self.minimax = minimax
+        self.generation_seconds = generation_seconds
+        self.fail_rate = fail_rate
+        self.video = os.urandom(video_bytes)
+        self.generations: dict[str, Generation] = {}
+        self.files: dict[str, Generation] = {}
+        self.counters: Counter = Counter()
+        self._callbacks: set[asyncio.Task] = set()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/openai/deployments/{deployment}/chat/completions", self.chat_completion)
+        app.router.add_post("/v1/video_generation", self.video_generation)
+        app.router.add_get("/v1/query/video_generation", self.query_video_generation)
+        app.router.add_get("/v1/files/retrieve", self.retrieve_file)
+        app.router.add_get("/download/{file_id}.mp4", self.download)
+        app.router.add_get("/stats", self.stats)
+        app.on_startup.append(self._start)
+        app.on_cleanup.append(self._stop)
+        return app
+
+    async def _start(self, _app) -> None:
+        self._session = aiohttp.ClientSession()
+
+    async def _stop(self, _app) -> None:
+        for task in list(self._callbacks):
+            task.cancel()
+        await self._session.close()
+
+    def _count(self, endpoint: str, outcome: str) -> None:
+        self.counters[f"{endpoint} {outcome}"] += 1
+
+    async def chat_completion(self, request: web.Request) -> web.Response:
+        await request.read()
+        await self.azure.delay()
+        if self.azure.throttled():
+            self._count("azure_chat", "429")
+            return web.json_response(
+                {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                status=429,
+                headers={"Retry-After": str(self.azure.retry_after_seconds)},
+            )
+        if self.azure.failed():
+            self._count("azure_chat", "500")
+            return web.json_response({"error": {"code": "InternalServerError", "message": "stub"}}, status=500)
+        self._count("azure_chat", "200")
+        return web.json_response({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.match_info["deployment"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "The subject slowly turns and smiles."},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 850, "completion_tokens": 12, "total_tokens": 862},
+        })
+
+    async def video_generation(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        await self.minimax.delay()
+        if self.minimax.throttled():
+            self._count("minimax_generate", "1002")
+            return web.json_response({"base_resp": {"status_code": MINIMAX_RATE_LIMITED, "status_msg": "rate limit"}})
+        if self.minimax.failed():
+            # service unavailable, the generation surely did not start
+            self._count("minimax_generate", "503")
+            return web.Response(status=503, text="stub gateway error")
+        generation = Generation(
+            task_id=uuid.uuid4().hex,
+            file_id=uuid.uuid4().hex,
+            ready_at=time.monotonic() + self.generation_seconds,
+            succeeds=random.random() >= self.fail_rate,
+            callback_url=body.get("callback_url"),
+        )
+        self.generations[generation.task_id] = generation
+        self.files[generation.file_id] = generation
+        if generation.callback_url:
+            task = asyncio.create_task(self._callback(generation))
+            self._callbacks.add(task)
+            task.add_done_callback(self._callbacks.discard)
+        self._count("minimax_generate", "200")
+        return web.json_response({"task_id": generation.task_id, "base_resp": {"status_code": MINIMAX_OK}})
+
+    async def _callback(self, generation: Generation) -> None:
+        await asyncio.sleep(max(generation.ready_at - time.monotonic(), 0))
+        try:
+            async with self._session.post(generation.callback_url, json={
+                "task_id": generation.task_id,
+                "status": generation.status(),
+                "file_id": generation.file_id,
+                "base_resp": {"status_code": MINIMAX_OK},
+            }) as response:
+                self._count("minimax_callback", str(response.status))
+        except aiohttp.ClientError:
+            self._count("minimax_callback", "error")
+
+    async def _minimax_query(self, endpoint: str) -> Optional[web.Response]:
+        """the throttle and error answer of a query, None to answer normally"""
+        await self.minimax.delay()
+        if self.minimax.throttled():
+            self._count(endpoint, "1002")
+            return web.json_response({"base_resp": {"status_code": MINIMAX_RATE_LIMITED, "status_msg": "rate limit"}})
+        if self.minimax.failed():
+            self._count(endpoint, "1013")
+            return web.json_response({"base_resp": {"status_code": MINIMAX_INTERNAL_ERROR, "status_msg": "stub"}})
+        return None
+
+    async def query_video_generation(self, request: web.Request) -> web.Response:
+        error = await self._minimax_query("minimax_query")
+        if error is not None:
+            return error
+        generation = self.generations.get(request.query.get("task_id", ""))
+        if generation is None:
+            self._count("minimax_query", "404")
+            return web.json_response({"base_resp": {"status_code": 2013, "status_msg": "task not found"}})
+        status = generation.status()
+        self._count("minimax_query", status)
+        result = {"task_id": generation.task_id, "status": status, "base_resp": {"status_code": MINIMAX_OK}}
+        if status == "Success":
+            result["file_id"] = generation.file_id
+        return web.json_response(result)
+
+    async def retrieve_file(self, request: web.Request) -> web.Response:
+        error = await self._minimax_query("minimax_files")
+        if error is not None:
+            return error
+        file_id = request.query.get("file_id", "")
+        if file_id not in self.files:
+            self._count("minimax_files", "404")
+            return web.json_response({"base_resp": {"status_code": 1004, "status_msg": "file not found"}})
+        self._count("minimax_files", "200")
+        return web.json_response({
+            "file": {"file_id": file_id, "download_url": str(request.url.with_path(f"/download/{file_id}.mp4").with_query(None))},
+            "base_resp": {"status_code": MINIMAX_OK},
+        })
+
+    async def download(self, request: web.Request) -> web.Response:
+        if request.match_info["file_id"] not in self.files:
+            return web.Response(status=404)
+        self._count("download", "200")
+        return web.Response(body=self.video, content_type="video/mp4")
+
+    async def stats(self, _request: web.Request) -> web.Response:
+        return web.json_response(dict(sorted(self.counters.items())))
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """stub behavior options, shared with the load test runner"""
+    group = parser.add_argument_group("stub providers")
+    for provider, latency in (("azure", 800), ("minimax", 150)):
+        group.add_argument(f"--{provider}-latency-ms", type=float, default=latency)
+        group.add_argument(f"--{provider}-error-rate", type=float, default=0.0)
+        group.add_argument(f"--{provider}-rps", type=float, default=0, help="rate limit, 0 for none")
+    group.add_argument("--generation-seconds", type=float, default=30, help="time until a generation finishes")
+    group.add_argument("--fail-rate", type=float, default=0.0, help="fraction of generations that fail")
+    group.add_argument("--video-kb", type=int, default=1024, help="size of the generated video")
+
+
+def from_arguments(args: argparse.Namespace) -> StubProviders:
+    return StubProviders(
+        azure=ProviderBehavior(args.azure_latency_ms, error_rate=args.azure_error_rate, rate_limit_rps=args.azure_rps),
+        minimax=ProviderBehavior(
+            args.minimax_latency_ms, error_rate=args.minimax_error_rate, rate_limit_rps=args.minimax_rps
+        ),
+        generation_seconds=args.generation_seconds,
+        fail_rate=args.fail_rate,
+        video_bytes=args.video_kb * 1024,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(from_arguments(args).build_app(), host=args.host, port=args.port, access_log=None)
@@ -0,0 +1,138 @@
+"""
+Throughput of /resource/{filename} delivery
+
+Serves a generated video file with uvicorn and measures, against the plain
+FileResponse the endpoint used before:
+
+- full downloads, MB/s
+- 1 MiB range requests at random offsets (player seeking), requests/s
+- revalidations with If-None-Match answered with 304, requests/s
+
+Needs the app settings, e.g.
+
+    ENV_FILE=videosnap-dev.env python benchmarks/resource_throughput.py --size-mb 64 --concurrency 16
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import aiohttp
+import uvicorn
+from fastapi import FastAPI
+from starlette.responses import FileResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.router import resource_router  # pylint: disable=wrong-import-position
+from app.utils import file_utils  # pylint: disable=wrong-import-position
+
+FILENAME = "benchmark.mp4"
+RANGE_SIZE = 1024 * 1024
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(resource_router.router)
+
+    @app.get("/baseline/{filename}")
+    async def baseline(filename: str):
+        return FileResponse(file_utils.get_file_path(filename), filename=filename)
+
+    return app
+
+
+def start_server(app: FastAPI) -> tuple[uvicorn.Server, int]:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, port
+
+
+async def run_load(concurrency: int, duration: float, request) -> tuple[int, int]:
+    """run request in concurrency loops for duration seconds
+
+    Returns:
+        tuple[int, int]: requests and bytes received
+    """
+    deadline = time.perf_counter() + duration
+    totals = [0, 0]
+
+    async def _loop(session: aiohttp.ClientSession):
+        while time.perf_counter() < deadline:
+            received = await request(session)
+            totals[0] += 1
+            totals[1] += received
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(_loop(session) for _ in range(concurrency)))
+    return totals[0], totals[1]
+
+
+async def benchmark(base_url: str, size: int, concurrency: int, duration: float) -> None:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{base_url}/resource/{FILENAME}") as response:
+            etag = response.headers["ETag"]
+
+    def full(prefix: str):
+        async def _request(session):
+            async with session.get(f"{base_url}/{prefix}/{FILENAME}") as response:
+                return len(await response.read())
+        return _request
+
+    def seek(prefix: str):
+        async def _request(session):
+            start = random.randrange(0, size - RANGE_SIZE)
+            headers = {"Range": f"bytes={start}-{start + RANGE_SIZE - 1}"}
+            async with session.get(f"{base_url}/{prefix}/{FILENAME}", headers=headers) as response:
+                return len(await response.read())
+        return _request
+
+    def revalidate(prefix: str):
+        async def _request(session):
+            headers = {"If-None-Match": etag}
+            async with session.get(f"{base_url}/{prefix}/{FILENAME}", headers=headers) as response:
+                return len(await response.read())
+        return _request
+
+    print(f"{'scenario':<12}{'endpoint':<12}{'req/s':>10}{'MB/s':>10}{'MB/req':>10}")
+    for name, factory in (("full", full), ("seek 1MiB", seek), ("revalidate", revalidate)):
+        for prefix in ("baseline", "resource"):
+            requests, received = await run_load(concurrency, duration, factory(prefix))
+            print(
+                f"{name:<12}{prefix:<12}{requests / duration:>10.1f}"
+                f"{received / duration / 1e6:>10.1f}{received / max(requests, 1) / 1e6:>10.2f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as asset_root:
+        file_utils.ASSET_ROOT = asset_root
+        size = args.size_mb * 1024 * 1024
+        with open(os.path.join(asset_root, FILENAME), "wb") as f:
+            f.write(os.urandom(size))
+        server, port = start_server(build_app())
+        try:
+            asyncio.run(benchmark(f"http://127.0.0.1:{port}", size, args.concurrency, args.duration))
+        finally:
+            server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
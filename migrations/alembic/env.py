@@ -7,6 +7,8 @@ from alembic import context
 
 from app.repository.database import Base
 from app.repository.i2v_task_model import I2vTask
+from app.repository.prompt_cache_model import I2vPromptCache
+from app.repository.i2v_job_model import I2vJob
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
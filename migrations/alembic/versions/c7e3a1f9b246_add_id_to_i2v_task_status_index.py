@@ -0,0 +1,39 @@
+"""add_id_to_i2v_task_status_index
+
+Adds id to ix_i2v_task_status_updated_at so the (updated_at, id) pages of the status
+scans are read in index order. InnoDB appended the primary key implicitly already,
+naming it keeps the order independent of the storage engine. Online, after the
+binary id swap of e2a94b7c6d05.
+
+Revision ID: c7e3a1f9b246
+Revises: a7c4e2f9d813
+Create Date: 2026-10-18 19:42:10.360218+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e3a1f9b246'
+down_revision: Union[str, None] = 'a7c4e2f9d813'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "ALTER TABLE i2v_task DROP INDEX ix_i2v_task_status_updated_at, "
+        "ADD INDEX ix_i2v_task_status_updated_at (status, updated_at, id), "
+        "ALGORITHM=INPLACE, LOCK=NONE"
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        "ALTER TABLE i2v_task DROP INDEX ix_i2v_task_status_updated_at, "
+        "ADD INDEX ix_i2v_task_status_updated_at (status, updated_at), "
+        "ALGORITHM=INPLACE, LOCK=NONE"
+    )
@@ -0,0 +1,57 @@
+"""add_i2v_task_binary_id_columns
+
+First step of moving the uuid keys from CHAR(32) to BINARY(16), runs while the old
+code is still serving. Adds binary shadow columns for i2v_task.id, i2v_job.id,
+i2v_job.task_id and i2v_prompt_cache.id, and insert triggers so new rows get them
+filled. Existing rows are copied by
+`python -m app.repository.binary_id_backfill`, then e2a94b7c6d05 swaps the columns
+with the writers stopped, before the new code is started.
+
+Revision ID: d5f27a8c3b14
+Revises: b84e0f3a9c61
+Create Date: 2026-10-18 12:08:31.552107+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5f27a8c3b14'
+down_revision: Union[str, None] = 'b84e0f3a9c61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 只加可空列, 在线 DDL 不锁表
+    op.execute("ALTER TABLE i2v_task ADD COLUMN id_bin BINARY(16) NULL, ALGORITHM=INPLACE, LOCK=NONE")
+    op.execute(
+        "ALTER TABLE i2v_job ADD COLUMN id_bin BINARY(16) NULL, ADD COLUMN task_id_bin BINARY(16) NULL, "
+        "ALGORITHM=INPLACE, LOCK=NONE"
+    )
+    op.execute("ALTER TABLE i2v_prompt_cache ADD COLUMN id_bin BINARY(16) NULL, ALGORITHM=INPLACE, LOCK=NONE")
+    op.execute(
+        "CREATE TRIGGER i2v_task_id_bin_insert BEFORE INSERT ON i2v_task "
+        "FOR EACH ROW SET NEW.id_bin = UNHEX(NEW.id)"
+    )
+    op.execute(
+        "CREATE TRIGGER i2v_job_id_bin_insert BEFORE INSERT ON i2v_job "
+        "FOR EACH ROW SET NEW.id_bin = UNHEX(NEW.id), NEW.task_id_bin = UNHEX(NEW.task_id)"
+    )
+    op.execute(
+        "CREATE TRIGGER i2v_prompt_cache_id_bin_insert BEFORE INSERT ON i2v_prompt_cache "
+        "FOR EACH ROW SET NEW.id_bin = UNHEX(NEW.id)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS i2v_prompt_cache_id_bin_insert")
+    op.execute("DROP TRIGGER IF EXISTS i2v_job_id_bin_insert")
+    op.execute("DROP TRIGGER IF EXISTS i2v_task_id_bin_insert")
+    op.drop_column('i2v_prompt_cache', 'id_bin')
+    op.drop_column('i2v_job', 'task_id_bin')
+    op.drop_column('i2v_job', 'id_bin')
+    op.drop_column('i2v_task', 'id_bin')
@@ -0,0 +1,116 @@
+"""swap_i2v_task_binary_id
+
+Second step of the BINARY(16) key migration, see d5f27a8c3b14. Copies the rows the
+backfill hasn't reached yet, then replaces the CHAR(32) columns by the binary ones.
+
+Writers have to be stopped for this step: once the insert triggers are dropped a new
+row would get no binary id and the NOT NULL swap would fail after a full rebuild.
+The ALTERs take LOCK=SHARED so a writer that is still running is blocked instead.
+Deploy order:
+
+1. d5f27a8c3b14 and `python -m app.repository.binary_id_backfill` while the old
+   code is serving, so only a few rows are left to copy here
+2. stop the API and the worker processes
+3. `alembic upgrade` to this revision, the tables stay readable while they are
+   rebuilt
+4. start the code using UUIDType(binary=True)
+
+Downgrading needs the same window, with the old code started at the end.
+
+Revision ID: e2a94b7c6d05
+Revises: d5f27a8c3b14
+Create Date: 2026-10-18 12:09:02.018644+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a94b7c6d05'
+down_revision: Union[str, None] = 'd5f27a8c3b14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 5000
+
+
+def _fill(statement: str) -> None:
+    """run a LIMITed UPDATE until it matches no more rows"""
+    conn = op.get_bind()
+    while conn.execute(sa.text(statement), {"limit": BATCH_SIZE}).rowcount:
+        pass
+
+
+def upgrade() -> None:
+    # 写入已停止, 先删触发器再补齐, 之后不会再有缺少二进制 id 的行
+    op.execute("DROP TRIGGER IF EXISTS i2v_task_id_bin_insert")
+    op.execute("DROP TRIGGER IF EXISTS i2v_job_id_bin_insert")
+    op.execute("DROP TRIGGER IF EXISTS i2v_prompt_cache_id_bin_insert")
+    _fill("UPDATE i2v_task SET id_bin = UNHEX(id) WHERE id_bin IS NULL LIMIT :limit")
+    _fill("UPDATE i2v_job SET id_bin = UNHEX(id) WHERE id_bin IS NULL LIMIT :limit")
+    _fill("UPDATE i2v_job SET task_id_bin = UNHEX(task_id) WHERE task_id_bin IS NULL LIMIT :limit")
+    _fill("UPDATE i2v_prompt_cache SET id_bin = UNHEX(id) WHERE id_bin IS NULL LIMIT :limit")
+    op.execute(
+        "ALTER TABLE i2v_task DROP PRIMARY KEY, DROP COLUMN id, "
+        "CHANGE COLUMN id_bin id BINARY(16) NOT NULL, ADD PRIMARY KEY (id), "
+        "ALGORITHM=INPLACE, LOCK=SHARED"
+    )
+    op.execute(
+        "ALTER TABLE i2v_job DROP PRIMARY KEY, DROP COLUMN id, "
+        "CHANGE COLUMN id_bin id BINARY(16) NOT NULL, ADD PRIMARY KEY (id), "
+        "DROP INDEX task_id, DROP COLUMN task_id, "
+        "CHANGE COLUMN task_id_bin task_id BINARY(16) NOT NULL, ADD UNIQUE INDEX task_id (task_id), "
+        "ALGORITHM=INPLACE, LOCK=SHARED"
+    )
+    op.execute(
+        "ALTER TABLE i2v_prompt_cache DROP PRIMARY KEY, DROP COLUMN id, "
+        "CHANGE COLUMN id_bin id BINARY(16) NOT NULL, ADD PRIMARY KEY (id), "
+        "ALGORITHM=INPLACE, LOCK=SHARED"
+    )
+
+
+def downgrade() -> None:
+    # back to the state after d5f27a8c3b14, the binary columns stay as shadow columns,
+    # writers are stopped as for the upgrade
+    op.execute("ALTER TABLE i2v_task ADD COLUMN id_hex CHAR(32) NULL, ALGORITHM=INPLACE, LOCK=NONE")
+    op.execute(
+        "ALTER TABLE i2v_job ADD COLUMN id_hex CHAR(32) NULL, ADD COLUMN task_id_hex CHAR(32) NULL, "
+        "ALGORITHM=INPLACE, LOCK=NONE"
+    )
+    op.execute("ALTER TABLE i2v_prompt_cache ADD COLUMN id_hex CHAR(32) NULL, ALGORITHM=INPLACE, LOCK=NONE")
+    _fill("UPDATE i2v_task SET id_hex = LOWER(HEX(id)) WHERE id_hex IS NULL LIMIT :limit")
+    _fill("UPDATE i2v_job SET id_hex = LOWER(HEX(id)) WHERE id_hex IS NULL LIMIT :limit")
+    _fill("UPDATE i2v_job SET task_id_hex = LOWER(HEX(task_id)) WHERE task_id_hex IS NULL LIMIT :limit")
+    _fill("UPDATE i2v_prompt_cache SET id_hex = LOWER(HEX(id)) WHERE id_hex IS NULL LIMIT :limit")
+    op.execute(
+        "ALTER TABLE i2v_task DROP PRIMARY KEY, CHANGE COLUMN id id_bin BINARY(16) NULL, "
+        "CHANGE COLUMN id_hex id CHAR(32) NOT NULL, ADD PRIMARY KEY (id), "
+        "ALGORITHM=INPLACE, LOCK=SHARED"
+    )
+    op.execute(
+        "ALTER TABLE i2v_job DROP PRIMARY KEY, CHANGE COLUMN id id_bin BINARY(16) NULL, "
+        "CHANGE COLUMN id_hex id CHAR(32) NOT NULL, ADD PRIMARY KEY (id), "
+        "DROP INDEX task_id, CHANGE COLUMN task_id task_id_bin BINARY(16) NULL, "
+        "CHANGE COLUMN task_id_hex task_id CHAR(32) NOT NULL, ADD UNIQUE INDEX task_id (task_id), "
+        "ALGORITHM=INPLACE, LOCK=SHARED"
+    )
+    op.execute(
+        "ALTER TABLE i2v_prompt_cache DROP PRIMARY KEY, CHANGE COLUMN id id_bin BINARY(16) NULL, "
+        "CHANGE COLUMN id_hex id CHAR(32) NOT NULL, ADD PRIMARY KEY (id), "
+        "ALGORITHM=INPLACE, LOCK=SHARED"
+    )
+    op.execute(
+        "CREATE TRIGGER i2v_task_id_bin_insert BEFORE INSERT ON i2v_task "
+        "FOR EACH ROW SET NEW.id_bin = UNHEX(NEW.id)"
+    )
+    op.execute(
+        "CREATE TRIGGER i2v_job_id_bin_insert BEFORE INSERT ON i2v_job "
+        "FOR EACH ROW SET NEW.id_bin = UNHEX(NEW.id), NEW.task_id_bin = UNHEX(NEW.task_id)"
+    )
+    op.execute(
+        "CREATE TRIGGER i2v_prompt_cache_id_bin_insert BEFORE INSERT ON i2v_prompt_cache "
+        "FOR EACH ROW SET NEW.id_bin = UNHEX(NEW.id)"
+    )
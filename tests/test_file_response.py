@@ -0,0 +1,177 @@
+"""
+Range parsing, validators and the responses of cached_file_response
+"""
+import os
+from email.utils import formatdate
+
+import pytest
+from starlette.applications import Starlette
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.utils.file_response import (
+    MAX_RANGES,
+    CachedFileResponse,
+    RangeNotSatisfiableError,
+    _if_range_matches,
+    cached_file_response,
+    is_not_modified,
+    parse_range_header,
+    strong_etag,
+)
+
+CONTENT = bytes(range(100))
+
+
+@pytest.fixture(name="stored_file")
+def fixture_stored_file(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(CONTENT)
+    return str(path)
+
+
+@pytest.fixture(name="client")
+def fixture_client(stored_file):
+    async def _resource(request: Request):
+        return await cached_file_response(request.headers, stored_file, media_type="video/mp4")
+
+    return TestClient(Starlette(routes=[Route("/resource", _resource, methods=["GET", "HEAD"])]))
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", [(0, 10)]),
+    ("bytes=90-", [(90, 100)]),
+    ("bytes=-10", [(90, 100)]),
+    # a suffix longer than the file is the whole file
+    ("bytes=-500", [(0, 100)]),
+    # the end is clipped to the file
+    ("bytes=95-200", [(95, 100)]),
+    ("bytes=0-4,3-9", [(0, 10)]),
+    # adjacent ranges are merged, the result is sorted
+    ("bytes=20-29,0-9,10-19", [(0, 30)]),
+    ("bytes=50-59, 0-9", [(0, 10), (50, 60)]),
+    # ranges past the end are dropped as long as one overlaps
+    ("bytes=0-0,200-300", [(0, 1)]),
+])
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, len(CONTENT)) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "items=0-9",
+    "bytes=",
+    "bytes=5",
+    "bytes=9-5",
+    "bytes=a-b",
+    "bytes=" + ",".join(f"{i}-{i}" for i in range(MAX_RANGES + 1)),
+])
+def test_malformed_range_is_ignored(header):
+    assert parse_range_header(header, len(CONTENT)) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=200-300", "bytes=-0"])
+def test_unsatisfiable_range(header):
+    with pytest.raises(RangeNotSatisfiableError):
+        parse_range_header(header, len(CONTENT))
+
+
+def test_not_modified_uses_the_weak_etag_comparison(stored_file):
+    stat_result = os.stat(stored_file)
+    etag = strong_etag(stat_result)
+    assert is_not_modified(Headers({"if-none-match": etag}), stat_result)
+    assert is_not_modified(Headers({"if-none-match": f'"other", W/{etag}'}), stat_result)
+    assert is_not_modified(Headers({"if-none-match": "*"}), stat_result)
+    assert not is_not_modified(Headers({"if-none-match": '"other"'}), stat_result)
+
+
+def test_not_modified_since(stored_file):
+    stat_result = os.stat(stored_file)
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    earlier = formatdate(stat_result.st_mtime - 60, usegmt=True)
+    assert is_not_modified(Headers({"if-modified-since": last_modified}), stat_result)
+    assert not is_not_modified(Headers({"if-modified-since": earlier}), stat_result)
+    assert not is_not_modified(Headers({"if-modified-since": "yesterday"}), stat_result)
+    # If-None-Match takes precedence
+    headers = Headers({"if-none-match": '"other"', "if-modified-since": last_modified})
+    assert not is_not_modified(headers, stat_result)
+
+
+def test_if_range_uses_the_strong_comparison(stored_file):
+    stat_result = os.stat(stored_file)
+    etag = strong_etag(stat_result)
+    assert _if_range_matches(etag, stat_result)
+    assert not _if_range_matches(f"W/{etag}", stat_result)
+    assert _if_range_matches(formatdate(stat_result.st_mtime, usegmt=True), stat_result)
+    assert not _if_range_matches(formatdate(stat_result.st_mtime - 60, usegmt=True), stat_result)
+
+
+def test_content_length_of_ranges(stored_file):
+    stat_result = os.stat(stored_file)
+    single = CachedFileResponse(stored_file, stat_result, [(10, 20)])
+    assert single.headers["content-length"] == "10"
+    assert single.headers["content-range"] == "bytes 10-19/100"
+
+    multi = CachedFileResponse(stored_file, stat_result, [(0, 10), (50, 60)], media_type="video/mp4")
+    body = b"".join(
+        multi._part_header(start, end, 100) + CONTENT[start:end] + b"\r\n" for start, end in multi.ranges
+    ) + multi._closing_boundary()
+    assert multi.headers["content-length"] == str(len(body))
+    assert "content-range" not in multi.headers
+
+
+def test_full_response(client):
+    response = client.get("/resource")
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["accept-ranges"] == "bytes"
+    assert "immutable" in response.headers["cache-control"]
+
+
+def test_single_range_response(client):
+    response = client.get("/resource", headers={"range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == CONTENT[10:20]
+    assert response.headers["content-range"] == "bytes 10-19/100"
+    assert response.headers["content-length"] == "10"
+
+
+def test_multiple_range_response(client):
+    response = client.get("/resource", headers={"range": "bytes=0-9,50-59"})
+    assert response.status_code == 206
+    content_type = response.headers["content-type"]
+    assert content_type.startswith("multipart/byteranges; boundary=")
+    boundary = content_type.split("boundary=")[1]
+    assert response.headers["content-length"] == str(len(response.content))
+    assert response.content.endswith(f"--{boundary}--\r\n".encode())
+    assert b"content-range: bytes 0-9/100\r\n\r\n" + CONTENT[0:10] + b"\r\n" in response.content
+    assert b"content-range: bytes 50-59/100\r\n\r\n" + CONTENT[50:60] + b"\r\n" in response.content
+
+
+def test_not_modified_response(client):
+    etag = client.get("/resource").headers["etag"]
+    response = client.get("/resource", headers={"if-none-match": etag, "range": "bytes=0-9"})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+    assert "immutable" in response.headers["cache-control"]
+
+
+def test_unsatisfiable_range_response(client):
+    response = client.get("/resource", headers={"range": "bytes=500-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */100"
+
+
+def test_stale_if_range_sends_the_whole_file(client):
+    response = client.get("/resource", headers={"range": "bytes=0-9", "if-range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+
+def test_head_sends_headers_only(client):
+    response = client.head("/resource", headers={"range": "bytes=0-9"})
+    assert response.status_code == 206
+    assert response.headers["content-length"] == "10"
+    assert response.content == b""
@@ -0,0 +1,155 @@
+"""
+Claim, lease and release of i2v jobs on a SQLite database created from the models
+"""
+import asyncio
+import time
+import uuid
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.repository import i2v_job_dao
+from app.repository.database import Base
+from app.repository.i2v_job_model import I2vJob
+from app.schema.i2v_job_schema import JobStatus
+
+LEASE_MS = 60_000
+
+
+@pytest.fixture(name="session_factory")
+def fixture_session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'jobs.db'}")
+
+    async def _create():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(_create())
+    yield async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    asyncio.run(engine.dispose())
+
+
+def _run(session_factory, scenario):
+    async def _main():
+        async with session_factory() as db:
+            return await scenario(db)
+
+    return asyncio.run(_main())
+
+
+async def _job(db, job_id) -> I2vJob:
+    """the job as stored"""
+    return await db.get(I2vJob, job_id, populate_existing=True)
+
+
+def _now() -> int:
+    return int(time.time() * 1000)
+
+
+def test_claim_takes_due_queued_jobs(session_factory):
+    async def scenario(db):
+        due = await i2v_job_dao.enqueue_i2v_job(db, uuid.uuid4())
+        later = await i2v_job_dao.enqueue_i2v_job(db, uuid.uuid4())
+        later.available_at = _now() + LEASE_MS
+        await db.commit()
+
+        claimed = await i2v_job_dao.claim_i2v_jobs(db, "worker-a", 10, LEASE_MS)
+        assert [job.id for job in claimed] == [due.id]
+        job = await _job(db, due.id)
+        assert job.status == JobStatus.RUNNING
+        assert job.locked_by == "worker-a"
+        assert job.attempts == 1
+        assert (await _job(db, later.id)).status == JobStatus.QUEUED
+
+    _run(session_factory, scenario)
+
+
+def test_claim_respects_limit(session_factory):
+    async def scenario(db):
+        for _ in range(3):
+            await i2v_job_dao.enqueue_i2v_job(db, uuid.uuid4())
+        assert len(await i2v_job_dao.claim_i2v_jobs(db, "worker-a", 2, LEASE_MS)) == 2
+        assert len(await i2v_job_dao.claim_i2v_jobs(db, "worker-b", 2, LEASE_MS)) == 1
+
+    _run(session_factory, scenario)
+
+
+def test_running_job_is_reclaimed_only_after_its_lease_expired(session_factory):
+    async def scenario(db):
+        job = await i2v_job_dao.enqueue_i2v_job(db, uuid.uuid4())
+        await i2v_job_dao.claim_i2v_jobs(db, "worker-a", 1, LEASE_MS)
+        assert await i2v_job_dao.claim_i2v_jobs(db, "worker-b", 1, LEASE_MS) == []
+
+        # worker-a stopped renewing its lease
+        (await _job(db, job.id)).locked_at = _now() - LEASE_MS - 1
+        await db.commit()
+        reclaimed = await i2v_job_dao.claim_i2v_jobs(db, "worker-b", 1, LEASE_MS)
+        assert [claimed.id for claimed in reclaimed] == [job.id]
+        job = await _job(db, job.id)
+        assert job.locked_by == "worker-b"
+        assert job.attempts == 2
+
+    _run(session_factory, scenario)
+
+
+def test_renewed_lease_keeps_a_long_job(session_factory):
+    async def scenario(db):
+        job = await i2v_job_dao.enqueue_i2v_job(db, uuid.uuid4())
+        await i2v_job_dao.claim_i2v_jobs(db, "worker-a", 1, LEASE_MS)
+        (await _job(db, job.id)).locked_at = _now() - LEASE_MS - 1
+        await db.commit()
+
+        assert await i2v_job_dao.renew_i2v_job_lease(db, job.id, "worker-a")
+        assert await i2v_job_dao.claim_i2v_jobs(db, "worker-b", 1, LEASE_MS) == []
+        # only the owner renews
+        assert not await i2v_job_dao.renew_i2v_job_lease(db, job.id, "worker-b")
+
+    _run(session_factory, scenario)
+
+
+def test_completion_requires_ownership(session_factory):
+    async def scenario(db):
+        job = await i2v_job_dao.enqueue_i2v_job(db, uuid.uuid4())
+        await i2v_job_dao.claim_i2v_jobs(db, "worker-a", 1, LEASE_MS)
+        (await _job(db, job.id)).locked_at = _now() - LEASE_MS - 1
+        await db.commit()
+        await i2v_job_dao.claim_i2v_jobs(db, "worker-b", 1, LEASE_MS)
+
+        assert not await i2v_job_dao.complete_i2v_job(db, job.id, "worker-a")
+        assert not await i2v_job_dao.fail_i2v_job(db, job.id, "worker-a", "lost")
+        assert await i2v_job_dao.complete_i2v_job(db, job.id, "worker-b")
+        job = await _job(db, job.id)
+        assert job.status == JobStatus.DONE
+        assert job.locked_by is None
+
+    _run(session_factory, scenario)
+
+
+def test_failed_job_is_queued_again_or_failed(session_factory):
+    async def scenario(db):
+        retried = await i2v_job_dao.enqueue_i2v_job(db, uuid.uuid4())
+        failed = await i2v_job_dao.enqueue_i2v_job(db, uuid.uuid4())
+        await i2v_job_dao.claim_i2v_jobs(db, "worker-a", 2, LEASE_MS)
+        retry_at = _now() + LEASE_MS
+
+        assert await i2v_job_dao.fail_i2v_job(db, retried.id, "worker-a", "timeout", retry_at)
+        assert await i2v_job_dao.fail_i2v_job(db, failed.id, "worker-a", "bad image")
+        retried, failed = await _job(db, retried.id), await _job(db, failed.id)
+        assert (retried.status, retried.available_at, retried.last_error) == (JobStatus.QUEUED, retry_at, "timeout")
+        assert failed.status == JobStatus.FAILED
+        # not due before retry_at
+        assert await i2v_job_dao.claim_i2v_jobs(db, "worker-a", 2, LEASE_MS) == []
+
+    _run(session_factory, scenario)
+
+
+def test_deferred_job_keeps_its_attempts(session_factory):
+    async def scenario(db):
+        job = await i2v_job_dao.enqueue_i2v_job(db, uuid.uuid4())
+        await i2v_job_dao.claim_i2v_jobs(db, "worker-a", 1, LEASE_MS)
+
+        assert await i2v_job_dao.fail_i2v_job(db, job.id, "worker-a", "circuit open", _now(), count_attempt=False)
+        job = await _job(db, job.id)
+        assert (job.status, job.attempts) == (JobStatus.QUEUED, 0)
+
+    _run(session_factory, scenario)
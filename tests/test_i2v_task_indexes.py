@@ -0,0 +1,118 @@
+"""
+EXPLAIN the i2v_task queries of the DAO and check that they use their indexes
+
+The statements built by i2v_task_dao are captured and planned on an in-memory
+SQLite database created from the models, so no MySQL server is needed.
+"""
+import asyncio
+import time
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, event
+
+from app.repository import i2v_task_dao
+from app.repository.database import Base
+from app.repository.i2v_task_model import I2vTask  # pylint: disable=unused-import
+from app.schema.i2v_task_schema import I2vType, TaskStatus, VideoGenerationProvider
+
+
+class _EmptyResult:
+    rowcount = 0
+
+    def scalar_one_or_none(self):
+        return None
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return []
+
+
+class _RecordingSession:
+    """stands in for AsyncSession and keeps the executed statements"""
+
+    def __init__(self):
+        self.statements = []
+
+    async def execute(self, statement, *args, **kwargs):
+        self.statements.append(statement)
+        return _EmptyResult()
+
+    async def commit(self):
+        pass
+
+
+@pytest.fixture(name="engine")
+def fixture_engine():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def _captured_statement(dao_call):
+    session = _RecordingSession()
+    asyncio.run(dao_call(session))
+    assert len(session.statements) == 1
+    return session.statements[0]
+
+
+def _query_plan(engine, statement) -> str:
+    """EXPLAIN QUERY PLAN of a statement, with its bound parameters"""
+    captured = {}
+
+    def _capture(conn, cursor, sql, parameters, context, executemany):
+        captured["sql"] = sql
+        captured["parameters"] = parameters
+
+    with engine.connect() as conn:
+        event.listen(conn, "before_cursor_execute", _capture)
+        conn.execute(statement)
+        event.remove(conn, "before_cursor_execute", _capture)
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + captured["sql"], captured["parameters"]).fetchall()
+        conn.rollback()
+    return "\n".join(row[-1] for row in rows)
+
+
+@pytest.mark.parametrize("after", [None, (1000, uuid.uuid4())])
+def test_status_scan_reads_pages_in_index_order(engine, after):
+    now = int(time.time() * 1000)
+    statement = _captured_statement(lambda db: i2v_task_dao.get_i2v_tasks_by_status(
+        db, TaskStatus.TASK_SUBMITTED, 100, after=after, updated_before=now
+    ))
+    plan = _query_plan(engine, statement)
+    assert "ix_i2v_task_status_updated_at" in plan
+    # no sort of the matching rows on each page
+    assert "TEMP B-TREE" not in plan
+
+
+def test_callback_lookup_uses_video_generation_id_index(engine):
+    statement = _captured_statement(
+        lambda db: i2v_task_dao.get_i2v_task_by_video_generation_id(db, "305614738170281")
+    )
+    assert "ix_i2v_task_video_generation_id" in _query_plan(engine, statement)
+
+
+def test_time_range_scan_uses_created_at_index(engine):
+    now = int(time.time() * 1000)
+    statement = _captured_statement(
+        lambda db: i2v_task_dao.get_i2v_tasks_created_between(db, now - 3_600_000, now, 100)
+    )
+    assert "ix_i2v_task_created_at" in _query_plan(engine, statement)
+
+
+def test_dedup_lookup_uses_content_hash_index(engine):
+    statement = _captured_statement(lambda db: i2v_task_dao.find_reusable_i2v_task(
+        db, "0" * 64, I2vType.REALISTIC, VideoGenerationProvider.MINIMAX_VIDEO_01, 0
+    ))
+    assert "ix_i2v_task_content_hash_i2v_type" in _query_plan(engine, statement)
+
+
+def test_bulk_transition_uses_primary_key(engine):
+    statement = _captured_statement(lambda db: i2v_task_dao.bulk_transition_i2v_tasks(
+        db, [uuid.uuid4(), uuid.uuid4()], {"status": TaskStatus.FAILED}, [TaskStatus.TASK_SUBMITTED]
+    ))
+    plan = _query_plan(engine, statement)
+    assert "SCAN" not in plan.replace("SCAN CONSTANT ROW", "")
@@ -0,0 +1,317 @@
+"""
+Conditional task transitions on a SQLite database created from the models
+
+A transition names the statuses the task is expected to be in, a writer holding a
+stale copy of the task must not overwrite a newer transition.
+"""
+import asyncio
+import time
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.repository import i2v_task_dao
+from app.repository.database import Base
+from app.repository.i2v_task_model import I2vTask
+from app.schema.i2v_task_schema import I2vType, TaskStatus, VideoGenerationProvider
+from app.service import i2v_task_service
+from app.service.resilience import PermanentProviderError, ProviderOutcomeUnknownError, RetryableProviderError
+from app.service.task_events import task_event_bus
+from app.utils.file_utils import SavedFile
+
+
+@pytest.fixture(name="session_factory")
+def fixture_session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'tasks.db'}")
+
+    async def _create():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(_create())
+    yield async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    asyncio.run(engine.dispose())
+
+
+@pytest.fixture(name="published")
+def fixture_published(monkeypatch):
+    """events published to the task event bus"""
+    events = []
+
+    async def _publish(event):
+        events.append(event)
+
+    monkeypatch.setattr(task_event_bus, "publish", _publish)
+    return events
+
+
+def _run(session_factory, scenario):
+    async def _main():
+        async with session_factory() as db:
+            return await scenario(db)
+
+    return asyncio.run(_main())
+
+
+async def _add_tasks(db, status: TaskStatus, count: int = 1, updated_at: int = 1000) -> list[I2vTask]:
+    tasks = [
+        I2vTask(
+            source_image_filename="source.jpg",
+            i2v_type=I2vType.REALISTIC,
+            video_generation_provider=VideoGenerationProvider.MINIMAX_VIDEO_01.value,
+            status=status,
+            updated_at=updated_at,
+        )
+        for _ in range(count)
+    ]
+    db.add_all(tasks)
+    await db.commit()
+    return tasks
+
+
+async def _stored_status(db, task: I2vTask) -> TaskStatus:
+    return (await db.get(I2vTask, task.id, populate_existing=True)).status
+
+
+def test_transition_applies_in_expected_status(session_factory):
+    async def scenario(db):
+        [task] = await _add_tasks(db, TaskStatus.IDLE)
+        updated = await i2v_task_dao.transition_i2v_task(
+            db, task.id, {"status": TaskStatus.PROMPT_GENERATED}, [TaskStatus.IDLE, TaskStatus.PROMPT_GENERATED]
+        )
+        assert updated == 1
+        stored = await db.get(I2vTask, task.id, populate_existing=True)
+        assert stored.status == TaskStatus.PROMPT_GENERATED
+        assert stored.updated_at > 1000
+
+    _run(session_factory, scenario)
+
+
+def test_stale_transition_is_refused(session_factory):
+    async def scenario(db):
+        [task] = await _add_tasks(db, TaskStatus.TASK_SUBMITTED)
+        # a writer that still believes the prompt stage is running
+        updated = await i2v_task_dao.transition_i2v_task(
+            db, task.id, {"status": TaskStatus.FAILED}, TaskStatus.PROMPT_GENERATED
+        )
+        assert updated == 0
+        assert await _stored_status(db, task) == TaskStatus.TASK_SUBMITTED
+
+    _run(session_factory, scenario)
+
+
+def test_bulk_transition_only_changes_tasks_in_expected_status(session_factory):
+    async def scenario(db):
+        submitted = await _add_tasks(db, TaskStatus.TASK_SUBMITTED, 2)
+        [completed] = await _add_tasks(db, TaskStatus.TASK_COMPLETED)
+        updated = await i2v_task_dao.bulk_transition_i2v_tasks(
+            db, [task.id for task in [*submitted, completed]], {"status": TaskStatus.FAILED}, [TaskStatus.TASK_SUBMITTED]
+        )
+        assert updated == 2
+        assert [await _stored_status(db, task) for task in submitted] == [TaskStatus.FAILED] * 2
+        assert await _stored_status(db, completed) == TaskStatus.TASK_COMPLETED
+
+    _run(session_factory, scenario)
+
+
+def test_bulk_transition_skips_tasks_changed_since(session_factory):
+    async def scenario(db):
+        [old] = await _add_tasks(db, TaskStatus.TASK_FINALIZING, updated_at=1000)
+        [renewed] = await _add_tasks(db, TaskStatus.TASK_FINALIZING, updated_at=5000)
+        updated = await i2v_task_dao.bulk_transition_i2v_tasks(
+            db, [old.id, renewed.id], {"status": TaskStatus.FAILED}, [TaskStatus.TASK_FINALIZING], updated_before=2000
+        )
+        assert updated == 1
+        assert await _stored_status(db, old) == TaskStatus.FAILED
+        assert await _stored_status(db, renewed) == TaskStatus.TASK_FINALIZING
+
+    _run(session_factory, scenario)
+
+
+def test_update_task_publishes_only_applied_transitions(session_factory, published):
+    async def scenario(db):
+        [task] = await _add_tasks(db, TaskStatus.TASK_SUBMITTED)
+        assert not await i2v_task_service.update_task(
+            db, task, {"status": TaskStatus.FAILED}, i2v_task_service.PIPELINE_STATUSES
+        )
+        assert published == []
+
+        assert await i2v_task_service.update_task(
+            db, task, {"status": TaskStatus.TASK_FINALIZING}, TaskStatus.TASK_SUBMITTED
+        )
+        assert [event["status"] for event in published] == [TaskStatus.TASK_FINALIZING.value]
+        assert await _stored_status(db, task) == TaskStatus.TASK_FINALIZING
+
+    _run(session_factory, scenario)
+
+
+def test_fail_tasks_publishes_stored_state_on_partial_match(session_factory, published, monkeypatch):
+    async def _independent_session():
+        return session_factory()
+
+    monkeypatch.setattr(i2v_task_service, "get_independent_db_session", _independent_session)
+
+    async def scenario(db):
+        tasks = await _add_tasks(db, TaskStatus.TASK_SUBMITTED, 3)
+        # finalized concurrently, the copies in hand are stale
+        await i2v_task_dao.transition_i2v_task(db, tasks[0].id, {"status": TaskStatus.TASK_COMPLETED})
+
+        failed = await i2v_task_service.fail_tasks(tasks, i2v_task_service.IN_FLIGHT_PROVIDER_STATUSES)
+        assert failed == 2
+        statuses = {event["id"]: event["status"] for event in published}
+        assert statuses == {
+            str(tasks[0].id): TaskStatus.TASK_COMPLETED.value,
+            str(tasks[1].id): TaskStatus.FAILED.value,
+            str(tasks[2].id): TaskStatus.FAILED.value,
+        }
+
+    _run(session_factory, scenario)
+
+
+def test_fail_tasks_publishes_nothing_without_a_match(session_factory, published, monkeypatch):
+    async def _independent_session():
+        return session_factory()
+
+    monkeypatch.setattr(i2v_task_service, "get_independent_db_session", _independent_session)
+
+    async def scenario(db):
+        tasks = await _add_tasks(db, TaskStatus.TASK_COMPLETED, 2)
+        assert await i2v_task_service.fail_tasks(tasks, i2v_task_service.IN_FLIGHT_PROVIDER_STATUSES) == 0
+        assert published == []
+
+    _run(session_factory, scenario)
+
+
+class _RejectingGenerator:
+    """a provider whose status queries fail with the given error"""
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+    async def check_status(self, video_generation_id):
+        raise self.error
+
+
+@pytest.mark.parametrize("error, expected", [
+    (PermanentProviderError("Download URL not found"), TaskStatus.FAILED),
+    # the next pass may get an answer
+    (RetryableProviderError("status 500"), TaskStatus.TASK_SUBMITTED),
+    (ProviderOutcomeUnknownError("gateway timeout"), TaskStatus.TASK_SUBMITTED),
+])
+def test_refresh_fails_tasks_the_provider_rejected(session_factory, published, monkeypatch, error, expected):
+    async def _independent_session():
+        return session_factory()
+
+    monkeypatch.setattr(i2v_task_service, "get_independent_db_session", _independent_session)
+    monkeypatch.setattr(
+        i2v_task_service.VideoGeneratorFactory, "create", staticmethod(lambda provider: _RejectingGenerator(error))
+    )
+
+    async def scenario(db):
+        [task] = await _add_tasks(db, TaskStatus.TASK_SUBMITTED)
+        task.video_generation_id = "vid"
+        await i2v_task_service.refresh_submitted_task(task)
+        assert await _stored_status(db, task) == expected
+
+    _run(session_factory, scenario)
+
+
+def test_rejected_task_is_not_failed_while_it_is_finalized(session_factory, published, monkeypatch):
+    async def _independent_session():
+        return session_factory()
+
+    monkeypatch.setattr(i2v_task_service, "get_independent_db_session", _independent_session)
+
+    async def scenario(db):
+        # the lease of a running download was just renewed
+        [running] = await _add_tasks(db, TaskStatus.TASK_FINALIZING, updated_at=int(time.time() * 1000))
+        [abandoned] = await _add_tasks(db, TaskStatus.TASK_FINALIZING, updated_at=1000)
+        assert await i2v_task_service.fail_in_flight_tasks([running, abandoned]) == 1
+        assert await _stored_status(db, running) == TaskStatus.TASK_FINALIZING
+        assert await _stored_status(db, abandoned) == TaskStatus.FAILED
+
+    _run(session_factory, scenario)
+
+
+def test_expired_finalization_claim_is_taken_over(session_factory):
+    async def scenario(db):
+        [task] = await _add_tasks(db, TaskStatus.TASK_SUBMITTED)
+        assert await i2v_task_dao.claim_i2v_task_finalization(db, task.id, 60_000)
+        # the first claim is still held
+        assert not await i2v_task_dao.claim_i2v_task_finalization(db, task.id, 60_000)
+
+        # its holder stopped before the lease ran out
+        await i2v_task_dao.transition_i2v_task(db, task.id, {"updated_at": 1000})
+        assert await i2v_task_dao.claim_i2v_task_finalization(db, task.id, 60_000)
+        stored = await db.get(I2vTask, task.id, populate_existing=True)
+        assert stored.status == TaskStatus.TASK_FINALIZING
+        assert stored.updated_at > 1000
+
+    _run(session_factory, scenario)
+
+
+def test_finished_task_is_not_claimed(session_factory):
+    async def scenario(db):
+        [task] = await _add_tasks(db, TaskStatus.TASK_COMPLETED, updated_at=1000)
+        assert not await i2v_task_dao.claim_i2v_task_finalization(db, task.id, 60_000)
+        assert await _stored_status(db, task) == TaskStatus.TASK_COMPLETED
+
+    _run(session_factory, scenario)
+
+
+class _Download:
+    """response of a video download that takes a while"""
+
+    status = 200
+    content_length = 4
+
+    def __init__(self):
+        self.content = self
+
+    async def iter_chunked(self, size):
+        await asyncio.sleep(0.05)
+        yield b"mp4!"
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+def test_concurrent_finalizations_download_once(session_factory, published, monkeypatch):
+    downloads = []
+
+    async def _independent_session():
+        return session_factory()
+
+    async def _save_stream(chunks, original_filename, sub_dir="", expected_size=None, **kwargs):
+        content = b"".join([chunk async for chunk in chunks])
+        return SavedFile(f"{sub_dir}/video.mp4", len(content), "0" * 64)
+
+    async def _no_derivatives(filename):
+        return {}
+
+    class _Session:
+        def get(self, url, **kwargs):
+            downloads.append(url)
+            return _Download()
+
+    monkeypatch.setattr(i2v_task_service, "get_independent_db_session", _independent_session)
+    monkeypatch.setattr(i2v_task_service, "get_http_session", _Session)
+    monkeypatch.setattr(i2v_task_service.storage, "save_stream", _save_stream)
+    monkeypatch.setattr(i2v_task_service, "generate_video_derivatives", _no_derivatives)
+
+    async def scenario(db):
+        [task] = await _add_tasks(db, TaskStatus.TASK_SUBMITTED)
+        first, second = await asyncio.gather(
+            i2v_task_service.finalize_task(task, "https://provider/video.mp4"),
+            i2v_task_service.finalize_task(task, "https://provider/video.mp4"),
+        )
+        assert downloads == ["https://provider/video.mp4"]
+        assert first.status == second.status == TaskStatus.TASK_COMPLETED
+        assert task.id not in i2v_task_service._finalizing
+        stored = await db.get(I2vTask, task.id, populate_existing=True)
+        assert (stored.status, stored.output_video_filename) == (TaskStatus.TASK_COMPLETED, "output/video.mp4")
+
+    _run(session_factory, scenario)
@@ -0,0 +1,105 @@
+"""
+Streaming the file of a multipart/form-data body
+"""
+import asyncio
+
+import pytest
+from starlette.datastructures import Headers
+
+from app.utils.file_utils import FileTooLargeError
+from app.utils.multipart_utils import MULTIPART_OVERHEAD, MultipartError, MultipartFileReader
+
+BOUNDARY = "test-boundary"
+HEADERS = Headers({"content-type": f"multipart/form-data; boundary={BOUNDARY}"})
+IMAGE = bytes(range(256)) * 40
+
+
+def _field(name: str, value: str) -> bytes:
+    return (
+        f"--{BOUNDARY}\r\ncontent-disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n"
+    ).encode()
+
+
+def _file(name: str, content: bytes) -> bytes:
+    return (
+        f"--{BOUNDARY}\r\ncontent-disposition: form-data; name=\"{name}\"; filename=\"a.png\"\r\n"
+        "content-type: image/png\r\n\r\n"
+    ).encode() + content + b"\r\n"
+
+
+def _body(*parts: bytes) -> bytes:
+    return b"".join(parts) + f"--{BOUNDARY}--\r\n".encode()
+
+
+def _read(body: bytes, chunk_size: int = 100, max_size: int = len(IMAGE)) -> tuple[bytes, MultipartFileReader]:
+    """the file content received in chunks of chunk_size, and the reader"""
+    async def _stream():
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    async def _main():
+        reader = MultipartFileReader(HEADERS, _stream(), "image", max_size)
+        return b"".join([chunk async for chunk in reader.file_chunks()]), reader
+
+    return asyncio.run(_main())
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 100, 1 << 20])
+def test_file_and_fields_are_read(chunk_size):
+    body = _body(_field("type", "realistic"), _file("image", IMAGE))
+    content, reader = _read(body, chunk_size)
+    assert content == IMAGE
+    assert reader.fields == {"type": "realistic"}
+
+
+def test_fields_after_the_file_are_read():
+    content, reader = _read(_body(_file("image", IMAGE), _field("type", "anime")))
+    assert content == IMAGE
+    assert reader.fields == {"type": "anime"}
+
+
+def test_file_is_streamed_as_it_arrives():
+    async def _main():
+        received = []
+        body = _body(_file("image", IMAGE))
+
+        async def _stream():
+            for start in range(0, len(body), 1000):
+                received.append(start)
+                yield body[start:start + 1000]
+
+        reader = MultipartFileReader(HEADERS, _stream(), "image", len(IMAGE))
+        first = await reader.file_chunks().__anext__()
+        assert len(received) == 1
+        assert IMAGE.startswith(first)
+
+    asyncio.run(_main())
+
+
+@pytest.mark.parametrize("body, error", [
+    (_body(_field("type", "realistic")), "image file is required"),
+    (_body(_file("image", IMAGE), _file("image", IMAGE)), "only one image file"),
+    (_body(_file("avatar", IMAGE)), "unexpected file field"),
+    (_body(_field("type", "realistic"), _field("reuse", "false"), _file("image", IMAGE)), "too many fields"),
+    (_body(_field("type", "x" * 2000), _file("image", IMAGE)), "exceeds"),
+    # cut off in the middle of the file
+    (_body(_file("image", IMAGE))[:len(IMAGE) // 2], "incomplete"),
+])
+def test_unexpected_forms_are_rejected(body, error):
+    with pytest.raises(MultipartError, match=error):
+        _read(body)
+
+
+def test_missing_boundary_is_rejected():
+    async def _empty():
+        yield b""
+
+    with pytest.raises(MultipartError):
+        MultipartFileReader(Headers({"content-type": "multipart/form-data"}), _empty(), "image", 100)
+
+
+def test_body_larger_than_the_limit_is_rejected():
+    oversized = IMAGE * ((MULTIPART_OVERHEAD // len(IMAGE)) + 2)
+    with pytest.raises(FileTooLargeError):
+        _read(_body(_file("image", oversized)), chunk_size=16 * 1024, max_size=len(IMAGE))
+
@@ -0,0 +1,159 @@
+"""
+Retry classification, circuit breaker and deadlines of provider calls
+"""
+import asyncio
+import time
+
+import aiohttp
+import pytest
+
+from app.service.rate_limiter import RateLimitedError
+from app.service.resilience import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    PermanentProviderError,
+    ProviderOutcomeUnknownError,
+    RetryableProviderError,
+    call_with_deadline,
+    call_with_retry,
+    is_retryable,
+    provider_request,
+)
+
+
+class _Provider:
+    """fails with the given errors in turn, then answers"""
+
+    def __init__(self, *errors: Exception):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def _retry(provider: _Provider, **kwargs):
+    return asyncio.run(call_with_retry(provider, base_delay=0, max_delay=0, **kwargs))
+
+
+@pytest.mark.parametrize("error, idempotent, retryable", [
+    (RetryableProviderError("status 503"), False, True),
+    (RateLimitedError("status 429"), False, True),
+    (CircuitOpenError("open"), False, True),
+    # the connection was never established
+    (aiohttp.ClientConnectorError(None, OSError("refused")), False, True),
+    # the request may have reached the provider
+    (aiohttp.ServerDisconnectedError(), False, False),
+    (asyncio.TimeoutError(), False, False),
+    (aiohttp.ServerDisconnectedError(), True, True),
+    (asyncio.TimeoutError(), True, True),
+    (PermanentProviderError("status 400"), True, False),
+    (ProviderOutcomeUnknownError("status 504"), True, False),
+    (ValueError("bad response"), True, False),
+])
+def test_is_retryable(error, idempotent, retryable):
+    assert is_retryable(error, idempotent) is retryable
+
+
+def test_non_idempotent_call_is_not_repeated_after_an_unknown_outcome():
+    provider = _Provider(ProviderOutcomeUnknownError("status 504"))
+    with pytest.raises(ProviderOutcomeUnknownError):
+        _retry(provider, attempts=3, idempotent=False)
+    assert provider.calls == 1
+
+    provider = _Provider(RetryableProviderError("status 503"))
+    assert _retry(provider, attempts=3, idempotent=False) == "ok"
+    assert provider.calls == 2
+
+
+def test_breaker_opens_probes_and_closes():
+    breaker = CircuitBreaker("test-recovery", failure_threshold=2, recovery_timeout=0.05)
+    for _ in range(2):
+        with pytest.raises(RetryableProviderError):
+            _retry(_Provider(RetryableProviderError("status 503")), attempts=1, breaker=breaker)
+    assert breaker.state == CIRCUIT_OPEN
+
+    provider = _Provider()
+    with pytest.raises(CircuitOpenError) as info:
+        _retry(provider, breaker=breaker)
+    assert provider.calls == 0
+    assert 0 < info.value.retry_after <= 0.05
+
+    time.sleep(0.06)
+    breaker.before_call()
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    # only one probe at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CIRCUIT_CLOSED
+    assert _retry(_Provider(), breaker=breaker) == "ok"
+
+
+def test_failed_probe_opens_the_breaker_again():
+    breaker = CircuitBreaker("test-probe", failure_threshold=1, recovery_timeout=0.01)
+    breaker.before_call()
+    breaker.record_failure()
+    time.sleep(0.02)
+    with pytest.raises(RetryableProviderError):
+        _retry(_Provider(RetryableProviderError("status 503")), attempts=1, breaker=breaker)
+    assert breaker.state == CIRCUIT_OPEN
+
+
+@pytest.mark.parametrize("error", [RateLimitedError("status 429"), PermanentProviderError("status 400")])
+def test_answered_errors_do_not_open_the_breaker(error):
+    breaker = CircuitBreaker("test-answered", failure_threshold=2, recovery_timeout=60)
+    for _ in range(3):
+        with pytest.raises(type(error)):
+            _retry(_Provider(error), attempts=3, breaker=breaker)
+    assert breaker.state == CIRCUIT_CLOSED
+
+
+def test_unknown_outcomes_open_the_breaker():
+    breaker = CircuitBreaker("test-unknown", failure_threshold=2, recovery_timeout=60)
+    for _ in range(2):
+        with pytest.raises(ProviderOutcomeUnknownError):
+            _retry(_Provider(ProviderOutcomeUnknownError("status 504")), idempotent=False, breaker=breaker)
+    assert breaker.state == CIRCUIT_OPEN
+
+
+async def _wait_for_limiter():
+    # no request was sent yet
+    await asyncio.sleep(1)
+
+
+async def _wait_for_response():
+    with provider_request():
+        await asyncio.sleep(1)
+
+
+async def _wait_after_throttle():
+    try:
+        with provider_request():
+            raise RateLimitedError("status 429", 30)
+    except RateLimitedError:
+        await asyncio.sleep(1)
+
+
+@pytest.mark.parametrize("func, error", [
+    (_wait_for_limiter, RetryableProviderError),
+    (_wait_for_response, ProviderOutcomeUnknownError),
+    (_wait_after_throttle, RateLimitedError),
+])
+def test_missed_deadline_of_a_non_idempotent_call(func, error):
+    with pytest.raises(error) as info:
+        asyncio.run(call_with_deadline(func, deadline=0.05, idempotent=False))
+    assert type(info.value) is error
+    if error is RateLimitedError:
+        assert info.value.retry_after == 30
+
+
+def test_missed_deadline_of_an_idempotent_call_is_retryable():
+    with pytest.raises(RetryableProviderError):
+        asyncio.run(call_with_deadline(_wait_for_response, deadline=0.05))
@@ -0,0 +1,126 @@
+"""
+Task status cache with the in-process backend
+"""
+import asyncio
+import time
+
+from prometheus_client import REGISTRY
+
+from app.service.task_status_cache import LocalStatusCacheBackend, TaskStatusCache
+
+
+def _status(task_id: str, status: str, updated_at: int) -> dict:
+    return {"id": task_id, "status": status, "updated_at": updated_at}
+
+
+def _requests(tier: str, result: str) -> float:
+    return REGISTRY.get_sample_value(
+        "i2v_task_status_cache_requests_total", {"tier": tier, "result": result}
+    ) or 0
+
+
+def _cache(ttl: float = 60, max_size: int = 100) -> TaskStatusCache:
+    return TaskStatusCache(LocalStatusCacheBackend(ttl, max_size), max_size=max_size)
+
+
+def test_fill_does_not_overwrite_a_newer_transition():
+    async def scenario():
+        cache = _cache()
+        await cache.put(_status("a", "task_submitted", 2000))
+        # loaded from the database before the transition was written
+        await cache.put(_status("a", "prompt_generated", 1000), fill=True)
+        assert (await cache.get_many(["a"]))["a"]["status"] == "task_submitted"
+
+        await cache.put(_status("b", "task_completed", 2000))
+        await cache.put(_status("b", "task_submitted", 1000), fill=True)
+        assert (await cache.get_many(["b"]))["b"]["status"] == "task_completed"
+
+    asyncio.run(scenario())
+
+
+def test_transitions_replace_older_entries_only():
+    async def scenario():
+        cache = _cache()
+        await cache.put(_status("a", "prompt_generated", 1000))
+        await cache.put(_status("a", "task_submitted", 2000))
+        # published late, e.g. by a slower process
+        await cache.put(_status("a", "prompt_generated", 1500))
+        assert (await cache.get_many(["a"]))["a"]["status"] == "task_submitted"
+
+    asyncio.run(scenario())
+
+
+def test_terminal_entries_outlive_the_ttl():
+    async def scenario():
+        cache = _cache(ttl=0.01)
+        await cache.put(_status("done", "task_completed", 1000))
+        await cache.put(_status("running", "task_submitted", 1000))
+        time.sleep(0.02)
+        assert list(await cache.get_many(["done", "running"])) == ["done"]
+
+    asyncio.run(scenario())
+
+
+def test_terminal_lru_is_bounded():
+    async def scenario():
+        cache = TaskStatusCache(LocalStatusCacheBackend(0.01, 100), max_size=2)
+        await cache.put(_status("a", "task_completed", 1000))
+        await cache.put(_status("b", "failed", 1000))
+        await cache.get_many(["a"])
+        await cache.put(_status("c", "task_completed", 1000))
+        time.sleep(0.02)
+        # b was the least recently used
+        assert sorted(await cache.get_many(["a", "b", "c"])) == ["a", "c"]
+
+    asyncio.run(scenario())
+
+
+def test_local_backend_is_bounded():
+    async def scenario():
+        backend = LocalStatusCacheBackend(60, 2)
+        for task_id in ("a", "b", "c"):
+            await backend.put(_status(task_id, "task_submitted", 1000))
+        assert sorted(await backend.get_many(["a", "b", "c"])) == ["b", "c"]
+
+    asyncio.run(scenario())
+
+
+def test_hit_and_miss_counters():
+    async def scenario():
+        cache = _cache()
+        await cache.put(_status("done", "task_completed", 1000))
+        await cache.put(_status("running", "task_submitted", 1000))
+        before = {
+            key: _requests(*key) for key in (("terminal", "hit"), ("backend", "hit"), ("backend", "miss"))
+        }
+        await cache.get_many(["done", "running", "unknown"])
+        assert _requests("terminal", "hit") - before["terminal", "hit"] == 1
+        assert _requests("backend", "hit") - before["backend", "hit"] == 1
+        assert _requests("backend", "miss") - before["backend", "miss"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_terminal_entries_expire_with_a_terminal_ttl():
+    async def scenario():
+        # without a shared backend, evictions by other processes are picked up on expiry
+        cache = TaskStatusCache(LocalStatusCacheBackend(0.01, 100), terminal_ttl=0.02)
+        await cache.put(_status("done", "task_completed", 1000))
+        assert list(await cache.get_many(["done"])) == ["done"]
+        time.sleep(0.03)
+        assert await cache.get_many(["done"]) == {}
+
+    asyncio.run(scenario())
+
+
+def test_refresh_replaces_a_terminal_entry_with_a_newer_one():
+    async def scenario():
+        cache = _cache(ttl=0.01)
+        await cache.put(_status("done", "task_completed", 1000))
+        evicted = {**_status("done", "task_completed", 2000), "output_video_filename": None}
+        cache.refresh(evicted)
+        cache.refresh(_status("done", "task_completed", 1500))
+        time.sleep(0.02)
+        assert (await cache.get_many(["done"]))["done"] == evicted
+
+    asyncio.run(scenario())